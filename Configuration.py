@@ -8,7 +8,10 @@ Created on Fri Nov  6 09:08:30 2020
 import os
 import yaml
 import json
-from dataclasses import dataclass, field
+import pickle
+import hashlib
+import weakref
+from dataclasses import dataclass, field, fields, MISSING
 from typing import List
 import logging.config
 
@@ -34,8 +37,141 @@ setup_logging()
 log = logging.getLogger(__name__)
 
 
+class NamedList(list):
+    """
+    A list of items that have a name, indexed by name. The index is built on
+    the first lookup and dropped whenever the list changes; an item renamed
+    since is found again on its next lookup.
+    """
+
+    __slots__ = ("_index", "_source", "__weakref__")
+
+    def __init__(self, items=()):
+        super().__init__(items)
+        self._index = None
+        # The list it was made from, see _named()
+        self._source = None
+
+    def __reduce__(self):
+        return NamedList, (list(self),)
+
+    def get(self, name, default=None):
+        """Returns the first item named <name>, or <default>"""
+        fresh = self._index is None
+        if fresh:
+            self._reindex()
+        item = self._index.get(name)
+        if item is None or item.name != name:
+            if fresh:
+                return default
+            item = self._reindex().get(name, default)
+        return item
+
+    def _reindex(self):
+        index = {}
+        for item in self:
+            index.setdefault(item.name, item)
+        self._index = index
+        return index
+
+
+def _dropping_index(method):
+    def mutator(self, *args, **kwargs):
+        self._index = None
+        return method(self, *args, **kwargs)
+
+    mutator.__name__ = method.__name__
+    return mutator
+
+
+for _name in (
+    "__setitem__",
+    "__delitem__",
+    "__iadd__",
+    "__imul__",
+    "append",
+    "extend",
+    "insert",
+    "pop",
+    "remove",
+    "clear",
+    "sort",
+    "reverse",
+):
+    setattr(NamedList, _name, _dropping_index(getattr(list, _name)))
+
+for _dumper in (yaml.Dumper, getattr(yaml, "CDumper", yaml.Dumper)):
+    yaml.add_representer(
+        NamedList, yaml.representer.SafeRepresenter.represent_list, Dumper=_dumper
+    )
+
+
+# {id(list): NamedList made from it}
+_named_lists = weakref.WeakValueDictionary()
+
+
+def _named(items):
+    """
+    Returns a NamedList of <items>. A list given to several fields (e.g.
+    Hvi.modules and Config.modules) gives them the same NamedList, as long as
+    it has not changed in between.
+    """
+    if isinstance(items, NamedList):
+        return items
+    named = _named_lists.get(id(items))
+    if (
+        named is None
+        or named._source is not items
+        or len(named) != len(items)
+        or any(a is not b for a, b in zip(named, items))
+    ):
+        named = NamedList(items)
+        named._source = items
+        _named_lists[id(items)] = named
+    return named
+
+
+class _Indexed:
+    """Keeps the fields listed in _NAMED as NamedLists"""
+
+    _NAMED = ()
+
+    def __setattr__(self, name, value):
+        if name in self._NAMED:
+            value = _named(value)
+        super().__setattr__(name, value)
+
+
+class _Slotted:
+    """State of a class made by _slotted(), as a {field: value} dict"""
+
+    __slots__ = ()
+
+    def __getstate__(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+
+
+def _slotted(cls):
+    """
+    Rebuilds dataclass <cls> with a __slots__ entry per field instead of a
+    __dict__. <cls> derives from _Slotted, so it pickles and dumps to YAML as
+    before.
+    """
+    namespace = dict(cls.__dict__)
+    names = tuple(f.name for f in fields(cls))
+    for name in names + ("__dict__", "__weakref__"):
+        namespace.pop(name, None)
+    namespace["__slots__"] = names
+    return type(cls)(cls.__name__, cls.__bases__, namespace)
+
+
+@_slotted
 @dataclass
-class QueueItem:
+class QueueItem(_Slotted):
     pulse_id: int
     trigger: bool
     start_time: float
@@ -49,24 +185,29 @@ class Queue:
     items: List[QueueItem]
 
 
+@_slotted
 @dataclass
-class Register:
+class Register(_Slotted):
     name: str = ""
     value: int = 0
 
 
 @dataclass
-class Fpga:
+class Fpga(_Indexed):
     image_file: str = ""
     vanilla_file: str = ""
     pc_registers: List[Register] = field(default_factory=list)
     hvi_registers: List[Register] = field(default_factory=list)
 
+    _NAMED = ("hvi_registers",)
+
     def get_hvi_register_value(self, name):
-        return [i.value for i in self.hvi_registers if i.name == name][0]
+        return _lookup(self.hvi_registers, name).value
 
+
+@_slotted
 @dataclass
-class SubPulseDescriptor:
+class SubPulseDescriptor(_Slotted):
     carrier: float
     width: float
     toa: float
@@ -82,7 +223,7 @@ class PulseDescriptor:
 
 
 @dataclass
-class ModuleDescriptor:
+class ModuleDescriptor(_Indexed):
     name: str
     model: str
     channels: int
@@ -91,8 +232,10 @@ class ModuleDescriptor:
     fpga: Fpga
     hvi_registers: List[Register]
 
+    _NAMED = ("hvi_registers",)
+
     def get_register_value(self, register):
-        return [i.value for i in self.hvi_registers if i.name == register][0]
+        return _lookup(self.hvi_registers, register).value
 
 
 @dataclass
@@ -100,6 +243,7 @@ class AwgDescriptor(ModuleDescriptor):
     pulseDescriptors: List[PulseDescriptor]
     queues: List[Queue] = field(default_factory=list)
     handle: int = 0
+    chassis: int = 1
 
 
 @dataclass
@@ -115,6 +259,7 @@ class DaqDescriptor:
 class DigDescriptor(ModuleDescriptor):
     daqs: List[DaqDescriptor]
     handle: int = 0
+    chassis: int = 1
 
 
 @dataclass
@@ -124,39 +269,177 @@ class HviConstant:
 
 
 @dataclass
-class Hvi:
+class Hvi(_Indexed):
     hviFile: str
     modules: List[ModuleDescriptor]
     constants: List[HviConstant] = field(default_factory=list)
     triggers: List[int] = None
 
+    _NAMED = ("modules", "constants")
+
     def get_constant(self, constant):
-        return [i.value for i in self.constants if i.name == constant][0]
+        return _lookup(self.constants, constant).value
 
 
 @dataclass
-class Config:
+class Config(_Indexed):
     modules: List[ModuleDescriptor]
     hvi: Hvi
 
+    _NAMED = ("modules",)
+
     def get_module(self, name):
-        return [i for i in self.modules if i.name == name][0]
+        return _lookup(self.modules, name)
+
+
+def _lookup(items, name):
+    item = items.get(name)
+    if item is None:
+        raise IndexError(f"No {name} in the config")
+    return item
 
 
 def loadConfig(configFile: str = "latest"):
     if configFile == "latest":
-        if os.path.exists("./config_hist"):
-            latest_hist = 0
-            for file in os.listdir("./config_hist"):
-                name = os.path.splitext(file)[0]
-                hist = int(name.split("_")[-1])
-                if hist > latest_hist:
-                    latest_hist = hist
-            configFile = "./config_hist/config_" + str(latest_hist) + ".yaml"
-        else:
-            configFile = "config_default.yaml"
+        import config_history
+
+        configFile = config_history.latest_file() or "config_default.yaml"
 
-    with open(configFile, "r") as f:
-        config = yaml.load(f, Loader=yaml.FullLoader)
+    config = _load_cache(configFile)
+    if config is None:
+        with open(configFile, "rb") as f:
+            content = f.read()
+        config = yaml.load(content, Loader=_ConfigLoader)
+        _save_cache(configFile, content, config)
     log.info("Opened: {}".format(configFile))
     return config
+
+
+# Loading
+#
+# Config files are YAML dumps of the classes above (tagged
+# !!python/object:Configuration.<class>). _ConfigLoader is a safe loader that
+# only builds those classes, checking each mapping against the class's fields.
+# The result is kept in a binary sidecar (<file>.cache), so the next load of
+# the same file skips the YAML parsing. The sidecar is used if the file's
+# mtime and size, or failing those its SHA-1, match the ones it was made from.
+
+_SCHEMA = [
+    QueueItem,
+    Queue,
+    Register,
+    Fpga,
+    SubPulseDescriptor,
+    PulseDescriptor,
+    ModuleDescriptor,
+    AwgDescriptor,
+    DaqDescriptor,
+    DigDescriptor,
+    HviConstant,
+    Hvi,
+    Config,
+]
+_CLASSES = {cls.__name__: cls for cls in _SCHEMA + [NamedList]}
+# Changes when a field is added or removed, or a class's layout changes, so
+# sidecars made before are ignored
+_SCHEMA_DIGEST = hashlib.sha1(
+    repr(
+        [
+            (
+                cls.__name__,
+                [f.name for f in fields(cls)],
+                getattr(cls, "__slots__", None),
+                getattr(cls, "_NAMED", None),
+            )
+            for cls in _SCHEMA
+        ]
+    ).encode()
+).hexdigest()
+CACHE_SUFFIX = ".cache"
+
+
+class _ConfigLoader(getattr(yaml, "CSafeLoader", yaml.SafeLoader)):
+    pass
+
+
+def _construct(loader, node, cls):
+    instance = cls.__new__(cls)
+    # Yielding first lets aliases (e.g. Hvi.modules) refer to the instance
+    yield instance
+    state = loader.construct_mapping(node, deep=True)
+    known = set(f.name for f in fields(cls))
+    unknown = set(state) - known
+    if unknown:
+        raise yaml.constructor.ConstructorError(
+            None,
+            None,
+            f"{cls.__name__} has no field {sorted(unknown)}",
+            node.start_mark,
+        )
+    for f in fields(cls):
+        if f.name in state:
+            continue
+        if f.default is not MISSING:
+            state[f.name] = f.default
+        elif f.default_factory is not MISSING:
+            state[f.name] = f.default_factory()
+        else:
+            raise yaml.constructor.ConstructorError(
+                None, None, f"{cls.__name__} needs {f.name}", node.start_mark
+            )
+    for name, value in state.items():
+        setattr(instance, name, value)
+
+
+for _cls in _SCHEMA:
+    _ConfigLoader.add_constructor(
+        f"tag:yaml.org,2002:python/object:{__name__}.{_cls.__name__}",
+        lambda loader, node, cls=_cls: _construct(loader, node, cls),
+    )
+
+
+class _CacheUnpickler(pickle.Unpickler):
+    """Only restores the classes of the schema"""
+
+    def find_class(self, module, name):
+        if module == __name__ and name in _CLASSES:
+            return _CLASSES[name]
+        raise pickle.UnpicklingError(f"{module}.{name} is not part of a Config")
+
+
+def _load_cache(configFile):
+    try:
+        stat = os.stat(configFile)
+        with open(configFile + CACHE_SUFFIX, "rb") as f:
+            schema, mtime, size, digest = _CacheUnpickler(f).load()
+            if schema != _SCHEMA_DIGEST:
+                return None
+            if (mtime, size) != (stat.st_mtime_ns, stat.st_size):
+                # Touched, but maybe not changed
+                with open(configFile, "rb") as config_file:
+                    if hashlib.sha1(config_file.read()).hexdigest() != digest:
+                        return None
+            return _CacheUnpickler(f).load()
+    except FileNotFoundError:
+        return None
+    except Exception as err:
+        log.warning(f"Ignoring cache of {configFile}: {err}")
+        return None
+
+
+def _save_cache(configFile, content, config):
+    stat = os.stat(configFile)
+    header = (
+        _SCHEMA_DIGEST,
+        stat.st_mtime_ns,
+        stat.st_size,
+        hashlib.sha1(content).hexdigest(),
+    )
+    cacheFile = configFile + CACHE_SUFFIX
+    try:
+        with open(cacheFile + ".tmp", "wb") as f:
+            pickle.dump(header, f, pickle.HIGHEST_PROTOCOL)
+            pickle.dump(config, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(cacheFile + ".tmp", cacheFile)
+    except OSError as err:
+        log.warning(f"Cannot save cache of {configFile}: {err}")
@@ -1,105 +1,213 @@
 import time
+import queue
 import logging
+import threading
+
+import numpy as np
+
 import hvi_wrap as hvi
+import completion
+import k7z_index
+import averager_model
+import hvi_topology
 
 log = logging.getLogger(__name__)
 
+# Ping-pong averaging: while the HVI triggers the frames of one block (the
+# NumberOfLoops triggers of an iteration) the host reads the previous block,
+# into the other of BUFFERS buffers
+BUFFERS = 2
 
-def check_status(config):
-    versionReg = config.get_module("DIG_0").handle.FPGAgetSandBoxRegister(
-        "PC_CH1_Version"
-    )
-    averagesReg = config.get_module("DIG_0").handle.FPGAgetSandBoxRegister(
-        "PC_CH1_Averages"
-    )
-    triggersReg = config.get_module("DIG_0").handle.FPGAgetSandBoxRegister(
-        "PC_CH1_Triggers"
-    )
-    durationReg = config.get_module("DIG_0").handle.FPGAgetSandBoxRegister(
-        "PC_CH1_Duration"
+
+# Sandbox registers of each channel's averager, see averager_model
+REGISTERS = [
+    "Control",
+    "Log2Averages",
+    "Samples",
+    "Prescaler",
+    "Flags",
+    "Averages",
+    "Triggers",
+    "Duration",
+    "Version",
+    "Status",
+]
+# Registers logged by check_status()
+STATUS_REGISTERS = ["Version", "Averages", "Triggers", "Duration", "Status"]
+
+# {module name: [ChannelRegisters]}, made by configure_digitizer()
+_channels = {}
+# When start() was called
+_started = None
+
+
+class ChannelRegisters:
+    """The sandbox register handles of the averager of <channel>"""
+
+    def __init__(self, handle, channel):
+        self.channel = channel
+        self.handles = {
+            name: handle.FPGAgetSandBoxRegister(f"PC_CH{channel}_{name}")
+            for name in REGISTERS
+        }
+
+    def read(self, name):
+        return self.handles[name].readRegisterInt32()
+
+    def write(self, name, value):
+        return self.handles[name].writeRegisterInt32(value)
+
+
+def averaged_daqs(module):
+    """The DAQs of <module> whose channel has an averager in its FPGA image"""
+    names = None
+    if module.fpga.image_file != "":
+        names = k7z_index.pc_registers(module.fpga.image_file)
+    # Images that cannot be read are taken to average channel 1 only
+    channels = [1] if names is None else averager_model.channels(names)
+    return [daq for daq in module.daqs if daq.channel in channels]
+
+
+def channel_registers(module):
+    """The ChannelRegisters of the averaged DAQs of <module>"""
+    registers = _channels.get(module.name)
+    if registers is None:
+        registers = [
+            ChannelRegisters(module.handle, daq.channel)
+            for daq in averaged_daqs(module)
+        ]
+        _channels[module.name] = registers
+    return registers
+
+
+def check_status(config, timeout=None, progress=None):
+    """
+    Waits until every averager of every digitizer has counted NumberOfLoops *
+    NumberOfIterations triggers, or <timeout> seconds (default: twice the
+    expected run time + 1s).
+    """
+    channels = [
+        (name, registers)
+        for name in hvi_topology.from_config(config).digitizers
+        for registers in channel_registers(config.get_module(name))
+    ]
+    if not channels:
+        log.warning("No digitizer has an averager")
+        return False
+    expected = config.hvi.get_constant("NumberOfLoops") * config.hvi.get_constant(
+        "NumberOfIterations"
     )
-    statusReg = config.get_module("DIG_0").handle.FPGAgetSandBoxRegister(
-        "PC_CH1_Status"
+    if timeout is None:
+        timeout = 2 * expected * config.hvi.get_constant("Gap") * 1e-9 + 1.0
+    complete = completion.wait_for(
+        lambda: min(registers.read("Triggers") for _, registers in channels),
+        expected,
+        timeout,
+        progress,
+        name=f"Averager triggers ({len(channels)} channels)",
     )
-    for i in range(2):
-        time.sleep(1)
-        log.info(f"Version: {versionReg.readRegisterInt32()}")
-        log.info(f"Averages: {averagesReg.readRegisterInt32()}")
-        log.info(f"Triggers: {triggersReg.readRegisterInt32()}")
-        log.info(f"Duration: {durationReg.readRegisterInt32()}")
-        log.info(f"Status: {statusReg.readRegisterInt32()}")
-    return True
+    elapsed = time.perf_counter() - (_started or time.perf_counter())
+    outputs = 0
+    for module, registers in channels:
+        values = {name: registers.read(name) for name in STATUS_REGISTERS}
+        outputs += values["Averages"]
+        log.info(
+            f"{module} CH{registers.channel} "
+            + ", ".join(f"{name}: {value}" for name, value in values.items())
+        )
+    if elapsed > 0:
+        log.info(
+            f"{outputs} averaged frames from {len(channels)} channels in "
+            f"{elapsed:.3f}s: {outputs / elapsed:.0f} frames/s"
+        )
+    return complete
 
 
 def configure_digitizer(module):
-    controlReg = module.handle.FPGAgetSandBoxRegister("PC_CH1_Control")
-    prescalerReg = module.handle.FPGAgetSandBoxRegister("PC_CH1_Prescaler")
-    samplesReg = module.handle.FPGAgetSandBoxRegister("PC_CH1_Samples")
-    flagsReg = module.handle.FPGAgetSandBoxRegister("PC_CH1_Flags")
-    averagesReg = module.handle.FPGAgetSandBoxRegister("PC_CH1_Log2Averages")
-    points_per_cycle = int(round(module.daqs[0].captureTime * module.sample_rate))
-    log.info(f"Setting averager samples to {points_per_cycle}")
-    samplesReg.writeRegisterInt32(points_per_cycle)
-    log.info(f"Enabling Averager...")
-    controlReg.writeRegisterInt32(0x2)
-    controlReg.writeRegisterInt32(0x1)
-
-    return
-
+    """Sets the frame size of every averaged DAQ of <module>, and arms them"""
+    daqs = averaged_daqs(module)
+    averaged = [daq.channel for daq in daqs]
+    raw = [daq.channel for daq in module.daqs if daq.channel not in averaged]
+    if raw:
+        log.warning(
+            f"{module.fpga.image_file} has no averager for DAQ {raw}, "
+            f"they capture every frame"
+        )
+    # Handles of a previous image are stale
+    _channels.pop(module.name, None)
+    channels = channel_registers(module)
+    for daq, registers in zip(daqs, channels):
+        points_per_cycle = int(round(daq.captureTime * module.sample_rate))
+        log.info(f"Setting CH{daq.channel} averager samples to {points_per_cycle}")
+        registers.write("Samples", points_per_cycle)
+    log.info(f"Enabling {len(channels)} averagers...")
+    # Every averager is reset before any runs, so they count the same triggers
+    for registers in channels:
+        registers.write("Control", averager_model.CONTROL_RESET)
+    for registers in channels:
+        registers.write("Control", averager_model.CONTROL_RUN)
 
 
 def configure_hvi(config):
-    hvi_module_info = []
-    for module in config.modules:
-        hvi_module_info.append(
-            hvi.ModuleDescriptor(
-                name=module.name,
-                hvi_registers=[reg.name for reg in module.hvi_registers],
-                handle=module.handle,
-                fpga=module.fpga.image_file,
-            )
-        )
+    topology = hvi_topology.from_config(config)
+    lead = topology.lead
     loop_count = config.hvi.get_constant("NumberOfLoops")
     iteration_count = config.hvi.get_constant("NumberOfIterations")
     gap = config.hvi.get_constant("Gap")
-    trigger_awgs = ["awg1_trigger", "awg2_trigger", "awg3_trigger", "awg4_trigger"]
-    trigger_daqs = ["daq1_trigger", "daq2_trigger", "daq3_trigger", "daq4_trigger"]
+    # No iterations: run until stop() is called
+    continuous = iteration_count == 0
 
     """ Defines the complete HVI environment and HVI sequence"""
     # Create the main Sequencer and assign all the resources to be used
-    hvi.define_system("FrameAverager HVI", modules=hvi_module_info)
+    hvi_topology.define_system(config, topology, "FrameAverager HVI")
+
+    # Values that can change without recompiling the HVI
+    hvi.parameter(lead, "NumberOfLoops", loop_count)
+    hvi.parameter(lead, "NumberOfIterations", iteration_count)
+    # Loop counters, counted down from the parameters
+    hvi.parameter(lead, "LoopsRemaining", 0)
+    hvi.parameter(lead, "IterationsRemaining", 0)
 
     hvi.start_sync_multi_sequence_block("Initialize", delay=30)
-    # AWG_LEAD Instructions
-    hvi.set_register("Clear Loop Counter", "AWG_LEAD", "LoopCounter", 0)
-    hvi.set_register("Clear Iteration Counter", "AWG_LEAD", "IterationCounter", 0)
+    # Lead AWG Instructions
+    hvi.set_register("Clear Loop Counter", lead, "LoopCounter", 0)
+    hvi.set_register("Clear Iteration Counter", lead, "IterationCounter", 0)
+    hvi.set_register(
+        "Set Iterations",
+        lead,
+        "IterationsRemaining",
+        1 if continuous else "NumberOfIterations",
+    )
+    hvi.set_register("Set Loops", lead, "LoopsRemaining", "NumberOfLoops")
     hvi.end_sync_multi_sequence_block()
 
     hvi.start_syncWhile_register(
         "Main Loop",
-        "AWG_LEAD",
-        "IterationCounter",
-        "LESS_THAN",
-        iteration_count,
+        lead,
+        "IterationsRemaining",
+        "GREATER_THAN",
+        0,
         delay=70,
     )
     hvi.start_syncWhile_register(
-        "Iteration Loop", "AWG_LEAD", "LoopCounter", "LESS_THAN", loop_count, delay=570
+        "Iteration Loop", lead, "LoopsRemaining", "GREATER_THAN", 0, delay=570
     )
     hvi.start_sync_multi_sequence_block("Trigger All", delay=260)
-    # AWG_LEAD Instructions
-    hvi.execute_actions("Trigger All", "AWG_LEAD", trigger_awgs)
-    hvi.incrementRegister("Increment loop counter", "AWG_LEAD", "LoopCounter")
-    hvi.delay("Wait Gap time", "AWG_LEAD", gap)
-    # DIG_0 Instructions
-    hvi.execute_actions("Trigger All", "DIG_0", trigger_daqs)
+    hvi_topology.trigger_all(topology, "Trigger All")
+    # Lead AWG Instructions
+    hvi.incrementRegister("Increment loop counter", lead, "LoopCounter")
+    hvi.addToRegister("Count down loops", lead, "LoopsRemaining", -1)
+    hvi.delay("Wait Gap time", lead, gap)
     hvi.end_sync_multi_sequence_block()
     hvi.end_syncWhile()  # Iteration Loop
 
     hvi.start_sync_multi_sequence_block("Change Frequency", delay=260)
-    hvi.set_register("Clear Loop Counter", "AWG_LEAD", "LoopCounter", 0)
-    hvi.incrementRegister("Increment Iteration counter", "AWG_LEAD", "IterationCounter")
-    hvi.delay("Wait Gap time", "AWG_LEAD", 100)
+    hvi.set_register("Clear Loop Counter", lead, "LoopCounter", 0)
+    hvi.set_register("Reload Loops", lead, "LoopsRemaining", "NumberOfLoops")
+    hvi.incrementRegister("Increment Iteration counter", lead, "IterationCounter")
+    if not continuous:
+        hvi.addToRegister("Count down iterations", lead, "IterationsRemaining", -1)
+    hvi.delay("Wait Gap time", lead, 100)
     hvi.end_sync_multi_sequence_block()
     hvi.end_syncWhile()  # Main Loop
 
@@ -108,7 +216,182 @@ def configure_hvi(config):
     return
 
 
+def ping_pong(config):
+    """Whether <config> reads the averaged frames while they are acquired"""
+    constant = config.hvi.constants.get("PingPong")
+    return constant is not None and constant.value != 0
+
+
+def stream(config, on_block=None, blocks=None):
+    """
+    Reads the averaged frames of every DAQ of every digitizer block by block,
+    each digitizer on its own thread, while the HVI acquires the next block.
+    Calls on_block(block number, frames) for each block, frames being a list
+    of int16 [frames, points], one per DAQ (only valid during the call).
+    Returns the frames of the last block, as getDigDataRaw() would.
+    blocks : blocks to read (default: NumberOfIterations, or until
+    interrupted if continuous)
+    """
+    topology = hvi_topology.from_config(config)
+    loops = config.hvi.get_constant("NumberOfLoops")
+    iterations = config.hvi.get_constant("NumberOfIterations")
+    if blocks is None:
+        blocks = iterations or None
+    block_time = loops * config.hvi.get_constant("Gap") * 1e-9
+    readers = []
+    for name in topology.digitizers:
+        module = config.get_module(name)
+        registers = {r.name: r.value for r in module.fpga.pc_registers}
+        daqs = []
+        for daq in module.daqs:
+            # Channels without an averager have 1 average: every frame
+            settings = averager_model.Settings.from_registers(registers, daq.channel)
+            if loops % settings.averages:
+                raise ValueError(
+                    f"NumberOfLoops ({loops}) is not a multiple of {name} DAQ "
+                    f"{daq.channel}'s {settings.averages} averages"
+                )
+            daqs.append(
+                (
+                    daq.channel,
+                    loops // settings.averages,
+                    int(round(daq.captureTime * module.sample_rate)),
+                )
+            )
+        readers.append(
+            PingPongReader(
+                module.handle,
+                daqs,
+                completion.hvi_counter(topology.lead, "IterationCounter"),
+                timeout=2 * block_time + 1.0,
+            )
+        )
+    last = []
+    count = 0
+    start = time.perf_counter()
+    for reader in readers:
+        reader.start(blocks)
+    try:
+        # A block is complete once every digitizer has read it
+        for read in zip(*readers):
+            frames = [daq_frames for _, frames in read for daq_frames in frames]
+            if on_block is not None:
+                on_block(read[0][0], frames)
+            last = [channel_frames.copy() for channel_frames in frames]
+            count += 1
+    except KeyboardInterrupt:
+        log.info("Streaming interrupted")
+    finally:
+        # The HVI runs on after the blocks read
+        if not iterations or count < iterations:
+            stop(config)
+        for reader in readers:
+            reader.stop()
+    elapsed = time.perf_counter() - start
+    if count:
+        frames = count * sum(len(channel_frames) for channel_frames in last)
+        nbytes = count * sum(channel_frames.nbytes for channel_frames in last)
+        log.info(
+            f"Streamed {count} blocks from {len(last)} DAQs ({frames} averaged "
+            f"frames) in {elapsed:.3f}s: {frames / elapsed:.0f} frames/s, "
+            f"{nbytes / elapsed / 1e6:.1f} MB/s"
+        )
+    return [list(channel_frames) for channel_frames in last]
+
+
+class PingPongReader:
+    """
+    Reads blocks from the DAQs of one digitizer, on a thread, into two
+    buffers in turn. <daqs> lists the (channel, frames, points) of each DAQ;
+    the DAQs are read one after the other, as they share the module's handle.
+    Block n is read once <blocks_done>() (an HVI counter) exceeds n, which
+    marks the swap. Iterating returns (block number, [frames per DAQ]); the
+    buffer of a block is refilled once the block after next is asked for.
+    """
+
+    def __init__(self, handle, daqs, blocks_done, timeout=10.0):
+        self.handle = handle
+        self.channels = [channel for channel, _, _ in daqs]
+        self.blocks_done = blocks_done
+        self.timeout = timeout
+        self.buffers = [
+            [np.zeros((frames, points), dtype=np.int16) for _, frames, points in daqs]
+            for _ in range(BUFFERS)
+        ]
+        self._free = threading.Semaphore(BUFFERS)
+        self._full = queue.Queue()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self, blocks=None):
+        """Starts reading <blocks> blocks (default: until stop())"""
+        self._thread = threading.Thread(
+            target=self._read, args=(blocks,), name="PingPongReader", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._free.release()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __iter__(self):
+        while True:
+            item = self._full.get()
+            if item is None:
+                return
+            yield item
+            self._free.release()
+
+    def _read(self, blocks):
+        block = 0
+        try:
+            while blocks is None or block < blocks:
+                self._free.acquire()
+                if self._stop.is_set():
+                    break
+                if not completion.wait_for(
+                    self.blocks_done,
+                    block + 1,
+                    self.timeout,
+                    name=f"DAQs {self.channels} block {block}",
+                    level=logging.DEBUG,
+                ):
+                    break
+                buffers = self.buffers[block % BUFFERS]
+                if not all(
+                    self._read_daq(channel, buffer, block)
+                    for channel, buffer in zip(self.channels, buffers)
+                ):
+                    break
+                self._full.put((block, buffers))
+                block += 1
+        finally:
+            self._full.put(None)
+
+    def _read_daq(self, channel, buffer, block):
+        """Reads <block> of DAQ <channel> into <buffer>, returns True if whole"""
+        data = self.handle.DAQread(channel, buffer.size, int(self.timeout * 1000))
+        if len(data) != buffer.size:
+            log.warning(
+                f"DAQ {channel} block {block}: read {len(data)} of "
+                f"{buffer.size} points"
+            )
+            return False
+        buffer.reshape(-1)[:] = data
+        return True
+
+
+def stop(config):
+    """Ends the HVI's main loop after the current iteration"""
+    lead = hvi_topology.from_config(config).lead
+    hvi.runtime_register(lead, "IterationsRemaining").write(0)
+
+
 def start():
+    global _started
+    _started = time.perf_counter()
     return hvi.start()
 
 
@@ -10,43 +10,73 @@ import os
 import sys
 import time
 import importlib
+from concurrent.futures import ThreadPoolExecutor
 
 import matplotlib.pyplot as plt
 import numpy as np
 
-sys.path.append(r"C:\Program Files (x86)\Keysight\SD1\Libraries\Python")
-import keysightSD1 as key
+from drivers import key
 
 import Configuration
+import awg_queue
+import completion
+import instrument
+import k7z_index
+import validate
 import pulses as pulseLab
 
 log = logging.getLogger(__name__)
 
-if len(sys.argv) > 1:
-    configName = sys.argv[1]
-else:
-    configName = "latest"
-log.info("Opening Config file: {})".format(configName))
+# Samples per second that a DAQ read is expected to manage at least, and the
+# time allowed on top, which set how long a read waits for its captures
+READ_SAMPLE_RATE = 10e6
+READ_MARGIN = 1.0
 
-config = Configuration.loadConfig(configName)
+# The experiment being run, and the HVI module that implements it
+config = None
+hvi = None
 
-hvi = importlib.import_module(config.hvi.hviFile, package=None)
 
-def main():
-    configureModules()
-    hvi.configure_hvi(config)
-    hvi.start()
+def load(configName="latest"):
+    """Opens config file <configName> and imports the HVI module it uses"""
+    global config, hvi
+    log.info("Opening Config file: {})".format(configName))
+    config = Configuration.loadConfig(configName)
+    hvi = importlib.import_module(config.hvi.hviFile, package=None)
+    return config
 
-    log.info("Waiting for stuff to happen...")
-    hvi.check_status(config)
-    digData = []
-    for module in config.modules:
-        if module.model == "M3102A":
-            digData.append(getDigData(module))
-            sampleRate = module.sample_rate
-    log.info("Closing down hardware...")
-    hvi.close()
-    closeModules()
+
+def main(configName="latest"):
+    load(configName)
+    # Every problem of the config, before any module is opened
+    validate.check(config)
+    try:
+        with instrument.phase("configure"):
+            configureModules()
+        with instrument.phase("configure_hvi"):
+            hvi.configure_hvi(config)
+        with instrument.phase("start"):
+            hvi.start()
+
+        digitizers = [module for module in config.modules if module.model == "M3102A"]
+        sampleRate = digitizers[-1].sample_rate
+        if hasattr(hvi, "stream") and hvi.ping_pong(config):
+            # Frames are read while they are acquired
+            with instrument.phase("stream"):
+                digData = [hvi.stream(config)]
+        else:
+            log.info("Waiting for stuff to happen...")
+            with instrument.phase("status"):
+                hvi.check_status(config)
+            with instrument.phase("readout"):
+                digData = readDigitizers(digitizers, getDigData)
+        log.info("Closing down hardware...")
+        with instrument.phase("close"):
+            hvi.close()
+            closeModules()
+    finally:
+        # Failed runs get a trace too
+        instrument.report()
     log.info("Plotting Results...")
     plotWaves(digData, sampleRate, "Captured Waveforms")
     plt.show()
@@ -67,22 +97,21 @@ def plotWaves(waves, sampleRate, title):
 
 
 def configureModules():
-    chassis = key.SD_Module.getChassisByIndex(1)
-    if chassis < 0:
-        log.error(
-            "Finding Chassis: {} {}".format(
-                chassis, key.SD_Error.getErrorMessage(chassis)
-            )
-        )
-    log.info("Chassis found: {}".format(chassis))
+    chassisList = sorted(set(module.chassis for module in config.modules))
+    log.info("Chassis used: {}".format(chassisList))
     for module in config.modules:
         if module.model == "M3202A":
-            configureAwg(chassis, module)
+            configureAwg(module.chassis, module)
         elif module.model == "M3102A":
-            configureDig(chassis, module)
+            configureDig(module.chassis, module)
 
 
 def _configureFpga(module):
+    _loadFpga(module)
+    _writeFpgaRegisters(module)
+
+
+def _loadFpga(module):
     if module.fpga.image_file != "":
         log.info(f"Loading FPGA image: {module.fpga.image_file}")
         error = module.handle.FPGAload(os.getcwd() + "\\" + module.fpga.image_file)
@@ -92,8 +121,16 @@ def _configureFpga(module):
                 f"{key.SD_Error.getErrorMessage(error)}"
             )
 
+
+def _writeFpgaRegisters(module):
     log.info(f"Writing {len(module.fpga.pc_registers)} FPGA registers...")
+    names = None
+    if module.fpga.image_file != "":
+        names = k7z_index.pc_registers(module.fpga.image_file)
     for register in module.fpga.pc_registers:
+        if names is not None and register.name not in names:
+            log.error(f"No register {register.name} in {module.fpga.image_file}")
+            continue
         log.info(f"...Writing {register.value} to {register.name}")
         sbReg = module.handle.FPGAgetSandBoxRegister(register.name)
         error = sbReg.writeRegisterInt32(register.value)
@@ -102,7 +139,7 @@ def _configureFpga(module):
 
 
 def configureAwg(chassis, module):
-    log.info(f"Configuring AWG in slot {module.slot}...")
+    log.info(f"Configuring AWG in chassis {chassis} slot {module.slot}...")
     module.handle = key.SD_AOU()
     awg = module.handle
     error = awg.openWithSlotCompatibility(
@@ -110,11 +147,20 @@ def configureAwg(chassis, module):
     )
     if error < 0:
         log.info(f"Error Opening - {error}")
+    # Whatever an earlier program left queued
+    for channel in range(1, module.channels + 1):
+        awg_queue.flush(module, channel)
     _configureFpga(module)
-    # Clear all queues and waveforms
+    setupAwg(module)
+
+
+def setupAwg(module):
+    """Clears and reloads the waveforms and queues of an open AWG"""
+    awg = module.handle
+    # Clear all waveforms; the queues are reprogrammed by enqueueWaves()
     awg.waveformFlush()
+    awg_queue.waveforms_reloaded(module)
     for channel in range(module.channels):
-        awg.AWGflush(channel + 1)
         # This is only required for channels that implement the 'vanilla'
         # ModGain block. (It does no harm to other applications that do not).
         # It assumes that the source is to be directly from the AWG, rather
@@ -156,6 +202,8 @@ def closeModules():
                     f"{key.SD_Error.getErrorMessage(error)}"
                 )
         module.handle.close()
+        if module.model == "M3202A":
+            awg_queue.forget(module.chassis, module.slot)
     log.info("Finished stopping and closing Modules")
 
 
@@ -239,34 +287,11 @@ def loadWaves(module):
 
 
 def enqueueWaves(module):
-    for queue in module.queues:
-        for item in queue.items:
-            if item.trigger:
-                trigger = key.SD_TriggerModes.SWHVITRIG
-            else:
-                trigger = key.SD_TriggerModes.AUTOTRIG
-            start_delay = item.start_time / 10e-09  # expressed in 10ns
-            start_delay = int(np.round(start_delay))
-            log.info(f"Enqueueing: {item.pulse_id} in channel {queue.channel}")
-            error = module.handle.AWGqueueWaveform(
-                queue.channel, item.pulse_id, trigger, start_delay, 1, 0
-            )
-            if error < 0:
-                log.info(f"Queueing waveform failed! - {error}")
-        log.info(f"Setting queue 'Cyclic' to {queue.cyclic}")
-        if queue.cyclic:
-            queueMode = key.SD_QueueMode.CYCLIC
-        else:
-            queueMode = key.SD_QueueMode.ONE_SHOT
-        error = module.handle.AWGqueueConfig(queue.channel, queueMode)
-        if error < 0:
-            log.error(f"Configure cyclic mode failed! - {error}")
-
-        module.handle.AWGstart(queue.channel)
+    return awg_queue.arm_queues(module)
 
 
 def configureDig(chassis, module):
-    log.info("Configuring DIG in slot {}...".format(module.slot))
+    log.info("Configuring DIG in chassis {} slot {}...".format(chassis, module.slot))
     module.handle = key.SD_AIN()
     dig = module.handle
     error = dig.openWithSlotCompatibility(
@@ -275,6 +300,12 @@ def configureDig(chassis, module):
     if error < 0:
         log.info(f"Error Opening - {error}")
     _configureFpga(module)
+    setupDig(module)
+
+
+def setupDig(module):
+    """Configures and starts the acquisitions of an open digitizer"""
+    dig = module.handle
     # Configure all channels to be DC coupled and 50 Ohm
     for channel in range(1, module.channels + 1):
         error = dig.DAQflush(channel)
@@ -315,22 +346,53 @@ def configureDig(chassis, module):
         log.info("No special configuration implemented")
 
 
-def getDigDataRaw(module):
-    TIMEOUT = 1000
-    daqData = []
-    for daq in module.daqs:
-        channelData = []
-        for capture in range(daq.captureCount):
-            pointsPerCycle = int(np.round(daq.captureTime * module.sample_rate))
-            dataRead = module.handle.DAQread(daq.channel, pointsPerCycle, TIMEOUT)
-            if len(dataRead) != pointsPerCycle:
-                log.warning(
-                    f"Slot:{module.slot} Attempted to Read {pointsPerCycle} samples, "
-                    f"actually read {len(dataRead)} samples"
-                )
-            channelData.append(dataRead)
-        daqData.append(channelData)
-    return daqData
+def readDigitizers(modules, read=None):
+    """
+    Returns <read>(module) (default: getDigDataRaw) for each digitizer of
+    <modules>. The modules are read concurrently, each through its own handle.
+    """
+    read = read or getDigDataRaw
+    if len(modules) <= 1:
+        return [read(module) for module in modules]
+    with ThreadPoolExecutor(len(modules)) as pool:
+        return list(pool.map(read, modules))
+
+
+def getDigDataRaw(module, timeout=None):
+    """
+    Reads every capture of every DAQ in <module>, one DAQ after the other as
+    they share the module's handle, waiting up to <timeout> seconds for each
+    DAQ to hold all of its captures (default: READ_MARGIN plus the time to
+    read them at READ_SAMPLE_RATE).
+    """
+    return [_readDaq(module, daq, timeout) for daq in module.daqs]
+
+
+def _readDaq(module, daq, timeout=None):
+    """Returns the captures of DAQ <daq> of <module>"""
+    channelData = []
+    pointsPerCycle = int(np.round(daq.captureTime * module.sample_rate))
+    if timeout is None:
+        timeout = READ_MARGIN + pointsPerCycle * daq.captureCount / READ_SAMPLE_RATE
+    start = time.perf_counter()
+    completion.wait_for(
+        completion.daq_counter(module.handle, daq.channel, pointsPerCycle),
+        daq.captureCount,
+        timeout,
+        name=f"Slot:{module.slot} DAQ {daq.channel} captures",
+    )
+    for capture in range(daq.captureCount):
+        remaining = timeout - (time.perf_counter() - start)
+        dataRead = module.handle.DAQread(
+            daq.channel, pointsPerCycle, max(int(remaining * 1000), 1)
+        )
+        if len(dataRead) != pointsPerCycle:
+            log.warning(
+                f"Slot:{module.slot} Attempted to Read {pointsPerCycle} samples, "
+                f"actually read {len(dataRead)} samples"
+            )
+        channelData.append(dataRead)
+    return channelData
 
 
 def getDigData(module):
@@ -350,4 +412,7 @@ def interweavePulses(pulses):
 
 
 if __name__ == "__main__":
-    main()
+    if len(sys.argv) > 1:
+        main(sys.argv[1])
+    else:
+        main()
@@ -1,9 +1,7 @@
 import time
 import logging
-import sys
 
-sys.path.append(r"C:\Program Files (x86)\Keysight\SD1\Libraries\Python")
-import keysightSD1 as key
+from drivers import key
 
 import hvi_wrap as hvi
 
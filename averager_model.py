@@ -0,0 +1,171 @@
+"""
+Software model of the frame averager of the Averager.k7z digitizer image.
+
+For each channel n the image has these sandbox registers:
+
+    PC_CH<n>_Control      CONTROL_RESET clears the accumulator and counters,
+                          CONTROL_RUN averages the frames triggered
+    PC_CH<n>_Samples      samples per frame, after the prescaler
+    PC_CH<n>_Log2Averages frames averaged per output frame, as a power of 2
+    PC_CH<n>_Prescaler    keeps one ADC sample out of Prescaler + 1
+    PC_CH<n>_Triggers     (read) frames triggered since the reset
+    PC_CH<n>_Averages     (read) frames output since the reset
+    PC_CH<n>_Status       (read) STATUS_RUNNING, STATUS_PARTIAL
+
+(Flags, Duration and Version are not modelled.) Images need not average every
+channel, see channels().
+
+Each trigger captures a frame of Samples samples, added sample by sample into
+an ACCUMULATOR_BITS two's complement accumulator (which wraps, it does not
+saturate). After 2^Log2Averages frames the accumulator is shifted right by
+Log2Averages (rounding down), its low SAMPLE_BITS are output as a frame of the
+DAQ, and it is cleared.
+
+The model works on whole arrays of frames, so long runs can be replayed
+offline and checked against what the digitizer returned:
+
+    averager = Averager(Settings(samples=75000, log2_averages=4))
+    outputs = averager.push(frames)    # int16 [frames // 16, 75000]
+"""
+
+import re
+from dataclasses import dataclass
+
+import numpy as np
+
+ACCUMULATOR_BITS = 32
+SAMPLE_BITS = 16
+# Sums in this type wrap as the accumulator does
+_ACCUMULATOR = np.int32
+# Above this the accumulator can wrap
+MAX_LOG2_AVERAGES = ACCUMULATOR_BITS - SAMPLE_BITS
+CONTROL_RUN = 0x1
+CONTROL_RESET = 0x2
+STATUS_RUNNING = 0x1
+# Frames are accumulated that are not averaged yet
+STATUS_PARTIAL = 0x2
+
+_LOG2_AVERAGES = re.compile(r"PC_CH(\d+)_Log2Averages$")
+
+
+@dataclass
+class Settings:
+    samples: int
+    log2_averages: int = 0
+    prescaler: int = 0
+
+    @classmethod
+    def from_registers(cls, registers, channel=1):
+        """Settings of <channel>, from {register name: value}"""
+        prefix = f"PC_CH{channel}_"
+        return cls(
+            registers.get(prefix + "Samples", 0),
+            registers.get(prefix + "Log2Averages", 0),
+            registers.get(prefix + "Prescaler", 0),
+        )
+
+    @property
+    def averages(self):
+        return 1 << self.log2_averages
+
+    def raw_samples(self):
+        """ADC samples spanned by a frame"""
+        return self.samples * (self.prescaler + 1)
+
+    def frame_rate(self, sample_rate=500e6):
+        """Highest trigger rate (frames/s), with no dead time between frames"""
+        return sample_rate / self.raw_samples()
+
+    def output_rate(self, sample_rate=500e6):
+        """Output frames/s at the highest trigger rate"""
+        return self.frame_rate(sample_rate) / self.averages
+
+    def output_bandwidth(self, sample_rate=500e6):
+        """Bytes/s read out at the highest trigger rate"""
+        return self.output_rate(sample_rate) * self.samples * SAMPLE_BITS // 8
+
+
+class Averager:
+    """
+    The averager of one channel: its accumulator and counters, between two
+    resets
+    """
+
+    def __init__(self, settings):
+        self.settings = settings
+        self.reset()
+
+    def reset(self):
+        self.accumulator = np.zeros(self.settings.samples, dtype=_ACCUMULATOR)
+        # Frames in the accumulator
+        self.pending = 0
+        self.triggers = 0
+        self.outputs = 0
+
+    @property
+    def status(self):
+        return STATUS_RUNNING | (STATUS_PARTIAL if self.pending else 0)
+
+    def push(self, frames):
+        """
+        Averages <frames> (int16 [frames, ADC samples]: at least
+        Settings.raw_samples() each), returns the frames output
+        (int16 [outputs, samples])
+        """
+        frames = prescale(frames, self.settings)
+        averages = self.settings.averages
+        self.triggers += len(frames)
+        # Completes the frame in the accumulator first
+        first = min(averages - self.pending, len(frames))
+        head = self.accumulator + frames[:first].sum(axis=0, dtype=_ACCUMULATOR)
+        if self.pending + first < averages:
+            self.accumulator = head
+            self.pending += first
+            return np.zeros((0, self.settings.samples), dtype=np.int16)
+        rest = frames[first:]
+        whole = len(rest) // averages * averages
+        groups = rest[:whole].reshape(-1, averages, self.settings.samples)
+        sums = np.concatenate(
+            [head[np.newaxis], groups.sum(axis=1, dtype=_ACCUMULATOR)], axis=0
+        )
+        self.accumulator = rest[whole:].sum(axis=0, dtype=_ACCUMULATOR)
+        self.pending = len(rest) - whole
+        self.outputs += len(sums)
+        return output(sums, self.settings)
+
+
+def channels(register_names):
+    """The channels an image with registers <register_names> averages, sorted"""
+    found = (_LOG2_AVERAGES.match(name) for name in register_names)
+    return sorted(int(match.group(1)) for match in found if match is not None)
+
+
+def prescale(frames, settings):
+    """
+    Returns the samples of <frames> (int16 [frames, ADC samples]) the
+    averager keeps, as int16 [frames, samples]
+    """
+    frames = np.atleast_2d(np.asarray(frames, dtype=np.int16))
+    kept = frames[:, :: settings.prescaler + 1][:, : settings.samples]
+    if kept.shape[1] < settings.samples:
+        raise ValueError(
+            f"Frames of {frames.shape[1]} samples are shorter than "
+            f"{settings.raw_samples()}"
+        )
+    return kept
+
+
+def output(sums, settings):
+    """Returns the frames output for accumulated <sums> ([frames, samples])"""
+    # Integer casts wrap in two's complement, as the accumulator and the
+    # output do
+    accumulated = np.asarray(sums).astype(_ACCUMULATOR, copy=False)
+    return (accumulated >> settings.log2_averages).astype(np.int16)
+
+
+def average(frames, settings):
+    """
+    Returns the frames a freshly reset averager outputs for <frames>
+    (int16 [frames, ADC samples]), as int16 [outputs, samples]
+    """
+    return Averager(settings).push(frames)
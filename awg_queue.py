@@ -0,0 +1,192 @@
+"""
+Compiles AWG queue descriptions (Configuration.Queue) into the list of driver
+calls needed to program them, and keeps track of what is currently armed in
+each channel so that an unchanged queue can be restarted without a flush.
+"""
+
+import time
+import logging
+from dataclasses import dataclass
+from typing import Dict, Set, Tuple
+
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+# Queue start delays are expressed in units of 10ns, held in 16 bits.
+START_DELAY_UNIT = 10e-09
+MAX_START_DELAY = 2 ** 16 - 1
+# 0 cycles means 'repeat forever'
+MAX_CYCLES = 2 ** 16 - 1
+# Compiled tables kept for reuse; the oldest are dropped beyond this
+MAX_COMPILED = 1024
+
+
+@dataclass(frozen=True)
+class CompiledQueue:
+    """Precomputed driver calls for one AWG channel queue."""
+
+    channel: int
+    mode: int
+    # Arguments to AWGqueueWaveform:
+    #   (channel, waveform id, trigger mode, start delay, cycles, prescaler)
+    calls: Tuple[Tuple[int, int, int, int, int, int], ...]
+
+
+# Compiled queue tables, keyed on the queue contents.
+_compiled: Dict[tuple, CompiledQueue] = {}
+# Table currently programmed into each (chassis, slot, channel).
+_armed: Dict[Tuple[int, int, int], CompiledQueue] = {}
+# (chassis, slot) of the AWGs whose waveforms were reloaded after their queues
+# were programmed: the queues still refer to the old waveforms.
+_reloaded: Set[Tuple[int, int]] = set()
+
+
+def _drivers():
+    # Only compiling needs the driver's constants, not validate_queue()
+    from drivers import key
+
+    return key
+
+
+def _queue_key(queue):
+    return (
+        queue.channel,
+        queue.cyclic,
+        tuple(
+            (item.pulse_id, item.trigger, item.start_time, item.cycles)
+            for item in queue.items
+        ),
+    )
+
+
+def validate_queue(queue, resident_ids=None, channels=None):
+    """
+    Returns a list of problems found in <queue>. An empty list means the
+    queue can be compiled.
+
+    resident_ids : waveform IDs that are (or will be) loaded in the module.
+    channels : number of channels in the module.
+    """
+    problems = []
+    if channels is not None and not 1 <= queue.channel <= channels:
+        problems.append(f"Channel {queue.channel} does not exist")
+    if len(queue.items) == 0:
+        problems.append(f"Channel {queue.channel}: queue is empty")
+    for index, item in enumerate(queue.items):
+        where = f"Channel {queue.channel}, item {index}"
+        if resident_ids is not None and item.pulse_id not in resident_ids:
+            problems.append(f"{where}: waveform ID {item.pulse_id} is not loaded")
+        start_delay = int(np.round(item.start_time / START_DELAY_UNIT))
+        if not 0 <= start_delay <= MAX_START_DELAY:
+            problems.append(
+                f"{where}: start time {item.start_time} is outside 0 to "
+                f"{MAX_START_DELAY * START_DELAY_UNIT}"
+            )
+        if not 0 <= item.cycles <= MAX_CYCLES:
+            problems.append(f"{where}: cycles {item.cycles} is outside 0 to {MAX_CYCLES}")
+    return problems
+
+
+def compile_queue(queue, resident_ids=None, channels=None):
+    """
+    Validates <queue> and returns its CompiledQueue. Compiled tables are cached,
+    so compiling an identical queue again returns the same object.
+    Raises ValueError listing every problem found.
+    """
+    problems = validate_queue(queue, resident_ids, channels)
+    if problems:
+        raise ValueError("Invalid queue:\n" + "\n".join(problems))
+
+    queue_key = _queue_key(queue)
+    compiled = _compiled.get(queue_key)
+    if compiled is not None:
+        return compiled
+
+    key = _drivers()
+    calls = []
+    for item in queue.items:
+        if item.trigger:
+            trigger = key.SD_TriggerModes.SWHVITRIG
+        else:
+            trigger = key.SD_TriggerModes.AUTOTRIG
+        start_delay = int(np.round(item.start_time / START_DELAY_UNIT))
+        calls.append((queue.channel, item.pulse_id, trigger, start_delay, item.cycles, 0))
+    if queue.cyclic:
+        mode = key.SD_QueueMode.CYCLIC
+    else:
+        mode = key.SD_QueueMode.ONE_SHOT
+    compiled = CompiledQueue(queue.channel, mode, tuple(calls))
+    if len(_compiled) >= MAX_COMPILED:
+        del _compiled[next(iter(_compiled))]
+    _compiled[queue_key] = compiled
+    return compiled
+
+
+def program_queue(module, compiled):
+    """Writes <compiled> into the (empty) queue of its channel and starts it"""
+    handle = module.handle
+    for call in compiled.calls:
+        error = handle.AWGqueueWaveform(*call)
+        if error < 0:
+            log.info(f"Queueing waveform failed! - {error}")
+    error = handle.AWGqueueConfig(compiled.channel, compiled.mode)
+    if error < 0:
+        log.error(f"Configure cyclic mode failed! - {error}")
+    handle.AWGstart(compiled.channel)
+    _armed[(module.chassis, module.slot, compiled.channel)] = compiled
+
+
+def flush(module, channel):
+    """Flushes <channel> of AWG <module> and forgets what was armed in it"""
+    _armed.pop((module.chassis, module.slot, channel), None)
+    return module.handle.AWGflush(channel)
+
+
+def waveforms_reloaded(module):
+    """
+    Records that the waveforms of AWG <module> were flushed and loaded again,
+    so its queues are reprogrammed the next time they are armed.
+    """
+    _reloaded.add((module.chassis, module.slot))
+
+
+def forget(chassis, slot):
+    """Forgets what was armed in the AWG in <chassis> <slot>, once it is closed"""
+    for place in [place for place in _armed if place[:2] == (chassis, slot)]:
+        del _armed[place]
+    _reloaded.discard((chassis, slot))
+
+
+def arm_queues(module):
+    """
+    Programs every queue of AWG <module>. Channels that already hold an
+    identical table (of the same waveforms) are only restarted, otherwise the
+    channel is flushed (if needed) and reprogrammed.
+
+    Returns the time taken to program each channel, in seconds.
+    """
+    resident_ids = {pulse.id for pulse in module.pulseDescriptors}
+    reloaded = (module.chassis, module.slot) in _reloaded
+    _reloaded.discard((module.chassis, module.slot))
+    timings = {}
+    for queue in module.queues:
+        start = time.perf_counter()
+        compiled = compile_queue(queue, resident_ids, module.channels)
+        armed = _armed.get((module.chassis, module.slot, queue.channel))
+        if armed == compiled and not reloaded:
+            module.handle.AWGstop(queue.channel)
+            module.handle.AWGstart(queue.channel)
+            action = "Re-armed"
+        else:
+            if armed is not None:
+                flush(module, queue.channel)
+            program_queue(module, compiled)
+            action = "Programmed"
+        timings[queue.channel] = time.perf_counter() - start
+        log.info(
+            f"{action} {len(compiled.calls)} queue entries in channel "
+            f"{queue.channel} (cyclic: {queue.cyclic}) in "
+            f"{timings[queue.channel] * 1e3:.3f} ms"
+        )
+    return timings
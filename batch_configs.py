@@ -0,0 +1,215 @@
+"""
+Generates a family of configs from a template config and a grid of parameters.
+
+Each combination of the grid's values is applied to a copy of the template,
+checked (see validate.validate(), without the HVI timing) and dumped in a pool
+of processes, then all of them are added to the config history in one
+transaction:
+
+    grid = Grid(loops=[1, 5, 10], gaps=[100e-6, 200e-6])
+    for variant, entry in generate(loadConfig("latest"), grid):
+        ...
+
+or from the command line, from the latest config:
+
+    python batch_configs.py latest --loops 1 5 10 --frequencies 10e6,30e6,50e6,70e6
+
+Parameters left out of the grid keep the template's values.
+"""
+
+import os
+import re
+import sys
+import time
+import pickle
+import logging
+import argparse
+import itertools
+from typing import List
+from dataclasses import dataclass, fields
+from concurrent.futures import ProcessPoolExecutor
+
+import validate
+import lo_encoding
+import averager_model
+import config_history
+import Configuration
+
+log = logging.getLogger(__name__)
+
+# PC_CH<n>_PhaseInc<k>A/B and HVI_CH<n>_PhaseInc0A/B, see lo_registers
+_PHASE_INC = re.compile(r"(?:PC|HVI)_CH\d+_PhaseInc(\d+)([AB])$")
+
+
+@dataclass
+class Grid:
+    # LO frequencies (Hz): a list of the frequency of each LO, per variant
+    frequencies: List[List[float]] = None
+    loops: List[int] = None
+    iterations: List[int] = None
+    # Width (s) of every sub-pulse
+    widths: List[float] = None
+    # Gap (s) between triggers
+    gaps: List[float] = None
+
+    def variants(self):
+        """Yields {parameter: value} for each combination of the grid's values"""
+        axes = [(f.name, getattr(self, f.name)) for f in fields(self)]
+        axes = [(name, values) for name, values in axes if values is not None]
+        names = [name for name, _ in axes]
+        for values in itertools.product(*(values for _, values in axes)):
+            yield dict(zip(names, values))
+
+
+def apply(config, variant):
+    """Sets the parameters of <variant> (see Grid.variants()) in <config>"""
+    hvi = config.hvi
+    if "frequencies" in variant:
+        _set_frequencies(config, variant["frequencies"])
+    if "loops" in variant:
+        _set_constant(hvi, "NumberOfLoops", variant["loops"])
+    if "iterations" in variant:
+        _set_constant(hvi, "NumberOfIterations", variant["iterations"])
+    if "loops" in variant or "iterations" in variant:
+        triggers = hvi.get_constant("NumberOfLoops") * hvi.get_constant(
+            "NumberOfIterations"
+        )
+        for module in config.modules:
+            registers = {r.name: r.value for r in module.fpga.pc_registers}
+            for daq in getattr(module, "daqs", []):
+                # One capture per trigger, or per 2^Log2Averages triggers on
+                # an averager, as hvi_timing.check() counts them
+                settings = averager_model.Settings.from_registers(
+                    registers, daq.channel
+                )
+                daq.captureCount = triggers // settings.averages
+    if "widths" in variant:
+        for module in config.modules:
+            for descriptor in getattr(module, "pulseDescriptors", []):
+                for pulse in descriptor.pulses:
+                    pulse.width = variant["widths"]
+    if "gaps" in variant:
+        _set_constant(hvi, "Gap", int(round(variant["gaps"] / 1e-9)))
+    return config
+
+
+def _set_constant(hvi, name, value):
+    constant = hvi.constants.get(name)
+    if constant is None:
+        raise IndexError(f"No {name} in the config")
+    constant.value = value
+
+
+def _set_frequencies(config, frequencies):
+    """
+    Sets the phase increment registers of each LO, and the HVI's iterator, at
+    each module's sample rate. Raises ValueError if an LO has no frequency.
+    """
+    for module in config.modules:
+        a, b = lo_encoding.encode_frequency(frequencies, module.sample_rate)
+        words = {"A": a.tolist(), "B": b.tolist()}
+        for register in module.fpga.pc_registers + module.fpga.hvi_registers:
+            match = _PHASE_INC.match(register.name)
+            if match is None:
+                continue
+            lo = int(match.group(1))
+            if lo >= len(frequencies):
+                raise ValueError(
+                    f"{module.name}: {register.name} needs LO {lo}, only "
+                    f"{len(frequencies)} frequencies are given"
+                )
+            register.value = words[match.group(2)][lo]
+        for register in module.hvi_registers:
+            if register.name == "FrequencyIterator":
+                register.value = words["A"][0]
+
+
+def generate(template, grid, workers=None):
+    """
+    Saves a config per variant of <grid> applied to Config <template>, returns
+    [(variant, Entry)] of those saved. Variants with problems are logged and
+    left out. <workers> : processes to use (default: one per CPU, 1 to
+    generate them in this process).
+    """
+    start = time.perf_counter()
+    variants = list(grid.variants())
+    workers = workers or os.cpu_count()
+    if workers == 1:
+        _start_worker(pickle.dumps(template, pickle.HIGHEST_PROTOCOL))
+        results = list(map(_generate, variants))
+    else:
+        with ProcessPoolExecutor(
+            workers,
+            initializer=_start_worker,
+            initargs=(pickle.dumps(template, pickle.HIGHEST_PROTOCOL),),
+        ) as pool:
+            chunk = max(1, len(variants) // (4 * workers))
+            results = list(pool.map(_generate, variants, chunksize=chunk))
+    generated = time.perf_counter() - start
+
+    saved = []
+    for variant, (dumped, problems) in zip(variants, results):
+        if problems:
+            log.warning(f"Skipping {variant}: " + "; ".join(problems))
+        else:
+            saved.append((variant, dumped))
+    with config_history.ConfigHistory() as history:
+        entries = history.save_dumped([dumped for _, dumped in saved])
+    elapsed = time.perf_counter() - start
+    log.info(
+        f"Generated {len(variants)} configs in {generated:.2f}s, saved "
+        f"{len(entries)} in {elapsed:.2f}s ({len(variants) / elapsed:.0f} configs/s)"
+    )
+    return [(variant, entry) for (variant, _), entry in zip(saved, entries)]
+
+
+# The template, in each worker process
+_template = None
+
+
+def _start_worker(template):
+    global _template
+    _template = template
+
+
+def _generate(variant):
+    """Returns the dumped config of <variant>, and its problems"""
+    # Unpickling copies the template faster than deepcopy
+    try:
+        config = apply(pickle.loads(_template), variant)
+    except (IndexError, ValueError) as err:
+        return None, [str(err)]
+    problems = validate.validate(config, timing=False)
+    return (None if problems else config_history.dump(config)), problems
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("template", nargs="?", default="latest")
+    parser.add_argument(
+        "--frequencies",
+        nargs="+",
+        metavar="F0,F1,...",
+        type=lambda text: [float(f) for f in text.split(",")],
+    )
+    parser.add_argument("--loops", nargs="+", type=int)
+    parser.add_argument("--iterations", nargs="+", type=int)
+    parser.add_argument("--widths", nargs="+", type=float)
+    parser.add_argument("--gaps", nargs="+", type=float)
+    parser.add_argument("--workers", type=int)
+    arguments = parser.parse_args(argv)
+    grid = Grid(
+        arguments.frequencies,
+        arguments.loops,
+        arguments.iterations,
+        arguments.widths,
+        arguments.gaps,
+    )
+    template = Configuration.loadConfig(arguments.template)
+    entries = generate(template, grid, arguments.workers)
+    if entries:
+        log.info(f"Configs {entries[0][1].number} to {entries[-1][1].number}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,76 @@
+"""
+Measures how many frames per second the averager model processes, against
+accumulating them one frame at a time, and lists the averager's capacity
+(highest trigger and output rates, readout bandwidth) for a few settings. No
+hardware or driver is needed.
+
+    python benchmarks/bench_averager_model.py
+"""
+
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import averager_model
+from averager_model import Settings
+
+SAMPLES = [1000, 10000, 75000]
+FRAMES = 256
+LOG2_AVERAGES = 4
+SAMPLE_RATE = 500e6
+
+
+def frame_by_frame(frames, settings):
+    """Accumulates each frame in turn, as the FPGA does"""
+    outputs = []
+    accumulator = np.zeros(settings.samples, dtype=np.int64)
+    for index, frame in enumerate(frames, 1):
+        accumulator += frame[:: settings.prescaler + 1][: settings.samples]
+        if index % settings.averages == 0:
+            outputs.append(averager_model.output(accumulator[np.newaxis], settings)[0])
+            accumulator[:] = 0
+    return np.array(outputs, dtype=np.int16)
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    rng = np.random.default_rng(0)
+    print(f"{'Samples':>8}{'frame by frame/s':>18}{'model/s':>10}{'model MS/s':>12}")
+    for samples in SAMPLES:
+        settings = Settings(samples, LOG2_AVERAGES)
+        frames = rng.integers(-2048, 2048, (FRAMES, samples), dtype=np.int16)
+        reference, reference_time = timed(frame_by_frame, frames, settings)
+        modelled, model_time = timed(averager_model.average, frames, settings)
+        assert np.array_equal(reference, modelled)
+        print(
+            f"{samples:>8}{FRAMES / reference_time:>18.0f}"
+            f"{FRAMES / model_time:>10.0f}"
+            f"{FRAMES * samples / model_time / 1e6:>12.0f}"
+        )
+
+    print(
+        f"\n{'Samples':>8}{'Log2':>6}{'Prescaler':>11}"
+        f"{'triggers/s':>12}{'outputs/s':>11}{'MB/s':>8}"
+    )
+    for samples in SAMPLES:
+        for log2_averages, prescaler in [(0, 0), (4, 0), (10, 4)]:
+            settings = Settings(samples, log2_averages, prescaler)
+            print(
+                f"{samples:>8}{log2_averages:>6}{prescaler:>11}"
+                f"{settings.frame_rate(SAMPLE_RATE):>12.0f}"
+                f"{settings.output_rate(SAMPLE_RATE):>11.1f}"
+                f"{settings.output_bandwidth(SAMPLE_RATE) / 1e6:>8.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+Measures register lookups, memory and load time of configs holding tens of
+thousands of registers. No hardware or driver is needed.
+
+    python benchmarks/bench_config_model.py
+
+Lookups by name should take the same time whatever the number of registers
+(once the first one has built the index), where the list scans they replace
+grow with it.
+"""
+
+import os
+import sys
+import time
+import random
+import logging
+import tempfile
+import tracemalloc
+from dataclasses import dataclass
+
+import yaml
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import Configuration
+from Configuration import Config, AwgDescriptor, Hvi, HviConstant, Fpga, Register
+
+SIZES = [1000, 10000, 50000]
+LOOKUPS = 1000
+
+
+@dataclass
+class DictRegister:
+    """Register as it was, with a __dict__"""
+
+    name: str = ""
+    value: int = 0
+
+
+def make_config(registers):
+    """An AWG with <registers> HVI registers and as many FPGA registers"""
+    fpga = Fpga(
+        "",
+        "",
+        [],
+        [Register(f"HVI_Register{index}", index) for index in range(registers)],
+    )
+    module = AwgDescriptor(
+        "AWG_LEAD",
+        "M3202A",
+        4,
+        1e9,
+        2,
+        fpga,
+        [Register(f"Register{index}", index) for index in range(registers)],
+        [],
+    )
+    return Config([module], Hvi("hvi_quad_lo", [module], [HviConstant("Gap", 0)]))
+
+
+def scan(registers, name):
+    """The lookup before indexing"""
+    return [i.value for i in registers if i.name == name][0]
+
+
+def per_lookup(function, names):
+    start = time.perf_counter()
+    for name in names:
+        function(name)
+    return (time.perf_counter() - start) / len(names)
+
+
+def allocated(cls, count):
+    """Bytes allocated per instance of <cls>"""
+    tracemalloc.start()
+    instances = [cls(f"Register{index}", index) for index in range(count)]
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del instances
+    return size / count
+
+
+def load_time(config):
+    """Seconds to load <config> from YAML, and from the cache"""
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "config.yaml")
+        with open(path, "w") as f:
+            yaml.dump(config, f, Dumper=getattr(yaml, "CDumper", yaml.Dumper))
+        times = []
+        for _ in range(2):
+            start = time.perf_counter()
+            Configuration.loadConfig(path)
+            times.append(time.perf_counter() - start)
+    return times
+
+
+def main():
+    # Configuration sets up INFO logging when imported
+    logging.getLogger().setLevel(logging.WARNING)
+    print(
+        f"{'Registers':>10}{'scan us':>10}{'index us':>10}"
+        f"{'B/reg':>8}{'B/reg dict':>12}{'YAML ms':>10}{'cache ms':>10}"
+    )
+    for size in SIZES:
+        config = make_config(size)
+        module = config.get_module("AWG_LEAD")
+        names = [f"Register{random.randrange(size)}" for _ in range(LOOKUPS)]
+        scanned = per_lookup(lambda name: scan(module.hvi_registers, name), names)
+        # The first lookup builds the index
+        module.get_register_value(names[0])
+        indexed = per_lookup(module.get_register_value, names)
+        parse, cached = load_time(config)
+        print(
+            f"{2 * size:>10}{scanned * 1e6:>10.1f}{indexed * 1e6:>10.2f}"
+            f"{allocated(Register, size):>8.0f}"
+            f"{allocated(DictRegister, size):>12.0f}"
+            f"{parse * 1e3:>10.0f}{cached * 1e3:>10.0f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Measures how long hvi_wrap takes to build large HVI sequences, and to lower
+them into keysight_hvi objects, using the simulated backend with zero latency.
+
+    python benchmarks/bench_hvi_build.py
+
+Build and lowering time per statement should stay flat as the sequence grows.
+"""
+
+import os
+import sys
+import time
+import logging
+
+os.environ.setdefault("HVI_SIMULATE", "1")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import simulated_sd1
+import hvi_wrap as hvi
+from drivers import key
+
+SIZES = [1000, 2000, 5000, 10000]
+
+
+def build_instructions(module, size):
+    """One block holding <size> register writes in one module"""
+    hvi.define_system("Benchmark", modules=[module])
+    hvi.start_sync_multi_sequence_block("Block", delay=30)
+    for step in range(size):
+        hvi.set_register("Set step", module.name, "Step", step)
+    hvi.end_sync_multi_sequence_block()
+
+
+def build_blocks(module, size):
+    """<size> / 2 trigger blocks, each holding two instructions"""
+    hvi.define_system("Benchmark", modules=[module])
+    for step in range(size // 2):
+        hvi.start_sync_multi_sequence_block("Trigger", delay=260)
+        hvi.execute_actions("Trigger", module.name, ["awg1_trigger"])
+        hvi.incrementRegister("Increment step", module.name, "Step")
+        hvi.end_sync_multi_sequence_block()
+
+
+def main():
+    logging.basicConfig(level=logging.WARNING)
+    simulated_sd1.configure(time_scale=0)
+    module = hvi.ModuleDescriptor("AWG_0", hvi_registers=["Step"])
+    module.handle = key.SD_AOU()
+    module.handle.openWithOptions("M3202A", 1, 2, "simulate=true")
+
+    print(
+        f"{'Build':<14}{'Statements':>12}{'Build ms':>10}{'us/statement':>14}"
+        f"{'Lower ms':>10}{'us/statement':>14}"
+    )
+    for build in (build_instructions, build_blocks):
+        for size in SIZES:
+            start = time.perf_counter()
+            build(module, size)
+            built = time.perf_counter()
+            hvi.lower(hvi.program)
+            lowered = time.perf_counter()
+            print(
+                f"{build.__name__[6:]:<14}{size:>12}{(built - start) * 1e3:>10.1f}"
+                f"{(built - start) / size * 1e6:>14.2f}"
+                f"{(lowered - built) * 1e3:>10.1f}"
+                f"{(lowered - built) / size * 1e6:>14.2f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Compares declaring every action, event and FPGA sandbox of each module with
+declaring only those a sequence uses (lazy declaration), using the simulated
+keysight_hvi backend with its default latencies.
+
+    python benchmarks/bench_hvi_declare.py
+
+The sequence triggers two AWGs and a digitizer in a loop, as QuadLO does,
+without touching any FPGA registers.
+"""
+
+import os
+import sys
+import time
+import logging
+
+os.environ.setdefault("HVI_SIMULATE", "1")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import simulated_sd1
+import hvi_wrap as hvi
+from drivers import key
+
+REPEATS = 3
+
+
+def build(modules, lazy):
+    hvi.define_system("Benchmark", modules=modules, lazy=lazy)
+    hvi.start_syncWhile_register("Loop", "AWG_0", "Count", "LESS_THAN", 10)
+    hvi.start_sync_multi_sequence_block("Trigger", delay=260)
+    hvi.execute_actions("Trigger", "AWG_0", ["awg1_trigger", "awg2_trigger"])
+    hvi.incrementRegister("Increment", "AWG_0", "Count")
+    hvi.execute_actions("Trigger", "AWG_1", ["awg1_trigger", "awg2_trigger"])
+    hvi.execute_actions("Trigger", "DIG_0", ["daq1_trigger"])
+    hvi.end_sync_multi_sequence_block()
+    hvi.end_syncWhile()
+
+
+def main():
+    logging.basicConfig(level=logging.WARNING)
+    modules = []
+    for slot, (name, driver) in enumerate(
+        [("AWG_0", key.SD_AOU), ("AWG_1", key.SD_AOU), ("DIG_0", key.SD_AIN)]
+    ):
+        module = hvi.ModuleDescriptor(
+            name, hvi_registers=["Count"], fpga="FPGA/QuadLoCh1_4_01_20.k7z"
+        )
+        module.handle = driver()
+        module.handle.openWithSlotCompatibility("", 1, slot + 2, 0)
+        modules.append(module)
+
+    print(f"{'Declaration':<14}{'Define ms':>11}{'Compile ms':>12}")
+    for lazy in (False, True):
+        define = compile_time = 0
+        for _ in range(REPEATS):
+            build(modules, lazy)
+            start = time.perf_counter()
+            hvi.lower(hvi.program)
+            defined = time.perf_counter()
+            hvi.sequencer.compile()
+            compiled = time.perf_counter()
+            define += defined - start
+            compile_time += compiled - defined
+        print(
+            f"{'lazy' if lazy else 'everything':<14}"
+            f"{define / REPEATS * 1e3:>11.1f}{compile_time / REPEATS * 1e3:>12.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
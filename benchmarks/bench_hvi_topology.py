@@ -0,0 +1,112 @@
+"""
+Measures how long the QuadLO HVI sequence takes to generate as AWGs and
+digitizers are added to the config. No hardware or driver is needed: only the
+hvi_ir program is built.
+
+    python benchmarks/bench_hvi_topology.py
+
+Generation time per module should stay flat as the number of modules grows.
+"""
+
+import os
+import sys
+import time
+import logging
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import hvi_wrap as hvi
+import hvi_quad_lo
+import hvi_topology
+from Configuration import (
+    Config,
+    AwgDescriptor,
+    DigDescriptor,
+    Hvi,
+    HviConstant,
+    Fpga,
+    Register,
+    Queue,
+    QueueItem,
+    DaqDescriptor,
+)
+
+SIZES = [2, 8, 32, 128, 512]
+
+
+def make_config(modules):
+    """A lead AWG followed by <modules> - 1 AWGs and digitizers, alternately"""
+    lo_registers = [
+        Register(f"HVI_CH{channel}_{name}", 0)
+        for channel in (1, 3, 4)
+        for name in ("PhaseInc0A", "PhaseInc0B", "Phase0", "Amplitude0")
+    ]
+    fpga = Fpga("", "", [], [Register(hvi_topology.PHASE_RESET, 0)] + lo_registers)
+    lead_registers = [
+        Register(name, 0)
+        for name in (
+            "LoopCounter",
+            "IterationCounter",
+            "FrequencyIterator",
+            "PhaseIterator",
+            "AmplitudeIterator",
+            "AB",
+        )
+    ]
+    queues = [Queue(channel, True, [QueueItem(1, True, 0, 1)]) for channel in (1, 3, 4)]
+    config_modules = [
+        AwgDescriptor("AWG_LEAD", "M3202A", 4, 1e9, 2, fpga, lead_registers, [], queues)
+    ]
+    for index in range(1, modules):
+        chassis = 1 + index // 16
+        slot = 2 + index % 16
+        if index % 2:
+            module = AwgDescriptor(
+                f"AWG_{index}", "M3202A", 4, 1e9, slot, fpga, [], [], queues
+            )
+        else:
+            module = DigDescriptor(
+                f"DIG_{index}",
+                "M3102A",
+                4,
+                500e6,
+                slot,
+                Fpga(),
+                [],
+                [DaqDescriptor(1, 100e-6, 10, True)],
+            )
+        module.chassis = chassis
+        config_modules.append(module)
+    constants = [
+        HviConstant(name, value)
+        for name, value in (
+            ("ResetPhase", 1),
+            ("NumberOfLoops", 5),
+            ("NumberOfIterations", 2),
+            ("Gap", 200000),
+            ("FrequencyIncrement", 0),
+            ("PhaseIncrement", 512),
+            ("AmplitudeIncrement", 49151),
+        )
+    ]
+    return Config(config_modules, Hvi("hvi_quad_lo", config_modules, constants))
+
+
+def main():
+    # Configuration sets up INFO logging when imported
+    logging.getLogger().setLevel(logging.WARNING)
+    print(f"{'Modules':>8}{'Chassis':>8}{'Statements':>12}{'ms':>8}{'us/module':>11}")
+    for size in SIZES:
+        config = make_config(size)
+        start = time.perf_counter()
+        hvi_quad_lo.configure_hvi(config)
+        elapsed = time.perf_counter() - start
+        statements = sum(1 for _ in hvi.hvi_ir.walk(hvi.program.statements))
+        print(
+            f"{size:>8}{len(hvi.program.chassis_list):>8}{statements:>12}"
+            f"{elapsed * 1e3:>8.1f}{elapsed / size * 1e6:>11.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Measures how long the LO registers take to generate for many cards, against
+computing them one at a time as the configurators did, the register values of
+many sweep points, and encoding and decoding a frequency hop table. No hardware
+or driver is needed.
+
+    python benchmarks/bench_lo_registers.py
+"""
+
+import os
+import sys
+import math
+import time
+import logging
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import sweep
+import lo_encoding
+import lo_registers
+from Configuration import Register
+
+CARDS = [1, 16, 128]
+CHANNELS = [1, 2, 3, 4]
+POINTS = [100, 1000, 10000]
+HOPS = [1000, 100000, 1000000]
+
+
+def A(f, fs=1e9):
+    return int((f / fs) * (5 / 8) * 2 ** 25)
+
+
+def B(f, fs=1e9):
+    K = (f / fs) * (5 / 8) * 2 ** 25
+    return round((K - int(K)) * 5 ** 10)
+
+
+def I(phase):
+    return int(round(32767 * math.cos(math.radians(phase))))
+
+
+def Q(phase):
+    return int(round(32767 * math.sin(math.radians(phase))))
+
+
+def scalar_pc_registers(los, control):
+    """The registers as the configurators listed them"""
+    registers = []
+    for channel, channel_los in los.items():
+        registers.append(Register(f"PC_CH{channel}_Control", control))
+        for lo, (frequency, phase) in enumerate(channel_los):
+            registers += [
+                Register(f"PC_CH{channel}_Q{lo}", Q(phase)),
+                Register(f"PC_CH{channel}_I{lo}", I(phase)),
+                Register(f"PC_CH{channel}_PhaseInc{lo}A", A(frequency)),
+                Register(f"PC_CH{channel}_PhaseInc{lo}B", B(frequency)),
+            ]
+    return registers
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    # Configuration sets up INFO logging when imported
+    logging.getLogger().setLevel(logging.WARNING)
+    frequencies = np.linspace(10e6, 70e6, lo_registers.LO_COUNT)
+    print(f"{'Cards':>8}{'Registers':>11}{'scalar ms':>11}{'table ms':>10}")
+    for cards in CARDS:
+        tables = [
+            lo_registers.lo_table(CHANNELS, frequencies + card * 1e3, card % 360)
+            for card in range(cards)
+        ]
+        scalar, scalar_time = timed(
+            lambda: [scalar_pc_registers(los, 6) for los in tables]
+        )
+        table, table_time = timed(
+            lambda: [lo_registers.pc_registers(los, 6) for los in tables]
+        )
+        assert scalar == table
+        print(
+            f"{cards:>8}{sum(map(len, table)):>11}"
+            f"{scalar_time * 1e3:>11.1f}{table_time * 1e3:>10.1f}"
+        )
+
+    print(f"\n{'Points':>8}{'ms':>11}")
+    for count in POINTS:
+        spec = sweep.SweepSpec.frequency_range(
+            10e6, 400e6, count // 4, phases=[0, 90], amplitudes=[0.25, 0.5]
+        )
+        _, elapsed = timed(sweep.points, spec)
+        print(f"{count:>8}{elapsed * 1e3:>11.1f}")
+
+    print(f"\n{'Hops':>8}{'encode ms':>11}{'decode ms':>11}{'max error Hz':>14}")
+    for count in HOPS:
+        frequencies = np.random.default_rng(0).uniform(10e6, 400e6, count)
+        (a, b), encode_time = timed(lo_encoding.encode_frequency, frequencies)
+        decoded, decode_time = timed(lo_encoding.decode_frequency, a, b)
+        error = np.abs(decoded - frequencies).max()
+        print(
+            f"{count:>8}{encode_time * 1e3:>11.1f}{decode_time * 1e3:>11.1f}"
+            f"{error:>14.2e}"
+        )
+
+
+if __name__ == "__main__":
+    main()
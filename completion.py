@@ -0,0 +1,80 @@
+"""
+Waits for a run to complete by polling a progress counter, instead of
+sleeping for a fixed time.
+
+The counter can be an HVI runtime register, an FPGA sandbox register (e.g. the
+averager's trigger count) or a digitizer's DAQ point counter. Polling starts
+fast and backs off while nothing changes; while the counter advances, the next
+poll is scheduled from the measured rate so that completion is seen promptly.
+"""
+
+import time
+import logging
+
+log = logging.getLogger(__name__)
+
+MIN_INTERVAL = 1e-3
+MAX_INTERVAL = 0.1
+BACKOFF = 2.0
+
+
+def wait_for(
+    read_count, expected, timeout=10.0, progress=None, name="run", level=logging.INFO
+):
+    """
+    Polls read_count() until it returns at least <expected>.
+
+    timeout : overall deadline, in seconds
+    progress : optional callback(count, expected), called when the count changes
+    level : log level of the completion message
+    Returns True on completion, False if the deadline passed.
+    """
+    start = time.perf_counter()
+    deadline = start + timeout
+    interval = MIN_INTERVAL
+    last_count = None
+    last_time = start
+    while True:
+        count = read_count()
+        now = time.perf_counter()
+        if count != last_count:
+            if progress is not None:
+                progress(count, expected)
+            if count >= expected:
+                log.log(
+                    level, f"{name} complete ({count}/{expected}) in {now - start:.3f}s"
+                )
+                return True
+            if last_count is not None and count > last_count:
+                # Sleep for about half the time the remaining counts should take
+                rate = (count - last_count) / (now - last_time)
+                interval = 0.5 * (expected - count) / rate
+            else:
+                interval = MIN_INTERVAL
+            last_count = count
+            last_time = now
+        else:
+            interval = interval * BACKOFF
+        if now >= deadline:
+            log.warning(f"{name} timed out after {timeout}s ({count}/{expected})")
+            return False
+        interval = min(max(interval, MIN_INTERVAL), MAX_INTERVAL)
+        time.sleep(min(interval, deadline - now))
+
+
+def hvi_counter(module, register):
+    """Returns a reader for HVI register <register> of <module>"""
+    import hvi_wrap
+
+    return hvi_wrap.runtime_register(module, register).read
+
+
+def sandbox_counter(handle, register):
+    """Returns a reader for FPGA sandbox register <register>"""
+    sandbox_register = handle.FPGAgetSandBoxRegister(register)
+    return sandbox_register.readRegisterInt32
+
+
+def daq_counter(handle, channel, points_per_capture=1):
+    """Returns a reader of the number of captures waiting in a DAQ"""
+    return lambda: max(handle.DAQcounterRead(channel), 0) // points_per_capture
@@ -0,0 +1,304 @@
+"""
+History of the configs that have been generated.
+
+Configs are kept as config_<n>.yaml in the history directory (./config_hist),
+as before, and indexed in index.sqlite next to them, so that:
+
+- the latest config is found without listing the directory,
+- saving a config identical to one already in the history records a new
+  entry for the existing file instead of writing another copy,
+- entries can be found by module, parameter value or date:
+
+    history = ConfigHistory()
+    history.find(module="DIG_0", parameter="NumberOfLoops", value=5)
+
+Parameters are the HVI constants (by name), and the modules' HVI and FPGA
+registers (as "<module>.<register>"). A directory made before the index
+existed is indexed the first time it is opened.
+"""
+
+import os
+import time
+import sqlite3
+import hashlib
+import logging
+from typing import List
+from dataclasses import dataclass, field
+
+import yaml
+
+log = logging.getLogger(__name__)
+
+DIRECTORY = "./config_hist"
+INDEX_FILE = "index.sqlite"
+
+# Writes the same YAML as yaml.Dumper, a few times faster
+_Dumper = getattr(yaml, "CDumper", yaml.Dumper)
+
+_TABLES = """
+CREATE TABLE IF NOT EXISTS entries (
+    number INTEGER PRIMARY KEY,
+    file TEXT NOT NULL,
+    sha1 TEXT NOT NULL,
+    created REAL NOT NULL,
+    hvi_file TEXT
+);
+CREATE INDEX IF NOT EXISTS entries_sha1 ON entries (sha1);
+CREATE INDEX IF NOT EXISTS entries_created ON entries (created);
+CREATE TABLE IF NOT EXISTS modules (
+    number INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    model TEXT,
+    slot INTEGER
+);
+CREATE INDEX IF NOT EXISTS modules_name ON modules (name, number);
+CREATE TABLE IF NOT EXISTS parameters (
+    number INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    value REAL
+);
+CREATE INDEX IF NOT EXISTS parameters_name ON parameters (name, value, number);
+"""
+
+
+@dataclass
+class Entry:
+    number: int
+    # Path of the config file
+    file: str
+    sha1: str
+    # Seconds since the epoch
+    created: float
+    hvi_file: str = None
+
+
+@dataclass
+class Dumped:
+    """A config as the history saves it: its YAML and what is indexed of it"""
+
+    content: bytes
+    sha1: str
+    hvi_file: str = None
+    # (name, model, slot) of each module
+    modules: List[tuple] = field(default_factory=list)
+    # (name, value) of each parameter
+    parameters: List[tuple] = field(default_factory=list)
+
+
+class ConfigHistory:
+    def __init__(self, directory=DIRECTORY):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(os.path.join(directory, INDEX_FILE))
+        self._db.executescript(_TABLES)
+        if self._db.execute("SELECT COUNT(*) FROM entries").fetchone()[0] == 0:
+            self._import()
+
+    def close(self):
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def save(self, config):
+        """
+        Adds <config> to the history, returns its Entry. The file of an
+        identical config already in the history is reused.
+        """
+        return self.save_dumped([dump(config)])[0]
+
+    def save_dumped(self, dumped):
+        """
+        Adds the configs <dumped> (see dump()) to the history, in one
+        transaction, returns their Entries
+        """
+        created = time.time()
+        # Files of the new configs, written as <file>.tmp and only renamed once
+        # their entries are committed: a transaction that fails leaves no
+        # config_<n>.yaml behind for a number the index does not hold
+        written = []
+        try:
+            with self._db:
+                self._db.execute("BEGIN IMMEDIATE")
+                number = self._next_number()
+                names = {}
+                entries = []
+                for config in dumped:
+                    name = names.get(config.sha1) or self._file_of(config.sha1)
+                    if name is not None:
+                        log.info(f"Config {number} is identical to {name}")
+                    else:
+                        name = f"config_{number}.yaml"
+                        path = os.path.join(self.directory, name)
+                        written.append(path)
+                        with open(path + ".tmp", "wb") as f:
+                            f.write(config.content)
+                    names[config.sha1] = name
+                    self._add(number, name, created, config)
+                    entries.append(
+                        Entry(
+                            number,
+                            os.path.join(self.directory, name),
+                            config.sha1,
+                            created,
+                            config.hvi_file,
+                        )
+                    )
+                    number += 1
+        except BaseException:
+            for path in written:
+                try:
+                    os.remove(path + ".tmp")
+                except OSError:
+                    pass
+            raise
+        for path in written:
+            os.replace(path + ".tmp", path)
+        return entries
+
+    def latest(self):
+        """Returns the latest Entry, or None if the history is empty"""
+        row = self._db.execute(
+            "SELECT * FROM entries ORDER BY number DESC LIMIT 1"
+        ).fetchone()
+        return self._entry(row)
+
+    def entry(self, number):
+        row = self._db.execute(
+            "SELECT * FROM entries WHERE number = ?", (number,)
+        ).fetchone()
+        return self._entry(row)
+
+    def find(self, module=None, parameter=None, value=None, since=None, until=None):
+        """
+        Returns the Entries, oldest first, that use <module>, have <parameter>
+        (equal to <value> if given), and were created between <since> and
+        <until> (seconds since the epoch).
+        """
+        query = "SELECT * FROM entries WHERE 1"
+        arguments = []
+        if module is not None:
+            query += " AND number IN (SELECT number FROM modules WHERE name = ?)"
+            arguments.append(module)
+        if parameter is not None:
+            query += " AND number IN (SELECT number FROM parameters WHERE name = ?"
+            arguments.append(parameter)
+            if value is not None:
+                query += " AND value = ?"
+                arguments.append(value)
+            query += ")"
+        if since is not None:
+            query += " AND created >= ?"
+            arguments.append(since)
+        if until is not None:
+            query += " AND created <= ?"
+            arguments.append(until)
+        query += " ORDER BY number"
+        return [self._entry(row) for row in self._db.execute(query, arguments)]
+
+    def _file_of(self, sha1):
+        row = self._db.execute(
+            "SELECT file FROM entries WHERE sha1 = ? LIMIT 1", (sha1,)
+        ).fetchone()
+        return None if row is None else row[0]
+
+    def _next_number(self):
+        row = self._db.execute("SELECT MAX(number) FROM entries").fetchone()
+        return (row[0] or 0) + 1
+
+    def _entry(self, row):
+        if row is None:
+            return None
+        number, name, sha1, created, hvi_file = row
+        return Entry(
+            number, os.path.join(self.directory, name), sha1, created, hvi_file
+        )
+
+    def _add(self, number, name, created, config):
+        self._db.execute(
+            "INSERT INTO entries VALUES (?, ?, ?, ?, ?)",
+            (number, name, config.sha1, created, config.hvi_file),
+        )
+        self._db.executemany(
+            "INSERT INTO modules VALUES (?, ?, ?, ?)",
+            [(number,) + module for module in config.modules],
+        )
+        self._db.executemany(
+            "INSERT INTO parameters VALUES (?, ?, ?)",
+            [(number,) + parameter for parameter in config.parameters],
+        )
+
+    def _import(self):
+        """Indexes the config_<n>.yaml files of a directory made before the index"""
+        import Configuration
+
+        files = []
+        for file in os.listdir(self.directory):
+            name, extension = os.path.splitext(file)
+            if extension == ".yaml" and name.startswith("config_"):
+                try:
+                    files.append((int(name.split("_")[-1]), file))
+                except ValueError:
+                    continue
+        if not files:
+            return
+        log.info(f"Indexing {len(files)} configs in {self.directory}...")
+        with self._db:
+            for number, file in sorted(files):
+                path = os.path.join(self.directory, file)
+                with open(path, "rb") as f:
+                    sha1 = hashlib.sha1(f.read()).hexdigest()
+                try:
+                    config = _summary(Configuration.loadConfig(path), None, sha1)
+                except Exception as err:
+                    log.warning(
+                        f"Cannot read {path}, indexing it without content: {err}"
+                    )
+                    config = Dumped(None, sha1)
+                self._add(number, file, os.path.getmtime(path), config)
+
+
+def dump(config):
+    """
+    Returns Config <config> as ConfigHistory saves it. Configs can be dumped
+    in other processes, then saved together with save_dumped().
+    """
+    content = yaml.dump(config, Dumper=_Dumper).encode()
+    return _summary(config, content, hashlib.sha1(content).hexdigest())
+
+
+def _summary(config, content, sha1):
+    return Dumped(
+        content,
+        sha1,
+        config.hvi.hviFile,
+        [(m.name, m.model, m.slot) for m in config.modules],
+        list(_parameters(config)),
+    )
+
+
+def _parameters(config):
+    """Yields (name, value) of <config>'s numeric parameters"""
+    for constant in config.hvi.constants:
+        yield constant.name, _number(constant.value)
+    for module in config.modules:
+        for register in module.hvi_registers:
+            yield f"{module.name}.{register.name}", _number(register.value)
+        for register in module.fpga.pc_registers + module.fpga.hvi_registers:
+            yield f"{module.name}.{register.name}", _number(register.value)
+
+
+def _number(value):
+    return value if isinstance(value, (int, float)) else None
+
+
+def latest_file(directory=DIRECTORY):
+    """Returns the file of the latest config in <directory>'s history, or None"""
+    if not os.path.isdir(directory):
+        return None
+    with ConfigHistory(directory) as history:
+        entry = history.latest()
+    return None if entry is None else entry.file
@@ -5,10 +5,11 @@ Created on Mon Nov  9 08:57:55 2020
 @author: Administrator
 """
 
-import os
-import yaml
+import shutil
 import logging
-import math
+
+import config_history
+import lo_encoding
 
 from Configuration import (
     Config,
@@ -36,6 +37,11 @@ def main():
     # repeats: Number of triggers to generate
     iterations = 16
 
+    # pingPong: 0 = read the averaged frames once all have been acquired
+    #           1 = read each iteration's frames while the next is acquired,
+    #               iterations = 0 then repeats until interrupted
+    pingPong = 0
+
     # pulseGap: Gap between pulses
     pulseGap = 200e-6
 
@@ -49,9 +55,8 @@ def main():
         Register("PC_CH1_Flags", 0x0),
     ]
 
-    hviFpgaRegisters = [
-        Register("HVI_GLOBAL_Trigger", 0),
-    ]
+    # The image has no HVI registers
+    hviFpgaRegisters = []
 
     # Fpga:
     #   #1 - filename of bit image
@@ -108,7 +113,7 @@ def main():
     #    #2 - Capture Period
     #    #3 - Number of captures
     #    #3 - Trigger (False = auto, True = trigger from SW/HVI)
-    daq1 = DaqDescriptor(1, 150e-06, loops, True)
+    daq1 = DaqDescriptor(1, 150e-06, loops * iterations, True)
 
     # AwgDescriptor:
     #    #1 - Name
@@ -152,6 +157,7 @@ def main():
         HviConstant("NumberOfLoops", loops),
         HviConstant("NumberOfIterations", iterations),
         HviConstant("Gap", int(pulseGap / 1e-9)),
+        HviConstant("PingPong", pingPong),
     ]
 
     # HVI:
@@ -173,30 +179,19 @@ def main():
 
 
 def saveConfig(config: Config):
-    if not os.path.exists("./config_hist"):
-        os.mkdir("./config_hist")
-    latest_hist = 0
-    for file in os.listdir("./config_hist"):
-        name = os.path.splitext(file)[0]
-        hist = int(name.split("_")[-1])
-        if hist > latest_hist:
-            latest_hist = hist
-
-    filename = "./config_hist/config_" + str(latest_hist + 1) + ".yaml"
-
-    log.info("Generating Config file: {}".format(filename))
-    with open(filename, "w") as f:
-        yaml.dump(config, f)
-    with open("config_default.yaml", "w") as f:
-        yaml.dump(config, f)
+    with config_history.ConfigHistory() as history:
+        entry = history.save(config)
+    log.info("Generating Config file: {}".format(entry.file))
+    # Loaded when there is no history yet (see Configuration.loadConfig())
+    shutil.copyfile(entry.file, "config_default.yaml")
 
 
 def I(phase):
-    return int(round(32767 * math.cos(math.radians(phase))))
+    return int(lo_encoding.encode_iq(phase)[0])
 
 
 def Q(phase):
-    return int(round(32767 * math.sin(math.radians(phase))))
+    return int(lo_encoding.encode_iq(phase)[1])
 
 
 if __name__ == "__main__":
@@ -5,10 +5,12 @@ Created on Mon Nov  9 08:57:55 2020
 @author: Administrator
 """
 
-import os
-import yaml
+import shutil
 import logging
-import math
+
+import config_history
+import lo_encoding
+import lo_registers
 
 from Configuration import (
     Config,
@@ -66,101 +68,17 @@ def main():
 
     control = mode + (phaseSource << 1) + (frequencySource << 2)
 
-    # Register:
-    #   #1 - name of register
-    #   #2 - value to be written
-    pcFpgaRegisters1 = [
-        Register("PC_CH1_Control", control),
-        Register("PC_CH1_Q0", Q(lophase1_1_0)),
-        Register("PC_CH1_I0", I(lophase1_1_0)),
-        Register("PC_CH1_PhaseInc0A", A(lo1_1_0)),
-        Register("PC_CH1_PhaseInc0B", B(lo1_1_0)),
-        Register("PC_CH1_Q1", Q(lophase1_1_0)),
-        Register("PC_CH1_I1", I(lophase1_1_0)),
-        Register("PC_CH1_PhaseInc1A", A(lo1_1_1)),
-        Register("PC_CH1_PhaseInc1B", B(lo1_1_1)),
-        Register("PC_CH1_Q2", Q(lophase1_1_0)),
-        Register("PC_CH1_I2", I(lophase1_1_0)),
-        Register("PC_CH1_PhaseInc2A", A(lo1_1_2)),
-        Register("PC_CH1_PhaseInc2B", B(lo1_1_2)),
-        Register("PC_CH1_Q3", Q(lophase1_1_0)),
-        Register("PC_CH1_I3", I(lophase1_1_0)),
-        Register("PC_CH1_PhaseInc3A", A(lo1_1_3)),
-        Register("PC_CH1_PhaseInc3B", B(lo1_1_3)),
-        Register("PC_CH3_Control", control),
-        Register("PC_CH3_Q0", Q(lophase1_1_0)),
-        Register("PC_CH3_I0", I(lophase1_1_0)),
-        Register("PC_CH3_PhaseInc0A", A(lo1_1_0)),
-        Register("PC_CH3_PhaseInc0B", B(lo1_1_0)),
-        Register("PC_CH3_Q1", Q(lophase1_1_0)),
-        Register("PC_CH3_I1", I(lophase1_1_0)),
-        Register("PC_CH3_PhaseInc1A", A(lo1_1_1)),
-        Register("PC_CH3_PhaseInc1B", B(lo1_1_1)),
-        Register("PC_CH3_Q2", Q(lophase1_1_0)),
-        Register("PC_CH3_I2", I(lophase1_1_0)),
-        Register("PC_CH3_PhaseInc2A", A(lo1_1_2)),
-        Register("PC_CH3_PhaseInc2B", B(lo1_1_2)),
-        Register("PC_CH3_Q3", Q(lophase1_1_0)),
-        Register("PC_CH3_I3", I(lophase1_1_0)),
-        Register("PC_CH3_PhaseInc3A", A(lo1_1_3)),
-        Register("PC_CH3_PhaseInc3B", B(lo1_1_3)),
-        Register("PC_CH4_Control", control),
-        Register("PC_CH4_Q0", Q(lophase1_1_0)),
-        Register("PC_CH4_I0", I(lophase1_1_0)),
-        Register("PC_CH4_PhaseInc0A", A(lo1_1_0)),
-        Register("PC_CH4_PhaseInc0B", B(lo1_1_0)),
-        Register("PC_CH4_Q1", Q(lophase1_1_0)),
-        Register("PC_CH4_I1", I(lophase1_1_0)),
-        Register("PC_CH4_PhaseInc1A", A(lo1_1_1)),
-        Register("PC_CH4_PhaseInc1B", B(lo1_1_1)),
-        Register("PC_CH4_Q2", Q(lophase1_1_0)),
-        Register("PC_CH4_I2", I(lophase1_1_0)),
-        Register("PC_CH4_PhaseInc2A", A(lo1_1_2)),
-        Register("PC_CH4_PhaseInc2B", B(lo1_1_2)),
-        Register("PC_CH4_Q3", Q(lophase1_1_0)),
-        Register("PC_CH4_I3", I(lophase1_1_0)),
-        Register("PC_CH4_PhaseInc3A", A(lo1_1_3)),
-        Register("PC_CH4_PhaseInc3B", B(lo1_1_3)),
-    ]
+    # LO table: {channel: [(frequency, phase) of each LO]}
+    frequencies = [lo1_1_0, lo1_1_1, lo1_1_2, lo1_1_3]
+    los1 = lo_registers.lo_table([1, 3, 4], frequencies, lophase1_1_0)
+    los2 = lo_registers.lo_table([1], frequencies, lophase4_1_0)
 
-    pcFpgaRegisters2 = [
-        Register("PC_CH1_Control", control),
-        Register("PC_CH1_Q0", Q(lophase4_1_0)),
-        Register("PC_CH1_I0", I(lophase4_1_0)),
-        Register("PC_CH1_PhaseInc0A", A(lo1_1_0)),
-        Register("PC_CH1_PhaseInc0B", B(lo1_1_0)),
-        Register("PC_CH1_Q1", Q(lophase4_1_0)),
-        Register("PC_CH1_I1", I(lophase4_1_0)),
-        Register("PC_CH1_PhaseInc1A", A(lo1_1_1)),
-        Register("PC_CH1_PhaseInc1B", B(lo1_1_1)),
-        Register("PC_CH1_Q2", Q(lophase4_1_0)),
-        Register("PC_CH1_I2", I(lophase4_1_0)),
-        Register("PC_CH1_PhaseInc2A", A(lo1_1_2)),
-        Register("PC_CH1_PhaseInc2B", B(lo1_1_2)),
-        Register("PC_CH1_Q3", Q(lophase4_1_0)),
-        Register("PC_CH1_I3", I(lophase4_1_0)),
-        Register("PC_CH1_PhaseInc3A", A(lo1_1_3)),
-        Register("PC_CH1_PhaseInc3B", B(lo1_1_3)),
-    ]
+    # PC_CH<n>_* registers of each LO
+    pcFpgaRegisters1 = lo_registers.pc_registers(los1, control)
+    pcFpgaRegisters2 = lo_registers.pc_registers(los2, control)
 
-    hviFpgaRegisters = [
-        Register("HVI_Mult_A", 0x00),
-        Register("HVI_Mult_B", 0x00),
-        Register("HVI_Mult_AB", 0x00),
-        Register("HVI_GLOBAL_PhaseReset", 0),
-        Register("HVI_CH1_PhaseInc0A", A(lo1_1_0)),
-        Register("HVI_CH1_PhaseInc0B", B(lo1_1_0)),
-        Register("HVI_CH3_PhaseInc0A", A(lo1_1_0)),
-        Register("HVI_CH3_PhaseInc0B", B(lo1_1_0)),
-        Register("HVI_CH4_PhaseInc0A", A(lo1_1_0)),
-        Register("HVI_CH4_PhaseInc0B", B(lo1_1_0)),
-        Register("HVI_CH1_Phase0", 0),
-        Register("HVI_CH3_Phase0", 0),
-        Register("HVI_CH4_Phase0", 0),
-        Register("HVI_CH1_Amplitude0", 0),
-        Register("HVI_CH3_Amplitude0", 0),
-        Register("HVI_CH4_Amplitude0", 0),
-    ]
+    # HVI_* registers, LO 0 of each channel starting at lo1_1_0
+    hviFpgaRegisters = lo_registers.hvi_registers({1: lo1_1_0, 3: lo1_1_0, 4: lo1_1_0})
 
     # Fpga:
     #   #1 - filename of bit image
@@ -203,7 +121,7 @@ def main():
         SubPulseDescriptor(0, 10e-6, 1e-06, 0.6, 1e06),
         SubPulseDescriptor(0, 10e-6, 1e-06, 0.2, 1e06),
         SubPulseDescriptor(0, 10e-6, 1e-06, 0.12, 1e06),
-        SubPulseDescriptor(0, 10e-6, 1e-06, 0.086, 1e06),
+        SubPulseDescriptor(0, 10e-6, 1e-06, 0.08, 1e06),
     ]
 
     pulseGroup2 = [SubPulseDescriptor(10e6, 10e-6, 1e-06, 0.5, 1e06)]
@@ -307,47 +225,27 @@ def main():
 
 
 def saveConfig(config: Config):
-    if not os.path.exists("./config_hist"):
-        os.mkdir("./config_hist")
-    latest_hist = 0
-    for file in os.listdir("./config_hist"):
-        name = os.path.splitext(file)[0]
-        hist = int(name.split("_")[-1])
-        if hist > latest_hist:
-            latest_hist = hist
-
-    filename = "./config_hist/config_" + str(latest_hist + 1) + ".yaml"
-
-    log.info("Generating Config file: {}".format(filename))
-    with open(filename, "w") as f:
-        yaml.dump(config, f)
-    with open("config_default.yaml", "w") as f:
-        yaml.dump(config, f)
+    with config_history.ConfigHistory() as history:
+        entry = history.save(config)
+    log.info("Generating Config file: {}".format(entry.file))
+    # Loaded when there is no history yet (see Configuration.loadConfig())
+    shutil.copyfile(entry.file, "config_default.yaml")
 
 
 def A(f, fs=1e9):
-    S = 5
-    T = 8
-    K = (f / fs) * (S / T) * 2 ** 25
-    A = int(K)
-    return A
+    return int(lo_encoding.encode_frequency(f, fs)[0])
 
 
 def B(f, fs=1e9):
-    S = 5
-    T = 8
-    K = (f / fs) * (S / T) * 2 ** 25
-    A = int(K)
-    B = round((K - A) * 5 ** 10)
-    return B
+    return int(lo_encoding.encode_frequency(f, fs)[1])
 
 
 def I(phase):
-    return int(round(32767 * math.cos(math.radians(phase))))
+    return int(lo_encoding.encode_iq(phase)[0])
 
 
 def Q(phase):
-    return int(round(32767 * math.sin(math.radians(phase))))
+    return int(lo_encoding.encode_iq(phase)[1])
 
 
 if __name__ == "__main__":
@@ -0,0 +1,34 @@
+"""
+Selects the instrument driver libraries used by the rest of the project.
+
+By default the Keysight SD1 and HVI libraries are imported from their
+installation folders. Setting the environment variable HVI_SIMULATE=1 replaces
+them with the pure-Python models in simulated_sd1 and simulated_hvi, so the
+orchestration can be run (and timed) on machines without a chassis.
+
+Setting HVI_TRACE=<file.json> times every call made through either library
+(see instrument.py).
+"""
+
+import os
+import sys
+
+import instrument
+
+SIMULATE = os.getenv("HVI_SIMULATE", "0") not in ("", "0")
+
+if SIMULATE:
+    import simulated_sd1 as key
+    import simulated_hvi as kthvi
+else:
+    sys.path.append(r"C:\Program Files (x86)\Keysight\SD1\Libraries\Python")
+    import keysightSD1 as key
+
+    sys.path.append(
+        r"C:/Program Files/Keysight/PathWave Test Sync Executive 2020 Update 1.0/api/python"
+    )
+    import keysight_hvi as kthvi
+
+if instrument.enabled:
+    key = instrument.wrap(key)
+    kthvi = instrument.wrap(kthvi)
@@ -0,0 +1,253 @@
+"""
+Hardware independent description of an HVI sequence.
+
+hvi_wrap builds a Program out of these statements and only lowers it into
+keysight_hvi objects when the HVI is started. Building, printing, comparing
+and analysing a Program does not need the vendor library.
+
+A Program holds a list of synchronous statements (SyncWhile, SyncBlock). Each
+SyncBlock holds, per module, a list of local statements (Instruction, Delay,
+If). Register operands are given by name; any other operand is an immediate.
+"""
+
+import hashlib
+import dataclasses
+from dataclasses import dataclass, field
+from typing import Any, Dict, List
+
+# Instructions provided by every engine's own instruction set, the rest are
+# provided by the module (e.g. the AWG's set_amplitude).
+NATIVE_INSTRUCTIONS = (
+    "assign",
+    "add",
+    "subtract",
+    "fpga_register_write",
+    "fpga_register_read",
+    "action_execute",
+)
+
+
+@dataclass
+class ModuleDescriptor:
+    """Holds a 'description' of a used module"""
+
+    name: str
+    events: List[str] = field(default_factory=list)
+    actions: List[str] = field(default_factory=list)
+    hvi_registers: List[str] = field(default_factory=list)
+    fpga: str = None
+    handle: int = None
+
+
+@dataclass
+class Register:
+    """HVI register <name> of <module>, set to <initial_value> when a run starts"""
+
+    module: str
+    name: str
+    initial_value: int = 0
+
+
+@dataclass
+class Instruction:
+    """
+    Executes <operation> in <module>.
+
+    operands : {parameter name: value}, e.g. {"destination": "LoopCounter"}
+    """
+
+    name: str
+    module: str
+    operation: str
+    operands: Dict[str, Any]
+    delay: int = 10
+
+
+@dataclass
+class Delay:
+    name: str
+    module: str
+    delay: int = 10
+
+
+@dataclass
+class If:
+    """Executes <statements> if <register> <comparison> <value>"""
+
+    name: str
+    module: str
+    register: str
+    comparison: str
+    value: int
+    delay: int = 10
+    statements: list = field(default_factory=list)
+
+
+@dataclass
+class SyncBlock:
+    """A sync multi-sequence block: {module name: [local statements]}"""
+
+    name: str
+    delay: int = 30
+    sequences: Dict[str, list] = field(default_factory=dict)
+
+
+@dataclass
+class SyncWhile:
+    """Repeats <statements> while <engine>'s <register> <comparison> <value>"""
+
+    name: str
+    engine: str
+    register: str
+    comparison: str
+    value: int
+    delay: int = 70
+    statements: list = field(default_factory=list)
+
+
+@dataclass
+class Program:
+    name: str
+    modules: List[ModuleDescriptor] = field(default_factory=list)
+    chassis_list: List[int] = field(default_factory=lambda: [1])
+    pxi_triggers: List[int] = field(default_factory=lambda: list(range(8)))
+    simulate: bool = False
+    # Only declare the actions, events and FPGA registers that are used
+    lazy: bool = False
+    registers: Dict[tuple, Register] = field(default_factory=dict)
+    statements: list = field(default_factory=list)
+
+    def add_register(self, module, name, initial_value=0):
+        register = Register(module, name, initial_value)
+        self.registers[(module, name)] = register
+        return register
+
+
+def walk(statements):
+    """Yields every statement in <statements>, including nested ones"""
+    for statement in statements:
+        yield statement
+        if isinstance(statement, SyncBlock):
+            for sequence in statement.sequences.values():
+                yield from walk(sequence)
+        elif isinstance(statement, (SyncWhile, If)):
+            yield from walk(statement.statements)
+
+
+def statement_counts(program):
+    """
+    Returns {module name: statements its engine holds}: every sync statement
+    of <program>, plus the module's own local statements
+    """
+    counts = {module.name: 0 for module in program.modules}
+    _count(program.statements, counts)
+    return counts
+
+
+def _count(statements, counts):
+    for statement in statements:
+        for module in counts:
+            counts[module] += 1
+        if isinstance(statement, SyncWhile):
+            _count(statement.statements, counts)
+        elif isinstance(statement, SyncBlock):
+            for module, sequence in statement.sequences.items():
+                counts[module] += sum(1 for _ in walk(sequence))
+
+
+def references(program):
+    """
+    Returns the resources used by <program>'s statements:
+    {module name: {"actions": set, "events": set, "fpga_registers": set}}
+    """
+    used = {
+        module.name: {"actions": set(), "events": set(), "fpga_registers": set()}
+        for module in program.modules
+    }
+    for statement in walk(program.statements):
+        if not isinstance(statement, Instruction):
+            continue
+        resources = used[statement.module]
+        if "action" in statement.operands:
+            resources["actions"].update(statement.operands["action"])
+        if "event" in statement.operands:
+            resources["events"].add(statement.operands["event"])
+        if "fpga_register" in statement.operands:
+            resources["fpga_registers"].add(statement.operands["fpga_register"])
+    return used
+
+
+def fingerprint(program):
+    """
+    Returns a digest of everything that is compiled into the HVI.
+
+    Register initial values are left out: they are written when a run starts,
+    so programs that only differ in them can share one compiled HVI.
+    """
+    return hashlib.sha1(repr(_structure(program)).encode()).hexdigest()
+
+
+def _structure(value):
+    if isinstance(value, ModuleDescriptor):
+        # Not the handle: the fingerprint only describes the program (see
+        # hvi_wrap.start() for the handles)
+        return (
+            value.name,
+            value.events,
+            value.actions,
+            value.hvi_registers,
+            value.fpga,
+        )
+    if isinstance(value, Register):
+        return (value.module, value.name)
+    if dataclasses.is_dataclass(value):
+        return (type(value).__name__,) + tuple(
+            _structure(getattr(value, f.name)) for f in dataclasses.fields(value)
+        )
+    if isinstance(value, dict):
+        return tuple((k, _structure(v)) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return tuple(_structure(v) for v in value)
+    return value
+
+
+def to_string(program):
+    """Returns <program> as an indented listing"""
+    lines = [f"Program: {program.name}"]
+    for register in program.registers.values():
+        lines.append(
+            f"  Register {register.module}.{register.name} = {register.initial_value}"
+        )
+    _describe(program.statements, lines, 1)
+    return "\n".join(lines)
+
+
+def _describe(statements, lines, indent):
+    pad = "  " * indent
+    for statement in statements:
+        if isinstance(statement, SyncWhile):
+            lines.append(
+                f"{pad}SyncWhile '{statement.name}' (delay {statement.delay}): "
+                f"{statement.engine}.{statement.register} "
+                f"{statement.comparison} {statement.value}"
+            )
+            _describe(statement.statements, lines, indent + 1)
+        elif isinstance(statement, SyncBlock):
+            lines.append(f"{pad}SyncBlock '{statement.name}' (delay {statement.delay})")
+            for module, sequence in statement.sequences.items():
+                lines.append(f"{pad}  {module}:")
+                _describe(sequence, lines, indent + 2)
+        elif isinstance(statement, If):
+            lines.append(
+                f"{pad}If '{statement.name}' (delay {statement.delay}): "
+                f"{statement.register} {statement.comparison} {statement.value}"
+            )
+            _describe(statement.statements, lines, indent + 1)
+        elif isinstance(statement, Delay):
+            lines.append(f"{pad}Delay '{statement.name}' ({statement.delay})")
+        else:
+            operands = ", ".join(f"{k}={v}" for k, v in statement.operands.items())
+            lines.append(
+                f"{pad}{statement.operation} '{statement.name}' "
+                f"(delay {statement.delay}): {operands}"
+            )
@@ -0,0 +1,243 @@
+"""
+Peephole optimizer for hvi_ir programs.
+
+Hand written sequences pad statements with generous delays and separate
+delay() statements, which limit how fast a loop can repeat. optimize() returns
+a copy of a program in which:
+
+- adjacent delays are merged, and a delay is folded into the start delay of
+  the statement that follows it,
+- consecutive assignments, additions and subtractions of the same register
+  with immediate operands are folded into one instruction,
+- register writes that do not change from one iteration to the next are
+  hoisted out of while loops,
+- sync block and while loop start delays are shrunk to the minimum legal
+  values.
+
+Instruction delays are kept (they hold the waits that a sequence relies on),
+as are FPGA register writes, which have side effects in the FPGA.
+"""
+
+import copy
+import logging
+from collections import Counter
+
+import hvi_ir
+import hvi_timing
+
+log = logging.getLogger(__name__)
+
+MIN_INSTRUCTION_DELAY = 10
+MIN_BLOCK_DELAY = 30
+MIN_WHILE_DELAY = 70
+
+# Instructions that only compute a register value, and so can be folded
+FOLDABLE = ("assign", "add", "subtract")
+
+
+def optimize(program, shrink=True):
+    """
+    Returns (optimized copy of <program>, report).
+
+    shrink : shrink sync block and while loop delays to their minimum
+    report : [(loop name, period before, period after)], periods in ns
+    """
+    before = hvi_timing.loop_periods(program)
+    # The modules (and their open handles) are shared, not copied
+    optimized = copy.deepcopy(program, {id(m): m for m in program.modules})
+    _optimize_sync(optimized, optimized.statements, shrink)
+    after = hvi_timing.loop_periods(optimized)
+    report = [(name, before[name], after.get(name)) for name in before]
+    for name, old, new in report:
+        log.info(
+            f"Loop '{name}': period {old} ns -> {new} ns "
+            f"({_rate(old)} -> {_rate(new)})"
+        )
+    return optimized, report
+
+
+def _rate(period):
+    """Repetition rate of a loop of <period> ns, for the log"""
+    if not period:
+        return "unknown rate"
+    return f"{1e6 / period:.2f} kHz"
+
+
+# Register usage
+
+
+def _writes(statement):
+    """Registers written by <statement>: [(module, name)]"""
+    operands = getattr(statement, "operands", {})
+    if "destination" in operands:
+        return [(statement.module, statement.operands["destination"])]
+    return []
+
+
+def _reads(statement):
+    """Registers read by <statement>: [(module, name)]"""
+    if isinstance(statement, hvi_ir.SyncWhile):
+        return [(statement.engine, statement.register)]
+    if isinstance(statement, hvi_ir.If):
+        return [(statement.module, statement.register)]
+    if isinstance(statement, hvi_ir.Instruction):
+        return [
+            (statement.module, value)
+            for parameter, value in statement.operands.items()
+            if type(value) is str
+            and parameter not in ("destination", "fpga_register", "action")
+        ]
+    return []
+
+
+# Passes
+
+
+def _optimize_sync(program, statements, shrink):
+    for statement in list(statements):
+        if isinstance(statement, hvi_ir.SyncWhile):
+            _optimize_sync(program, statement.statements, shrink)
+            _hoist(program, statements, statement)
+            if shrink:
+                statement.delay = min(statement.delay, MIN_WHILE_DELAY)
+        else:
+            for module, sequence in statement.sequences.items():
+                statement.sequences[module] = _optimize_local(sequence)
+            if shrink:
+                statement.delay = min(statement.delay, MIN_BLOCK_DELAY)
+
+
+def _optimize_local(statements):
+    optimized = []
+    for statement in statements:
+        if isinstance(statement, hvi_ir.If):
+            statement.statements = _optimize_local(statement.statements)
+        previous = optimized[-1] if optimized else None
+        if isinstance(previous, hvi_ir.Delay):
+            # Start the statement later instead of waiting for the delay
+            optimized.pop()
+            statement.delay += previous.delay
+            if isinstance(statement, hvi_ir.Delay):
+                statement.name = previous.name
+        elif _fold(previous, statement):
+            continue
+        optimized.append(statement)
+    return optimized
+
+
+def _fold(previous, statement):
+    """Folds <statement> into <previous> if possible, returns True if folded"""
+    if not (
+        isinstance(previous, hvi_ir.Instruction)
+        and isinstance(statement, hvi_ir.Instruction)
+        and previous.operation in FOLDABLE
+        and statement.operation in FOLDABLE
+        and statement.delay == MIN_INSTRUCTION_DELAY
+        and statement.module == previous.module
+        and _writes(statement) == _writes(previous)
+    ):
+        return False
+    register = previous.operands["destination"]
+    if statement.operation in ("add", "subtract"):
+        value = _step(statement, register)
+        if value is None:
+            return False
+        if previous.operation == "assign":
+            if type(previous.operands["source"]) is not int:
+                return False
+            previous.operands["source"] += value
+            return True
+        step = _step(previous, register)
+        if step is None:
+            return False
+        step += value
+        previous.operation = "add" if step >= 0 else "subtract"
+        previous.operands["right_operand"] = abs(step)
+        return True
+    # The first result is overwritten before it is used
+    if statement.operands["source"] == register:
+        return False
+    previous.operation = "assign"
+    previous.operands = dict(statement.operands)
+    previous.name = statement.name
+    return True
+
+
+def _step(statement, register):
+    """
+    The immediate that the add or subtract <statement> adds to <register>, or
+    None if it is not of the form register = register +/- immediate.
+    """
+    value = statement.operands["right_operand"]
+    if statement.operands["left_operand"] != register or type(value) is not int:
+        return None
+    return value if statement.operation == "add" else -value
+
+
+def _hoist(program, statements, loop):
+    """Moves writes of values that do not change out of <loop>"""
+    written = Counter(
+        register
+        for statement in hvi_ir.walk(loop.statements)
+        for register in _writes(statement)
+    )
+    # Hoisting is only safe if nothing outside the loop reads the register:
+    # a loop that runs no iterations would still make the write.
+    outside = set(
+        register
+        for statement in _walk_outside(program.statements, loop)
+        for register in _reads(statement)
+    )
+    hoisted = []
+    # Registers read so far in an iteration, which would see the value from
+    # before the loop in its first iteration
+    read = {(loop.engine, loop.register)}
+    for block in loop.statements:
+        if not isinstance(block, hvi_ir.SyncBlock):
+            for nested in hvi_ir.walk([block]):
+                read.update(_reads(nested))
+            continue
+        for sequence in block.sequences.values():
+            for statement in list(sequence):
+                register = (_writes(statement) or [None])[0]
+                if (
+                    isinstance(statement, hvi_ir.Instruction)
+                    and statement.operation == "assign"
+                    and statement.delay <= MIN_INSTRUCTION_DELAY
+                    and written[register] == 1
+                    and register not in read
+                    and register not in outside
+                    and not any(written[r] for r in _reads(statement))
+                ):
+                    sequence.remove(statement)
+                    hoisted.append(statement)
+                for nested in hvi_ir.walk([statement]):
+                    read.update(_reads(nested))
+    if not hoisted:
+        return
+    index = statements.index(loop)
+    previous = statements[index - 1] if index > 0 else None
+    if not isinstance(previous, hvi_ir.SyncBlock):
+        previous = hvi_ir.SyncBlock(
+            f"{loop.name} setup",
+            MIN_BLOCK_DELAY,
+            {module.name: [] for module in program.modules},
+        )
+        statements.insert(index, previous)
+    for statement in hoisted:
+        log.info(f"Hoisting '{statement.name}' out of '{loop.name}'")
+        statement.delay = MIN_INSTRUCTION_DELAY
+        previous.sequences[statement.module].append(statement)
+
+
+def _walk_outside(statements, loop):
+    """Yields every statement in <statements>, except those inside <loop>"""
+    for statement in statements:
+        yield statement
+        if statement is loop:
+            continue
+        if isinstance(statement, hvi_ir.SyncBlock):
+            for sequence in statement.sequences.values():
+                yield from hvi_ir.walk(sequence)
+        elif isinstance(statement, hvi_ir.SyncWhile):
+            yield from _walk_outside(statement.statements, loop)
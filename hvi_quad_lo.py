@@ -1,200 +1,209 @@
 import logging
-import time
 import hvi_wrap as hvi
+import completion
+import telemetry
+import hvi_topology
 
 log = logging.getLogger(__name__)
 
 
-def check_status(config):
-    #    register_runtime = hvi.sync_sequence.scopes["AWG_LEAD"].registers["LoopCounter"]
-    #    count = register_runtime.read
-    loop_counter = hvi.read_register_runtime("AWG_LEAD", "LoopCounter")
-    while loop_counter < 0:
-        log.info(f"loop: {loop_counter}")
-        loop_counter = hvi.read_register_runtime("AWG_LEAD", "LoopCounter")
-    AB = hvi.read_register_runtime("AWG_LEAD", "AB")
+def check_status(config, timeout=None, progress=None):
+    """
+    Waits until all NumberOfLoops * NumberOfIterations triggers have been
+    issued, or <timeout> seconds (default: twice the expected run time + 1s).
+    """
+    loop_count = config.hvi.get_constant("NumberOfLoops")
+    iteration_count = config.hvi.get_constant("NumberOfIterations")
+    expected = loop_count * iteration_count
+    if timeout is None:
+        timeout = 2 * expected * config.hvi.get_constant("Gap") * 1e-9 + 1.0
+
+    lead = hvi_topology.from_config(config).lead
+
+    def triggers_issued(values):
+        return values["iterations"] * loop_count + values["loops"]
+
+    sources = {
+        "iterations": completion.hvi_counter(lead, "IterationCounter"),
+        "loops": completion.hvi_counter(lead, "LoopCounter"),
+    }
+    with telemetry.TelemetryPoller(sources) as poller:
+        complete = completion.wait_for(
+            lambda: poller.value(triggers_issued),
+            expected,
+            timeout,
+            progress,
+            name="HVI triggers",
+        )
+        rate = poller.rate(triggers_issued, window=timeout)
+    if rate is not None:
+        log.info(f"Trigger rate: {rate:.0f} triggers/s")
+    AB = hvi.read_register_runtime(lead, "AB")
     log.info(f"Multiplier result: {AB}")
-    return True
+    return complete
 
 
 def configure_hvi(config):
-    hvi_module_info = []
-    for module in config.modules:
-        hvi_module_info.append(
-            hvi.ModuleDescriptor(
-                name=module.name,
-                hvi_registers=[reg.name for reg in module.hvi_registers],
-                handle=module.handle,
-                fpga=module.fpga.image_file,
-            )
-        )
+    topology = hvi_topology.from_config(config)
+    lead = topology.lead
     loop_count = config.hvi.get_constant("NumberOfLoops")
     iteration_count = config.hvi.get_constant("NumberOfIterations")
     frequency_increment = config.hvi.get_constant("FrequencyIncrement")
     phase_increment = config.hvi.get_constant("PhaseIncrement")
     amplitude_increment = config.hvi.get_constant("AmplitudeIncrement")
     gap = config.hvi.get_constant("Gap")
-    trigger_awgs = ["awg1_trigger", "awg2_trigger", "awg3_trigger", "awg4_trigger"]
-    trigger_daqs = ["daq1_trigger", "daq2_trigger", "daq3_trigger", "daq4_trigger"]
 
     """ Defines the complete HVI environment and HVI sequence"""
     # Create the main Sequencer and assign all the resources to be used
-    hvi.define_system("QuadLo HVI", modules=hvi_module_info)
+    hvi_topology.define_system(config, topology, "QuadLo HVI")
 
-    hvi.start_sync_multi_sequence_block("Initialize", delay=30)
-    # AWG_LEAD Instructions
-    lo_freq_0A = config.get_module("AWG_LEAD").fpga.get_hvi_register_value(
+    # Values that can change without recompiling the HVI
+    lo_freq_0A = config.get_module(lead).fpga.get_hvi_register_value(
         "HVI_CH1_PhaseInc0A"
     )
-    lo_freq_0B = config.get_module("AWG_LEAD").fpga.get_hvi_register_value(
+    lo_freq_0B = config.get_module(lead).fpga.get_hvi_register_value(
         "HVI_CH1_PhaseInc0B"
     )
-    lo_amplitude = config.get_module("AWG_LEAD").get_register_value(
-        "AmplitudeIterator"
+    lo_amplitude = config.get_module(lead).get_register_value("AmplitudeIterator")
+    hvi.parameter(lead, "NumberOfLoops", loop_count)
+    hvi.parameter(lead, "NumberOfIterations", iteration_count)
+    hvi.parameter(lead, "FrequencyIncrement", frequency_increment)
+    hvi.parameter(lead, "PhaseIncrement", phase_increment)
+    hvi.parameter(lead, "AmplitudeIncrement", amplitude_increment)
+    hvi.parameter(lead, "InitialFrequencyA", lo_freq_0A)
+    hvi.parameter(lead, "InitialFrequencyB", lo_freq_0B)
+    hvi.parameter(lead, "InitialAmplitude", lo_amplitude)
+    # Loop counters, counted down from the parameters
+    hvi.parameter(lead, "LoopsRemaining", 0)
+    hvi.parameter(lead, "IterationsRemaining", 0)
+
+    hvi.start_sync_multi_sequence_block("Initialize", delay=30)
+    # Lead AWG Instructions
+    hvi.set_register(
+        "Set Initial Frequency", lead, "FrequencyIterator", "InitialFrequencyA"
     )
     hvi.set_register(
-        "Set Initial Frequency", "AWG_LEAD", "FrequencyIterator", lo_freq_0A
+        "Set Iterations", lead, "IterationsRemaining", "NumberOfIterations"
     )
-    hvi.writeFpgaRegister("Set CH1 LO0A", "AWG_LEAD", "HVI_CH1_PhaseInc0A", lo_freq_0A)
-    hvi.writeFpgaRegister("Set CH1 LO0B", "AWG_LEAD", "HVI_CH1_PhaseInc0B", lo_freq_0B)
-
-    hvi.writeFpgaRegister("Set CH3 LO0A", "AWG_LEAD", "HVI_CH3_PhaseInc0A", lo_freq_0A)
-    hvi.writeFpgaRegister("Set CH3 LO0B", "AWG_LEAD", "HVI_CH3_PhaseInc0B", lo_freq_0B)
-
-    hvi.writeFpgaRegister("Set CH4 LO0A", "AWG_LEAD", "HVI_CH4_PhaseInc0A", lo_freq_0A)
-    hvi.writeFpgaRegister("Set CH4 LO0B", "AWG_LEAD", "HVI_CH4_PhaseInc0B", lo_freq_0B)
-
+    hvi.set_register("Set Loops", lead, "LoopsRemaining", "NumberOfLoops")
     hvi.set_register(
-        "Set Initial Amplitude", "AWG_LEAD", "AmplitudeIterator", lo_amplitude
+        "Set Initial Amplitude", lead, "AmplitudeIterator", "InitialAmplitude"
     )
-    hvi.delay("Wait for register", "AWG_LEAD", 60)
     hvi.writeFpgaRegister(
-        "Set CH1 LO Amplitude", "AWG_LEAD", "HVI_CH1_Amplitude0", "AmplitudeIterator"
+        "Set CH1 LO0A", lead, "HVI_CH1_PhaseInc0A", "InitialFrequencyA"
     )
     hvi.writeFpgaRegister(
-        "Set CH3 LO Amplitude", "AWG_LEAD", "HVI_CH3_Amplitude0", "AmplitudeIterator"
+        "Set CH1 LO0B", lead, "HVI_CH1_PhaseInc0B", "InitialFrequencyB"
     )
+
     hvi.writeFpgaRegister(
-        "Set CH4 LO Amplitude", "AWG_LEAD", "HVI_CH4_Amplitude0", "AmplitudeIterator"
+        "Set CH3 LO0A", lead, "HVI_CH3_PhaseInc0A", "InitialFrequencyA"
     )
-
     hvi.writeFpgaRegister(
-        "deassert LO Phase Reset", "AWG_LEAD", "HVI_GLOBAL_PhaseReset", 0b0000
+        "Set CH3 LO0B", lead, "HVI_CH3_PhaseInc0B", "InitialFrequencyB"
     )
+
     hvi.writeFpgaRegister(
-        "Assert LO Phase Reset", "AWG_LEAD", "HVI_GLOBAL_PhaseReset", 0b1111
+        "Set CH4 LO0A", lead, "HVI_CH4_PhaseInc0A", "InitialFrequencyA"
     )
     hvi.writeFpgaRegister(
-        "deassert LO Phase Reset", "AWG_LEAD", "HVI_GLOBAL_PhaseReset", 0b0000
+        "Set CH4 LO0B", lead, "HVI_CH4_PhaseInc0B", "InitialFrequencyB"
     )
-    hvi.set_register("Clear Loop Counter", "AWG_LEAD", "LoopCounter", 0)
-    hvi.set_register("Clear Iteration Counter", "AWG_LEAD", "IterationCounter", 0)
-
-    # Test the multiplier function
-    hvi.writeFpgaRegister("Set multA", "AWG_LEAD", "HVI_Mult_A", 0x3)
-    hvi.writeFpgaRegister("Set multB", "AWG_LEAD", "HVI_Mult_B", 0x4)
-    hvi.readFpgaRegister("Read multAB", "AWG_LEAD", "HVI_Mult_AB", "AB", delay=20)
 
-    # AWG_FOLLOW_0 Instructions
+    hvi.delay("Wait for register", lead, 60)
     hvi.writeFpgaRegister(
-        "deassert LO Phase Reset", "AWG_FOLLOW_0", "HVI_GLOBAL_PhaseReset", 0b0000
+        "Set CH1 LO Amplitude", lead, "HVI_CH1_Amplitude0", "AmplitudeIterator"
     )
     hvi.writeFpgaRegister(
-        "Assert LO Phase Reset", "AWG_FOLLOW_0", "HVI_GLOBAL_PhaseReset", 0b1111
+        "Set CH3 LO Amplitude", lead, "HVI_CH3_Amplitude0", "AmplitudeIterator"
     )
     hvi.writeFpgaRegister(
-        "deassert LO Phase Reset", "AWG_FOLLOW_0", "HVI_GLOBAL_PhaseReset", 0b0000
+        "Set CH4 LO Amplitude", lead, "HVI_CH4_Amplitude0", "AmplitudeIterator"
     )
+
+    hvi_topology.reset_phases(topology)
+    hvi.set_register("Clear Loop Counter", lead, "LoopCounter", 0)
+    hvi.set_register("Clear Iteration Counter", lead, "IterationCounter", 0)
+
+    # Test the multiplier function
+    hvi.writeFpgaRegister("Set multA", lead, "HVI_Mult_A", 0x3)
+    hvi.writeFpgaRegister("Set multB", lead, "HVI_Mult_B", 0x4)
+    hvi.readFpgaRegister("Read multAB", lead, "HVI_Mult_AB", "AB", delay=20)
+
     hvi.end_sync_multi_sequence_block()
 
+    # The loops count down registers loaded from the parameters, so that the
+    # number of loops and iterations are not compiled into the conditions.
     hvi.start_syncWhile_register(
         "Main Loop",
-        "AWG_LEAD",
-        "IterationCounter",
-        "LESS_THAN",
-        iteration_count,
+        lead,
+        "IterationsRemaining",
+        "GREATER_THAN",
+        0,
         delay=70,
     )
     hvi.start_syncWhile_register(
-        "Iteration Loop", "AWG_LEAD", "LoopCounter", "LESS_THAN", loop_count, delay=570
+        "Iteration Loop", lead, "LoopsRemaining", "GREATER_THAN", 0, delay=570
     )
     if config.hvi.get_constant("ResetPhase"):
         hvi.start_sync_multi_sequence_block("Reset Phase", delay=260)
-        # AWG_LEAD Instructions
-        hvi.writeFpgaRegister(
-            "Assert LO Phase Reset", "AWG_LEAD", "HVI_GLOBAL_PhaseReset", 0b1111
-        )
-        hvi.writeFpgaRegister(
-            "deassert LO Phase Reset", "AWG_LEAD", "HVI_GLOBAL_PhaseReset", 0b0000
-        )
-        # AWG_FOLLOW_0 Instructions
-        hvi.writeFpgaRegister(
-            "Assert LO Phase Reset", "AWG_FOLLOW_0", "HVI_GLOBAL_PhaseReset", 0b1111
-        )
-        hvi.writeFpgaRegister(
-            "deassert LO Phase Reset", "AWG_FOLLOW_0", "HVI_GLOBAL_PhaseReset", 0b0000
-        )
+        hvi_topology.reset_phases(topology, deassert_first=False)
         hvi.end_sync_multi_sequence_block()
         hvi.start_sync_multi_sequence_block("Trigger All")
     else:
         hvi.start_sync_multi_sequence_block("Trigger All", delay=260)
-    # AWG_LEAD Instructions
-    hvi.execute_actions("Trigger All", "AWG_LEAD", trigger_awgs)
-    hvi.incrementRegister("Increment loop counter", "AWG_LEAD", "LoopCounter")
-    hvi.delay("Wait Gap time", "AWG_LEAD", gap)
-    # AWG_FOLLOW_0 Instructions
-    hvi.execute_actions("Trigger All", "AWG_FOLLOW_0", trigger_awgs)
-    # DIG_0 Instructions
-    hvi.execute_actions("Trigger All", "DIG_0", trigger_daqs)
+    hvi_topology.trigger_all(topology, "Trigger All")
+    # Lead AWG Instructions
+    hvi.incrementRegister("Increment loop counter", lead, "LoopCounter")
+    hvi.addToRegister("Count down loops", lead, "LoopsRemaining", -1)
+    hvi.delay("Wait Gap time", lead, gap)
     hvi.end_sync_multi_sequence_block()
     hvi.end_syncWhile()
     # End Iteration Loop
     hvi.start_sync_multi_sequence_block("Change Frequency", delay=260)
-    # AWG_LEAD Instructions
-    hvi.set_register("Clear Loop Counter", "AWG_LEAD", "LoopCounter", 0)
-    hvi.incrementRegister("Increment Iteration counter", "AWG_LEAD", "IterationCounter")
+    # Lead AWG Instructions
+    hvi.set_register("Clear Loop Counter", lead, "LoopCounter", 0)
+    hvi.set_register("Reload Loops", lead, "LoopsRemaining", "NumberOfLoops")
+    hvi.incrementRegister("Increment Iteration counter", lead, "IterationCounter")
+    hvi.addToRegister("Count down iterations", lead, "IterationsRemaining", -1)
     hvi.addToRegister(
-        "Increment Frequency", "AWG_LEAD", "FrequencyIterator", frequency_increment
+        "Increment Frequency", lead, "FrequencyIterator", "FrequencyIncrement"
     )
-    hvi.addToRegister("Increment Phase", "AWG_LEAD", "PhaseIterator", phase_increment)
-    hvi.addToRegister("Increment Amplitude", "AWG_LEAD", "AmplitudeIterator", amplitude_increment)
-    hvi.delay("Wait for register", "AWG_LEAD", 60)
+    hvi.addToRegister("Increment Phase", lead, "PhaseIterator", "PhaseIncrement")
+    hvi.addToRegister(
+        "Increment Amplitude", lead, "AmplitudeIterator", "AmplitudeIncrement"
+    )
+    hvi.delay("Wait for register", lead, 60)
     hvi.writeFpgaRegister(
         "Set CH1 LO Amplitude",
-        "AWG_LEAD",
+        lead,
         "HVI_CH1_Amplitude0",
         "AmplitudeIterator",
     )
     hvi.writeFpgaRegister(
         "Set CH3 LO Amplitude",
-        "AWG_LEAD",
+        lead,
         "HVI_CH3_Amplitude0",
         "AmplitudeIterator",
     )
     hvi.writeFpgaRegister(
         "Set CH4 LO Amplitude",
-        "AWG_LEAD",
+        lead,
         "HVI_CH4_Amplitude0",
         "AmplitudeIterator",
     )
     hvi.writeFpgaRegister(
-        "Set Frequency CH1", "AWG_LEAD", "HVI_CH1_PhaseInc0A", "FrequencyIterator"
-    )
-    hvi.writeFpgaRegister(
-        "Set Frequency CH3", "AWG_LEAD", "HVI_CH3_PhaseInc0A", "FrequencyIterator"
-    )
-    hvi.writeFpgaRegister(
-        "Set Frequency CH4", "AWG_LEAD", "HVI_CH4_PhaseInc0A", "FrequencyIterator"
-    )
-    hvi.writeFpgaRegister(
-        "Set Phase CH1", "AWG_LEAD", "HVI_CH1_Phase0", "PhaseIterator"
+        "Set Frequency CH1", lead, "HVI_CH1_PhaseInc0A", "FrequencyIterator"
     )
     hvi.writeFpgaRegister(
-        "Set Phase CH3", "AWG_LEAD", "HVI_CH3_Phase0", "PhaseIterator"
+        "Set Frequency CH3", lead, "HVI_CH3_PhaseInc0A", "FrequencyIterator"
     )
     hvi.writeFpgaRegister(
-        "Set Phase CH4", "AWG_LEAD", "HVI_CH4_Phase0", "PhaseIterator"
+        "Set Frequency CH4", lead, "HVI_CH4_PhaseInc0A", "FrequencyIterator"
     )
+    hvi.writeFpgaRegister("Set Phase CH1", lead, "HVI_CH1_Phase0", "PhaseIterator")
+    hvi.writeFpgaRegister("Set Phase CH3", lead, "HVI_CH3_Phase0", "PhaseIterator")
+    hvi.writeFpgaRegister("Set Phase CH4", lead, "HVI_CH4_Phase0", "PhaseIterator")
     hvi.end_sync_multi_sequence_block()
     hvi.end_syncWhile()
     # End Main Loop
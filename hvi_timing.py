@@ -0,0 +1,383 @@
+"""
+Static timing analysis of hvi_ir programs.
+
+analyze() works out, without running anything, how long each while loop
+iteration takes, how many iterations it makes, the resulting trigger rate and
+the total run time of a program. Given the Config the program was built from,
+it also warns when triggers come faster than the AWG waveforms (pri) or the
+DAQ captures (captureTime) last, and when a DAQ is sent a different number of
+triggers than it expects to capture.
+
+Loop iteration counts are inferred by running a loop body twice from the
+register values at the start of the loop: the loop register must change by
+the same step each time. Values the program cannot know (e.g. read from the
+FPGA) make the counts, and the times that depend on them, None.
+
+The report is a dictionary (see analyze()) that write_report() saves as JSON:
+
+    python hvi_timing.py [config] [report.json]
+"""
+
+import sys
+import json
+import math
+import operator
+import logging
+import importlib
+from collections import Counter
+
+import hvi_ir
+import averager_model
+
+log = logging.getLogger(__name__)
+
+# The HVI engines run at 100 MHz
+CLOCK_PERIOD = 10
+# Time taken to execute one instruction, in ns
+INSTRUCTION_TIME = 10
+# Time taken to evaluate a while loop's condition and branch back, in ns
+LOOP_BACK_TIME = 10
+
+_comparisons = {
+    "EQUAL_TO": operator.eq,
+    "NOT_EQUAL_TO": operator.ne,
+    "GREATER_THAN": operator.gt,
+    "GREATER_THAN_OR_EQUAL_TO": operator.ge,
+    "LESS_THAN": operator.lt,
+    "LESS_THAN_OR_EQUAL_TO": operator.le,
+}
+
+
+def analyze(program, config=None):
+    """
+    Returns the timing report of <program>:
+
+    {
+        "program": name,
+        "clock_period_ns": engine clock period,
+        "total_ns": run time, "total_cycles": run time in clock cycles,
+        "loops": [{
+            "name", "engine", "register", "comparison", "value",
+            "depth": nesting depth (0 = outermost),
+            "entries": times the loop is started,
+            "iterations": iterations each time it is started,
+            "period_ns", "period_cycles": time for one iteration,
+            "rate_hz": iterations per second,
+            "total_ns": time spent in the loop over the whole run,
+            "triggers": modules whose actions the loop executes directly,
+        }],
+        "actions": {module: {action: times executed}},
+        "warnings": [text],
+    }
+    """
+    analysis = _Analysis()
+    state = {key: r.initial_value for key, r in program.registers.items()}
+    total = analysis.run_sync(program.statements, state, 1, True)
+    actions = {}
+    for (module, action), count in analysis.actions.items():
+        actions.setdefault(module, {})[action] = count
+    report = {
+        "program": program.name,
+        "clock_period_ns": CLOCK_PERIOD,
+        "total_ns": total,
+        "total_cycles": _div(total, CLOCK_PERIOD),
+        "loops": analysis.loops,
+        "actions": actions,
+        "warnings": analysis.warnings,
+    }
+    if config is not None:
+        report["warnings"] += check(report, config)
+    return report
+
+
+def check(report, config):
+    """Returns warnings about <report>'s timing against <config>"""
+    warnings = []
+    constants = {c.name: c.value for c in config.hvi.constants}
+    limits = {}
+    for module in config.modules:
+        if hasattr(module, "pulseDescriptors"):
+            used = set(
+                item.pulse_id for queue in module.queues for item in queue.items
+            )
+            limits[module.name] = [
+                (f"pulse {p.id} pri", p.pri * 1e9)
+                for p in module.pulseDescriptors
+                if p.id in used
+            ]
+        elif hasattr(module, "daqs"):
+            limits[module.name] = [
+                (f"DAQ {daq.channel} captureTime", daq.captureTime * 1e9)
+                for daq in module.daqs
+                if daq.trigger
+            ]
+    gap = constants.get("Gap")
+    if gap is not None:
+        for module, module_limits in limits.items():
+            for what, length in module_limits:
+                if gap < length:
+                    warnings.append(
+                        f"Gap ({gap} ns) is shorter than {module} {what} "
+                        f"({length:.0f} ns)"
+                    )
+    for loop in report["loops"]:
+        if loop["period_ns"] is None:
+            if loop["triggers"]:
+                warnings.append(
+                    f"Cannot tell how often loop '{loop['name']}' triggers "
+                    f"{', '.join(loop['triggers'])}"
+                )
+            continue
+        for module in loop["triggers"]:
+            for what, length in limits.get(module, []):
+                if loop["period_ns"] < length:
+                    warnings.append(
+                        f"Loop '{loop['name']}' triggers {module} every "
+                        f"{loop['period_ns']} ns, before its {what} "
+                        f"({length:.0f} ns) has finished"
+                    )
+    for module in config.modules:
+        if not hasattr(module, "daqs"):
+            continue
+        actions = report["actions"].get(module.name, {})
+        registers = {r.name: r.value for r in module.fpga.pc_registers}
+        for daq in module.daqs:
+            # 0 captures until stopped
+            if not daq.trigger or daq.captureCount == 0:
+                continue
+            triggers = actions.get(f"daq{daq.channel}_trigger", 0)
+            if triggers is None:
+                continue
+            # An averager image captures once per <averages> triggers
+            settings = averager_model.Settings.from_registers(registers, daq.channel)
+            captures = triggers // settings.averages
+            if captures < daq.captureCount:
+                warnings.append(
+                    f"{module.name} DAQ {daq.channel} is triggered {triggers} "
+                    f"times but waits for {daq.captureCount} captures (underrun)"
+                )
+            elif captures > daq.captureCount:
+                warnings.append(
+                    f"{module.name} DAQ {daq.channel} is triggered {triggers} "
+                    f"times but only captures {daq.captureCount} (overrun)"
+                )
+    return warnings
+
+
+def loop_periods(program):
+    """Returns {loop name: time for one iteration in ns}"""
+    periods = {}
+    for loop in analyze(program)["loops"]:
+        periods.setdefault(loop["name"], loop["period_ns"])
+    return periods
+
+
+def write_report(report, filename):
+    with open(filename, "w") as f:
+        json.dump(report, f, indent=2)
+    log.info(f"Timing report written to: {filename}")
+
+
+def _add(*values):
+    if any(v is None for v in values):
+        return None
+    return sum(values)
+
+
+def _mul(*values):
+    if any(v is None for v in values):
+        return None
+    result = 1
+    for value in values:
+        result *= value
+    return result
+
+
+def _div(value, divisor):
+    return None if value is None else value // divisor
+
+
+def _iterations(comparison, start, step, value):
+    """Number of iterations of a loop on a register starting at <start>"""
+    holds = _comparisons[comparison]
+    if start is None:
+        return None
+    if not holds(start, value):
+        return 0
+    if not step:
+        return None
+    if comparison == "LESS_THAN" and step > 0:
+        return math.ceil((value - start) / step)
+    if comparison == "LESS_THAN_OR_EQUAL_TO" and step > 0:
+        return (value - start) // step + 1
+    if comparison == "GREATER_THAN" and step < 0:
+        return math.ceil((start - value) / -step)
+    if comparison == "GREATER_THAN_OR_EQUAL_TO" and step < 0:
+        return (start - value) // -step + 1
+    if comparison == "EQUAL_TO":
+        return 1
+    if comparison == "NOT_EQUAL_TO" and (value - start) % step == 0:
+        if (value - start) // step > 0:
+            return (value - start) // step
+    # The register moves away from the end condition
+    return None
+
+
+class _Analysis:
+    def __init__(self):
+        self.loops = []
+        self.actions = Counter()
+        self.warnings = []
+        # Records of the loops being run, innermost last
+        self.stack = []
+
+    def run_sync(self, statements, state, multiplier, record):
+        """Runs <statements> once, returns their duration"""
+        total = 0
+        for statement in statements:
+            if isinstance(statement, hvi_ir.SyncWhile):
+                duration = self.run_while(statement, state, multiplier, record)
+            else:
+                duration = 0
+                for sequence in statement.sequences.values():
+                    duration = _max(
+                        duration, self.run_local(sequence, state, multiplier, record)
+                    )
+            total = _add(total, statement.delay, duration)
+        return total
+
+    def run_while(self, loop, state, multiplier, record):
+        key = (loop.engine, loop.register)
+        first = dict(state)
+        period = _add(
+            self.run_sync(loop.statements, first, multiplier, False), LOOP_BACK_TIME
+        )
+        second = dict(first)
+        self.run_sync(loop.statements, second, multiplier, False)
+        step = _step(state.get(key), first.get(key), second.get(key))
+        iterations = _iterations(loop.comparison, state.get(key), step, loop.value)
+        if iterations is None and record:
+            self.warnings.append(
+                f"Cannot tell how many iterations loop '{loop.name}' makes"
+            )
+        if record:
+            entry = {
+                "name": loop.name,
+                "engine": loop.engine,
+                "register": loop.register,
+                "comparison": loop.comparison,
+                "value": loop.value,
+                "depth": len(self.stack),
+                "entries": multiplier,
+                "iterations": iterations,
+                "period_ns": period,
+                "period_cycles": _div(period, CLOCK_PERIOD),
+                "rate_hz": None if not period else 1e9 / period,
+                "total_ns": _mul(multiplier, iterations, period),
+                "triggers": [],
+            }
+            self.loops.append(entry)
+            self.stack.append(entry)
+            self.run_sync(
+                loop.statements, dict(state), _mul(multiplier, iterations), True
+            )
+            self.stack.pop()
+        # Registers after the last iteration
+        for register in set(first) | set(state):
+            before = state.get(register)
+            after = first.get(register)
+            if iterations == 0 or before == after:
+                continue
+            if iterations is None:
+                state[register] = None
+            elif after == second.get(register):
+                state[register] = after
+            else:
+                step = _step(before, after, second.get(register))
+                state[register] = None if step is None else before + iterations * step
+        return _mul(iterations, period)
+
+    def run_local(self, statements, state, multiplier, record):
+        total = 0
+        for statement in statements:
+            total = _add(total, statement.delay)
+            if isinstance(statement, hvi_ir.If):
+                current = state.get((statement.module, statement.register))
+                # When the condition is unknown, assume the longer path
+                if current is None or _comparisons[statement.comparison](
+                    current, statement.value
+                ):
+                    total = _add(
+                        total,
+                        self.run_local(statement.statements, state, multiplier, record),
+                    )
+            elif isinstance(statement, hvi_ir.Instruction):
+                total = _add(total, INSTRUCTION_TIME)
+                self.execute(statement, state, multiplier, record)
+        return total
+
+    def execute(self, statement, state, multiplier, record):
+        module = statement.module
+        operands = statement.operands
+
+        def value(operand):
+            operand = operands[operand]
+            if type(operand) is str:
+                return state.get((module, operand))
+            return operand
+
+        operation = statement.operation
+        if operation == "assign":
+            state[(module, operands["destination"])] = value("source")
+        elif operation in ("add", "subtract"):
+            left = value("left_operand")
+            right = value("right_operand")
+            if left is None or right is None:
+                result = None
+            elif operation == "add":
+                result = left + right
+            else:
+                result = left - right
+            state[(module, operands["destination"])] = result
+        elif operation == "fpga_register_read":
+            state[(module, operands["destination"])] = None
+        elif operation == "action_execute" and record:
+            for action in operands["action"]:
+                if multiplier is None:
+                    self.actions[(module, action)] = None
+                elif self.actions.get((module, action), 0) is not None:
+                    self.actions[(module, action)] += multiplier
+            if self.stack and module not in self.stack[-1]["triggers"]:
+                self.stack[-1]["triggers"].append(module)
+
+
+def _max(a, b):
+    if a is None or b is None:
+        return None
+    return max(a, b)
+
+
+def _step(start, first, second):
+    """The change per iteration, if it is the same in the first two"""
+    if start is None or first is None or second is None:
+        return None
+    if first - start != second - first:
+        return None
+    return first - start
+
+
+if __name__ == "__main__":
+    import Configuration
+    import hvi_wrap
+
+    logging.basicConfig(level=logging.INFO)
+    config = Configuration.loadConfig(sys.argv[1] if len(sys.argv) > 1 else "latest")
+    hvi = importlib.import_module(config.hvi.hviFile)
+    hvi.configure_hvi(config)
+    report = analyze(hvi_wrap.program, config)
+    for warning in report["warnings"]:
+        log.warning(warning)
+    if len(sys.argv) > 2:
+        write_report(report, sys.argv[2])
+    else:
+        print(json.dumps(report, indent=2))
@@ -0,0 +1,146 @@
+"""
+Derives the modules' roles in an HVI sequence from a Config.
+
+Sequences used to name their modules: AWG_LEAD holds the counters and
+triggers its channels, AWG_FOLLOW_0 and DIG_0 are triggered alongside. A
+Topology works these out from Config.modules instead:
+
+- the lead engine (the first AWG), which holds the loop counters,
+- the actions that trigger each module, from the channels of its queues with
+  triggered items and of its DAQs that are triggered,
+- the AWGs whose FPGA has an LO phase reset register,
+- the chassis the HVI spans, and the PXI trigger lines it synchronizes with:
+  one per module of the fan-out in the busiest chassis (each chassis has its
+  own backplane lines), taken in order from Hvi.triggers or all eight, so the
+  other lines stay free,
+
+and emits the statements that fan out to every module, so adding a module to
+a sequence only means adding it to the Config.
+"""
+
+import logging
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Dict, List
+
+import hvi_wrap as hvi
+
+log = logging.getLogger(__name__)
+
+PHASE_RESET = "HVI_GLOBAL_PhaseReset"
+PXI_TRIGGERS = list(range(8))
+# Fewest PXI lines given to an HVI's synchronization
+MIN_PXI_TRIGGERS = 2
+
+
+@dataclass
+class Topology:
+    lead: str
+    awgs: List[str] = field(default_factory=list)
+    digitizers: List[str] = field(default_factory=list)
+    # {module name: [actions that trigger it]}
+    triggers: Dict[str, List[str]] = field(default_factory=dict)
+    # AWGs with an LO phase reset register
+    phase_resets: List[str] = field(default_factory=list)
+    chassis_list: List[int] = field(default_factory=lambda: [1])
+    pxi_triggers: List[int] = field(default_factory=lambda: list(PXI_TRIGGERS))
+
+
+def from_config(config):
+    """Returns the Topology of <config>'s modules"""
+    awgs = [m for m in config.modules if hasattr(m, "pulseDescriptors")]
+    digitizers = [m for m in config.modules if hasattr(m, "daqs")]
+    triggers = {}
+    for module in awgs:
+        channels = sorted(
+            set(
+                queue.channel
+                for queue in module.queues
+                if any(item.trigger for item in queue.items)
+            )
+        )
+        triggers[module.name] = [f"awg{channel}_trigger" for channel in channels]
+    for module in digitizers:
+        channels = sorted(set(daq.channel for daq in module.daqs if daq.trigger))
+        triggers[module.name] = [f"daq{channel}_trigger" for channel in channels]
+    if awgs:
+        lead = awgs[0].name
+    else:
+        lead = config.modules[0].name
+        log.warning(f"No AWG in the config, {lead} holds the HVI counters")
+    triggers = {name: actions for name, actions in triggers.items() if actions}
+    return Topology(
+        lead,
+        [m.name for m in awgs],
+        [m.name for m in digitizers],
+        triggers,
+        [
+            m.name
+            for m in awgs
+            if any(r.name == PHASE_RESET for r in m.fpga.hvi_registers)
+        ],
+        sorted(set(m.chassis for m in config.modules)),
+        pxi_lines(config, [lead] + [name for name in triggers if name != lead]),
+    )
+
+
+def pxi_lines(config, synchronized):
+    """
+    Allocates the PXI trigger lines of an HVI whose fan-out spans the modules
+    named <synchronized>: one line per such module in the chassis that has
+    the most of them, at least MIN_PXI_TRIGGERS, from the lines the config
+    allows (Hvi.triggers, or all eight) in order.
+    """
+    available = config.hvi.triggers
+    if available is None:
+        available = PXI_TRIGGERS
+    chassis = {m.name: m.chassis for m in config.modules}
+    per_chassis = Counter(chassis[name] for name in synchronized)
+    needed = max([MIN_PXI_TRIGGERS] + list(per_chassis.values()))
+    if needed > len(available):
+        log.warning(
+            f"The HVI synchronizes {needed} modules in one chassis with "
+            f"{len(available)} PXI lines, they share lines"
+        )
+    return list(available[:needed])
+
+
+def define_system(config, topology, name):
+    """Starts the definition of HVI <name>, using every module of <config>"""
+    modules = []
+    for module in config.modules:
+        modules.append(
+            hvi.ModuleDescriptor(
+                name=module.name,
+                hvi_registers=[reg.name for reg in module.hvi_registers],
+                handle=module.handle,
+                fpga=module.fpga.image_file,
+            )
+        )
+    return hvi.define_system(
+        name,
+        modules=modules,
+        chassis_list=topology.chassis_list,
+        pxi_triggers=topology.pxi_triggers,
+        lazy=True,
+    )
+
+
+def trigger_all(topology, name):
+    """Triggers every module, in the current sync block"""
+    for module, actions in topology.triggers.items():
+        hvi.execute_actions(name, module, actions)
+
+
+def reset_phases(topology, deassert_first=True):
+    """
+    Pulses the LO phase reset of every AWG, in the current sync block.
+    deassert_first : deassert the reset before asserting it
+    """
+    for module in topology.phase_resets:
+        if deassert_first:
+            hvi.writeFpgaRegister(
+                "deassert LO Phase Reset", module, PHASE_RESET, 0b0000
+            )
+        hvi.writeFpgaRegister("Assert LO Phase Reset", module, PHASE_RESET, 0b1111)
+        hvi.writeFpgaRegister("deassert LO Phase Reset", module, PHASE_RESET, 0b0000)
@@ -3,51 +3,55 @@
 Created on Tue Nov 24 08:29:02 2020
 
 @author: Guy McBride
+
+The functions below describe the sequence as an hvi_ir.Program, which needs
+no vendor library. start() lowers the program into keysight_hvi objects and
+compiles it, unless the same program is already loaded in the hardware.
 """
 
-import sys
 import os
+import time
 import logging
-from dataclasses import dataclass, field
 from collections import deque
-from typing import List
-
-
-sys.path.append(
-    r"C:/Program Files/Keysight/PathWave Test Sync Executive 2020 Update 1.0/api/python"
-)
-import keysight_hvi as kthvi
-
-sys.path.append(r"C:\Program Files (x86)\Keysight\SD1\Libraries\Python")
-import keysightSD1 as key
 
+import hvi_ir
+import hvi_opt
+import k7z_index
+from hvi_ir import ModuleDescriptor
 
 log = logging.getLogger(__name__)
 
-# Cached record of modules that are used in the HVI.
-modules = None
+# The program being described
+program = None
+modules_by_name = {}
+current_sync_sequence = deque()
+# Open local sequences of each module: {module name: deque of statement lists}
+current_sequences = {}
+# keysight_hvi objects of the last lowered program
 system_definition = None
 sequencer = None
-current_sync_sequence = deque()
-current_block = deque()
 hvi_handle = None
+# Fingerprint of the program that hvi_handle was compiled from, and the module
+# handles it was compiled for
+loaded_fingerprint = None
+loaded_handles = []
+# Optimize programs (see hvi_opt) before lowering them. This shortens block
+# and loop delays, so it is only done when HVI_OPTIMIZE is set.
+optimize = bool(os.getenv("HVI_OPTIMIZE"))
+# Statement names of each sequence, and the last count suffixed to each name:
+# {id: (sequence, counts, names used)}
+statement_counts = {}
 
 
-@dataclass
-class ModuleDescriptor:
-    """Holds a 'description' of a used module """
+def _drivers():
+    # The vendor libraries are only needed to lower and run a program
+    from drivers import kthvi
 
-    name: str
-    events: List[str] = field(default_factory=list)
-    actions: List[str] = field(default_factory=list)
-    hvi_registers: List[str] = field(default_factory=list)
-    fpga: str = None
-    handle: int = None
-    _current_sequence = None
+    return kthvi
 
 
 def define_system(name: str, **kwargs):
-    global modules, system_definition, sequencer, current_sync_sequence
+    global program, modules_by_name, current_sync_sequence, current_sequences
     pxi_triggers = [trigger for trigger in range(8)]
 
     defaultKwargs = {
@@ -55,13 +59,123 @@ def define_system(name: str, **kwargs):
         "pxi_triggers": pxi_triggers,
         "modules": [],
         "simulate": False,
+        "lazy": False,
     }
     kwargs = {**defaultKwargs, **kwargs}
     modules = kwargs["modules"]
+    modules_by_name = {module.name: module for module in modules}
+    program = hvi_ir.Program(
+        name,
+        modules=modules,
+        chassis_list=kwargs["chassis_list"],
+        pxi_triggers=kwargs["pxi_triggers"],
+        simulate=kwargs["simulate"],
+        lazy=kwargs["lazy"],
+    )
+    current_sync_sequence = deque([program.statements])
+    current_sequences = {module.name: deque() for module in modules}
+    for module in modules:
+        for register in module.hvi_registers:
+            program.add_register(module.name, register)
+    return program
+
+
+def parameter(module, name, value):
+    """
+    Declares HVI register <name> in <module>, initialized to <value> at the
+    start of every run.
 
-    system_definition = kthvi.SystemDefinition(name)
-    for chassis in kwargs["chassis_list"]:
-        if kwargs["simulate"]:
+    Initial values are not compiled into the HVI, so changing <value> reuses
+    the loaded HVI instead of compiling it again.
+    """
+    program.add_register(module, name, value)
+
+
+def start():
+    """
+    Compiles the program, loads it and runs it. If the same program is
+    already loaded for the same open modules (e.g. only parameter values
+    changed) it is run again with the new initial register values instead.
+
+    The reuse relies on run() leaving the registers as written: the hardware
+    sets them to their initial values in load_to_hw(), not in run(). The loaded
+    HVI is only reused within a process that keeps it open (a session or a
+    sweep); QuadLO.main() releases it with close() when its run ends.
+    """
+    global hvi_handle, loaded_fingerprint, loaded_handles
+    target = program
+    if optimize:
+        target, report = hvi_opt.optimize(program)
+    current = hvi_ir.fingerprint(target)
+    handles = [module.handle for module in program.modules]
+    if (
+        hvi_handle is not None
+        and current == loaded_fingerprint
+        # A module that was closed and opened again needs the HVI loaded again
+        and len(handles) == len(loaded_handles)
+        and all(a is b for a, b in zip(handles, loaded_handles))
+    ):
+        log.info("HVI unchanged, reusing the loaded HVI...")
+        scopes = hvi_handle.sync_sequence.scopes
+        for register in program.registers.values():
+            scopes[register.module].registers[register.name].write(
+                register.initial_value
+            )
+    else:
+        if hvi_handle is not None:
+            close()
+        start_time = time.perf_counter()
+        lower(target)
+        lowered = time.perf_counter()
+        log.info("Compiling HVI...")
+        hvi_handle = sequencer.compile()
+        compiled = time.perf_counter()
+        log.info(
+            f"HVI defined in {lowered - start_time:.3f}s, "
+            f"compiled in {compiled - lowered:.3f}s"
+        )
+        log.info("Loading HVI to HW...")
+        hvi_handle.load_to_hw()
+        loaded_fingerprint = current
+        loaded_handles = handles
+    log.info("Starting HVI...")
+    hvi_handle.run(hvi_handle.no_timeout)
+    return
+
+
+def close():
+    global hvi_handle, loaded_fingerprint, loaded_handles
+    log.info("Releasing HVI...")
+    hvi_handle.release_hw()
+    hvi_handle = None
+    loaded_fingerprint = None
+    loaded_handles = []
+
+
+def show_sequencer():
+    return hvi_ir.to_string(program)
+
+
+def runtime_register(module, register):
+    """Returns the runtime handle of HVI register <register> of <module>"""
+    return hvi_handle.sync_sequence.scopes[module].registers[register]
+
+
+def read_register_runtime(module, register):
+    return runtime_register(module, register).read()
+
+
+# Lowering into keysight_hvi
+
+
+def lower(program):
+    """Creates the keysight_hvi system definition and sequencer for <program>"""
+    global system_definition, sequencer, statement_counts
+    kthvi = _drivers()
+    statement_counts = {}
+    system_definition = kthvi.SystemDefinition(program.name)
+    for chassis in program.chassis_list:
+        if program.simulate:
             system_definition.chassis.add_with_options(
                 chassis, "Simulate=True,DriverSetup=model=M9018B,NoDriver=True"
             )
@@ -71,15 +185,18 @@ def define_system(name: str, **kwargs):
     # Add PXI trigger resources that we plan to use
     log.info("Adding PXIe triggers to the HVI environment...")
     pxiTriggers = []
-    for trigger in kwargs["pxi_triggers"]:
+    for trigger in program.pxi_triggers:
         pxiTriggerName = "PXI_TRIGGER{}".format(trigger)
         pxiTrigger = getattr(kthvi.TriggerResourceId, pxiTriggerName)
         pxiTriggers.append(pxiTrigger)
     system_definition.sync_resources = pxiTriggers
 
     log.info("Adding modules to the HVI environment...")
-    for module in kwargs["modules"]:
-        module._current_sequence = deque()
+    # In lazy mode only the resources the statements use are declared
+    used = hvi_ir.references(program) if program.lazy else None
+    # Number of [declared, available] actions, events and FPGA sandboxes
+    declared = {"actions": [0, 0], "events": [0, 0], "FPGA sandboxes": [0, 0]}
+    for module in program.modules:
         system_definition.engines.add(
             module.handle.hvi.engines.main_engine, module.name
         )
@@ -91,6 +208,10 @@ def define_system(name: str, **kwargs):
                 ]
             else:
                 actions = module.actions
+            declared["actions"][1] += len(actions)
+            if used is not None:
+                actions = [a for a in actions if a in used[module.name]["actions"]]
+            declared["actions"][0] += len(actions)
             for action in actions:
                 log.info(f"...adding: {action}")
                 action_id = getattr(module.handle.hvi.actions, action)
@@ -104,6 +225,10 @@ def define_system(name: str, **kwargs):
                 ]
             else:
                 events = module.events
+            declared["events"][1] += len(events)
+            if used is not None:
+                events = [e for e in events if e in used[module.name]["events"]]
+            declared["events"][0] += len(events)
             for event in events:
                 log.info(f"...adding: {event}")
                 event_id = getattr(module.handle.hvi.events, event)
@@ -111,140 +236,186 @@ def define_system(name: str, **kwargs):
 
         # Register the FPGA resources used by HVI (exposes the registers)
         if module.fpga:
-            log.info(f"...Declaring FPGA Registers used by: {module.name}...")
-            try:
-                system_definition.engines[module.name].fpga_sandboxes[0].load_from_k7z(
-                    os.getcwd() + "\\" + module.fpga
-                )
-            except Exception as err:
-                if err.args[0] == "No interface named 'MainEngine_Memory'":
-                    log.info("No HVI registers")
-                else:
-                    raise(err)
+            declared["FPGA sandboxes"][1] += 1
+            # None if the image's register map cannot be read
+            names = k7z_index.hvi_registers(module.fpga)
+            if used is not None and names is not None:
+                unknown = used[module.name]["fpga_registers"] - names
+                if unknown:
+                    raise KeyError(f"{module.fpga} has no HVI registers {unknown}")
+            if names == set():
+                log.info(f"No HVI registers in {module.fpga}")
+            elif used is None or used[module.name]["fpga_registers"]:
+                declared["FPGA sandboxes"][0] += 1
+                log.info(f"...Declaring FPGA Registers used by: {module.name}...")
+                sandbox = system_definition.engines[module.name].fpga_sandboxes[0]
+                try:
+                    sandbox.load_from_k7z(os.getcwd() + "\\" + module.fpga)
+                except Exception as err:
+                    if err.args[0] == "No interface named 'MainEngine_Memory'":
+                        log.info("No HVI registers")
+                    else:
+                        raise(err)
  
         for register in system_definition.engines[module.name].fpga_sandboxes[0].fpga_registers:
             log.info(f"...... {register.name}")
             
+    log.info(
+        "Declared "
+        + ", ".join(f"{n} of {total} {kind}" for kind, (n, total) in declared.items())
+    )
     log.info("Creating Main Sequencer Block...")
-    sequencer = kthvi.Sequencer(f"{name}_Sequencer", system_definition)
-    current_sync_sequence.append(sequencer.sync_sequence)
+    sequencer = kthvi.Sequencer(f"{program.name}_Sequencer", system_definition)
 
     log.info("Declaring HVI registers...")
     scopes = sequencer.sync_sequence.scopes
-    for module in kwargs["modules"]:
-        for register in module.hvi_registers:
-            log.info(
-                f"...Adding register: {register}, "
-                f"initial value: 0 to module: {module.name}"
+    for register in program.registers.values():
+        log.info(
+            f"...Adding register: {register.name}, "
+            f"initial value: {register.initial_value} to module: {register.module}"
+        )
+        registers = scopes[register.module].registers
+        hviRegister = registers.add(register.name, kthvi.RegisterSize.SHORT)
+        hviRegister.initial_value = register.initial_value
+
+    _lower_sync(kthvi, sequencer.sync_sequence, program.statements)
+    return sequencer
+
+
+def _lower_sync(kthvi, sync_sequence, statements):
+    for statement in statements:
+        statement_name = _statement_name(sync_sequence, statement.name)
+        if isinstance(statement, hvi_ir.SyncWhile):
+            whileRegister = sequencer.sync_sequence.scopes[statement.engine].registers[
+                statement.register
+            ]
+            condition = kthvi.Condition.register_comparison(
+                whileRegister,
+                getattr(kthvi.ComparisonOperator, statement.comparison),
+                statement.value,
             )
-            registers = scopes[module.name].registers
-            hviRegister = registers.add(register, kthvi.RegisterSize.SHORT)
-            hviRegister.initial_value = 0
-    return
-
-
-def start():
-    global hvi_handle
-    log.info("Compiling HVI...")
-    hvi_handle = sequencer.compile()
-    log.info("Loading HVI to HW...")
-    hvi_handle.load_to_hw()
-    log.info("Starting HVI...")
-    hvi_handle.run(hvi_handle.no_timeout)
-    return
-
-
-def close():
-    log.info("Releasing HVI...")
-    hvi_handle.release_hw()
+            while_sequence = sync_sequence.add_sync_while(
+                statement_name, statement.delay, condition
+            )
+            _lower_sync(kthvi, while_sequence.sync_sequence, statement.statements)
+        else:
+            block = sync_sequence.add_sync_multi_sequence_block(
+                statement_name, statement.delay
+            )
+            for module, local_statements in statement.sequences.items():
+                _lower_local(kthvi, block.sequences[module], local_statements)
+
+
+def _lower_local(kthvi, sequence, statements):
+    for statement in statements:
+        statement_name = _statement_name(sequence, statement.name)
+        if isinstance(statement, hvi_ir.Delay):
+            sequence.add_delay(statement_name, statement.delay)
+        elif isinstance(statement, hvi_ir.If):
+            if_condition = kthvi.Condition.register_comparison(
+                sequence.scope.registers[statement.register],
+                getattr(kthvi.ComparisonOperator, statement.comparison),
+                statement.value,
+            )
+            enable_matching_branches = True
+            if_statement = sequence.add_if(
+                statement_name, statement.delay, if_condition, enable_matching_branches
+            )
+            _lower_local(kthvi, if_statement.if_branch.sequence, statement.statements)
+        else:
+            if statement.operation in hvi_ir.NATIVE_INSTRUCTIONS:
+                command = getattr(sequence.instruction_set, statement.operation)
+            else:
+                handle = _get_module(statement.module).handle
+                command = getattr(handle.hvi.instruction_set, statement.operation)
+            instruction = sequence.add_instruction(
+                statement_name, statement.delay, command.id
+            )
+            for parameter, value in statement.operands.items():
+                instruction.set_parameter(
+                    getattr(command, parameter).id,
+                    _lower_operand(sequence, parameter, value),
+                )
 
 
-def show_sequencer():
-    return sequencer.sync_sequence.to_string(kthvi.OutputFormat.DEBUG)
+def _lower_operand(sequence, parameter, value):
+    if parameter == "fpga_register":
+        return sequence.engine.fpga_sandboxes[0].fpga_registers[value]
+    if parameter == "action":
+        return [sequence.engine.actions[action] for action in value]
+    if type(value) is str:
+        return sequence.scope.registers[value]
+    return value
 
 
 # Helper Functions
 
 
 def _get_module(name):
-    return [i for i in modules if i.name == name][0]
+    return modules_by_name[name]
 
 
 def _get_current_sequence(module_name):
-    return _get_module(module_name)._current_sequence[-1]
+    return current_sequences[module_name][-1]
 
 
 def _push_current_sequence(module_name, sequence):
-    _get_module(module_name)._current_sequence.append(sequence)
+    current_sequences[module_name].append(sequence)
 
 
 def _pop_current_sequence(module_name):
-    _get_module(module_name)._current_sequence.pop()
+    current_sequences[module_name].pop()
 
 
 def _statement_name(sequence, name):
-    statement_names = [s.name for s in sequence.statements if s.name.startswith(name)]
-    if len(statement_names) == 0:
-        statement_name = name
-    else:
-        statement_name = f"{name}_{len(statement_names)}"
-    return statement_name
+    """
+    Returns <name>, suffixed with a count if already used in <sequence>. The
+    count is bumped past names used literally, e.g. "X_1" before a second "X".
+    """
+    _, counts, used = statement_counts.setdefault(id(sequence), (sequence, {}, set()))
+    count = counts.get(name, 0)
+    unique = name
+    while unique in used:
+        count += 1
+        unique = f"{name}_{count}"
+    counts[name] = count
+    used.add(unique)
+    return unique
 
 
-def _sync_statement_name(sequence, name):
-    statement_names = [
-        s.name for s in sequence.sync_statements if s.name.startswith(name)
-    ]
-    if len(statement_names) == 0:
-        statement_name = name
-    else:
-        statement_name = f"{name}_{len(statement_names)}"
-    return statement_name
+def _add(module, statement):
+    log.info(f"......{statement.name}")
+    _get_current_sequence(module).append(statement)
 
 
 # Syncronous Block Statements
 
 
 def start_syncWhile_register(name, engine, register, comparison, value, delay=70):
-    global current_sync_sequence
-    sequence = current_sync_sequence[-1]
-    statement_name = _sync_statement_name(sequence, name)
-    whileRegister = sequencer.sync_sequence.scopes[engine].registers[register]
-    comparison_operator = getattr(kthvi.ComparisonOperator, comparison)
-
-    log.info(f"Creating Synchronized While loop, {value} iterations...")
-    condition = kthvi.Condition.register_comparison(
-        whileRegister, comparison_operator, value
-    )
-    while_sequence = sequence.add_sync_while(
-        statement_name, delay, condition
-    )
-    current_sync_sequence.append(while_sequence.sync_sequence)
+    log.info(f"Creating Synchronized While loop, {register} {comparison} {value}...")
+    statement = hvi_ir.SyncWhile(name, engine, register, comparison, value, delay)
+    current_sync_sequence[-1].append(statement)
+    current_sync_sequence.append(statement.statements)
     return
 
 
 def end_syncWhile():
-    global current_sync_sequence
     current_sync_sequence.pop()
     return
 
 
 def start_sync_multi_sequence_block(name, delay=30):
-    global current_block, modules
-    sequence = current_sync_sequence[-1]
-    statement_name = _sync_statement_name(sequence, name)
-    block = sequence.add_sync_multi_sequence_block(statement_name, delay)
-    current_block.append(block)
-    for module in modules:
-        module._current_sequence.append(block.sequences[module.name])
+    block = hvi_ir.SyncBlock(name, delay)
+    current_sync_sequence[-1].append(block)
+    for module in program.modules:
+        block.sequences[module.name] = []
+        _push_current_sequence(module.name, block.sequences[module.name])
     return
 
 
 def end_sync_multi_sequence_block():
-    global current_block
-    current_block.pop()
-    for module in modules:
-        module._current_sequence.pop()
+    for module in program.modules:
+        _pop_current_sequence(module.name)
 
 
 # Native HVI Sequence Instructions
@@ -254,19 +425,11 @@ def if_register_comparison(name, module, register, comparison, value, delay=10):
     """
     Inserts an 'if' statement in the flow following instructions
     are only executed if condition evalutes to True. This should be terminated
-    with
+    with end_if()
     """
-    sequence = _get_current_sequence(module)
-    statement_name = _statement_name(sequence, name)
-    comparison_operator = getattr(kthvi.ComparisonOperator, comparison)
-    if_condition = kthvi.Condition.register_comparison(
-        register, comparison_operator, value
-    )
-    enable_matching_branches = True
-    if_statement = sequence.add_if(
-        statement_name, delay, if_condition, enable_matching_branches
-    )
-    _push_current_sequence(module, if_statement.if_branch.sequence)
+    statement = hvi_ir.If(name, module, register, comparison, value, delay)
+    _add(module, statement)
+    _push_current_sequence(module, statement.statements)
 
 
 def end_if(module):
@@ -274,24 +437,9 @@ def end_if(module):
 
 
 def set_register(name, module, register, value, delay=10):
-    """Sets <register> in <module> to <value>"""
-    sequence = _get_current_sequence(module)
-    statement_name = _statement_name(sequence, name)
-    register_id = sequence.scope.registers[register]
-    log.info(f"......{statement_name}")
-    instruction = sequence.add_instruction(
-        statement_name, delay, sequence.instruction_set.assign.id
-    )
-    instruction.set_parameter(
-        sequence.instruction_set.assign.destination.id, register_id
-    )
-    instruction.set_parameter(sequence.instruction_set.assign.source.id, value)
-
-
-def read_register_runtime(module, register):
-    register_runtime = hvi_handle.sync_sequence.scopes[module].registers[register]
-    value = register_runtime.read()
-    return value
+    """Sets <register> in <module> to <value> (a number or a register name)"""
+    operands = {"destination": register, "source": value}
+    _add(module, hvi_ir.Instruction(name, module, "assign", operands, delay))
 
 
 def incrementRegister(name, module, register, delay=10):
@@ -300,17 +448,13 @@ def incrementRegister(name, module, register, delay=10):
 
 
 def addToRegister(name, module, register, value, delay=10):
-    """Adds <value> to <register> in <module>"""
-    sequence = _get_current_sequence(module)
-    statement_name = _statement_name(sequence, name)
-    register_id = sequence.scope.registers[register]
-    log.info(f"......{statement_name}")
-    instruction = sequence.add_instruction(
-        statement_name, delay, sequence.instruction_set.add.id
-    )
-    instruction.set_parameter(sequence.instruction_set.add.destination.id, register_id)
-    instruction.set_parameter(sequence.instruction_set.add.left_operand.id, register_id)
-    instruction.set_parameter(sequence.instruction_set.add.right_operand.id, value)
+    """Adds <value> (a number or a register name) to <register> in <module>"""
+    operands = {
+        "destination": register,
+        "left_operand": register,
+        "right_operand": value,
+    }
+    _add(module, hvi_ir.Instruction(name, module, "add", operands, delay))
 
 
 def writeFpgaRegister(name, module, register, value, delay=10):
@@ -319,38 +463,29 @@ def writeFpgaRegister(name, module, register, value, delay=10):
 
     name : title given to this instruction.
     register : name of the FPGA register
-    value : to be written to the register
+    value : to be written to the register (a number or an HVI register name)
     """
-    sequence = _get_current_sequence(module)
-    statement_name = _statement_name(sequence, name)
-    register_id = sequence.engine.fpga_sandboxes[0].fpga_registers[register]
-    log.info(f"......{statement_name}")
-    reg_cmd = sequence.instruction_set.fpga_register_write
-    instruction = sequence.add_instruction(statement_name, delay, reg_cmd.id)
-    instruction.set_parameter(reg_cmd.fpga_register.id, register_id)
-    if type(value) is str:
-        value = sequence.scope.registers[value]
-    instruction.set_parameter(reg_cmd.value.id, value)
+    operands = {"fpga_register": register, "value": value}
+    _add(
+        module,
+        hvi_ir.Instruction(name, module, "fpga_register_write", operands, delay),
+    )
     return
 
 
 def readFpgaRegister(name, module, fpga_register, hvi_register, delay=10):
     """
-    Writes <value> to module's FPGA register: <register>.
+    Reads module's FPGA register: <fpga_register> into <hvi_register>.
 
     name : title given to this instruction.
-    register : name of the FPGA register
-    value : to be written to the register
+    fpga_register : name of the FPGA register
+    hvi_register : name of the HVI register to hold the value
     """
-    sequence = _get_current_sequence(module)
-    statement_name = _statement_name(sequence, name)
-    register_id = sequence.engine.fpga_sandboxes[0].fpga_registers[fpga_register]
-    log.info(f"......{statement_name}")
-    reg_cmd = sequence.instruction_set.fpga_register_read
-    instruction = sequence.add_instruction(statement_name, delay, reg_cmd.id)
-    instruction.set_parameter(reg_cmd.fpga_register.id, register_id)
-    dest_register = sequence.scope.registers[hvi_register]
-    instruction.set_parameter(reg_cmd.destination.id, dest_register)
+    operands = {"fpga_register": fpga_register, "destination": hvi_register}
+    _add(
+        module,
+        hvi_ir.Instruction(name, module, "fpga_register_read", operands, delay),
+    )
     return
 
 
@@ -359,13 +494,8 @@ def execute_actions(name, module, actions, delay=10):
     Adds an instruction called <name> to sequence for <engine> to the current block
     to execute all <actions>
     """
-    sequence = _get_current_sequence(module)
-    statement_name = _statement_name(sequence, name)
-    log.info(f"......{statement_name}")
-    actionCmd = sequence.instruction_set.action_execute
-    actionParams = [sequence.engine.actions[action] for action in actions]
-    instruction = sequence.add_instruction(statement_name, delay, actionCmd.id)
-    instruction.set_parameter(actionCmd.action.id, actionParams)
+    operands = {"action": list(actions)}
+    _add(module, hvi_ir.Instruction(name, module, "action_execute", operands, delay))
 
 
 def delay(name, module, delay=10):
@@ -373,10 +503,7 @@ def delay(name, module, delay=10):
     Adds an instruction called <name> to sequence for <module> to the current block
     to delay for <delay> ns.
     """
-    sequence = _get_current_sequence(module)
-    statement_name = _statement_name(sequence, name)
-    log.info(f"......{statement_name}")
-    sequence.add_delay(name, delay)
+    _add(module, hvi_ir.Delay(name, module, delay))
 
 
 # AWG specific HVI Sequence Instructions
@@ -387,21 +514,12 @@ def awg_set_amplitude(name, module, channel, value, delay=10):
     Adds an instruction called <name> to <module>'s sequence to set amplitude
     of <channel> to <value>
     """
-    module_name = module
-    sequence = _get_current_sequence(module)
-    statement_name = _statement_name(sequence, name)
-    log.info(f"......{name}")
-    for module in modules:
-        if module.name == module_name:
-            break
-    command = module.handle.hvi.instruction_set.set_amplitude
-    instruction = sequence.add_instruction(statement_name, delay, command.id)
-    instruction.set_parameter(command.channel.id, channel)
-    instruction.set_parameter(command.value.id, value)
+    operands = {"channel": channel, "value": value}
+    _add(module, hvi_ir.Instruction(name, module, "set_amplitude", operands, delay))
 
 
 if __name__ == "__main__":
-    import time
+    from drivers import key
 
     logging.basicConfig(level=logging.INFO)
 
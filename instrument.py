@@ -0,0 +1,271 @@
+"""
+Records where a run spends its time.
+
+When the environment variable HVI_TRACE names an output file, drivers.py wraps
+the keysightSD1 and keysight_hvi libraries with wrap(), so every driver call is
+timed. Scripts mark their major steps with phase(). At the end of a run
+report() writes a Chrome trace (load it in chrome://tracing or
+https://ui.perfetto.dev) and logs a summary table of call counts, latency
+histograms and bytes transferred.
+"""
+
+import os
+import json
+import math
+import time
+import inspect
+import logging
+import weakref
+import threading
+from contextlib import contextmanager
+
+log = logging.getLogger(__name__)
+
+trace_file = os.getenv("HVI_TRACE")
+enabled = bool(trace_file)
+
+# Latency histogram buckets: bucket n holds calls taking < 2**n us
+HISTOGRAM_BUCKETS = 24
+# The AWG stores waveforms as 16 bit samples
+WAVE_SAMPLE_BYTES = 2
+
+
+class CallStats:
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+        self.nbytes = 0
+        self.histogram = [0] * HISTOGRAM_BUCKETS
+
+    def add(self, duration, nbytes):
+        self.count += 1
+        self.total += duration
+        self.maximum = max(self.maximum, duration)
+        self.nbytes += nbytes
+        us = duration * 1e6
+        bucket = 0 if us < 1 else min(int(math.log2(us)) + 1, HISTOGRAM_BUCKETS - 1)
+        self.histogram[bucket] += 1
+
+    def percentile(self, fraction):
+        """Upper bound, in seconds, of the bucket holding the <fraction> percentile"""
+        target = fraction * self.count
+        seen = 0
+        for bucket, count in enumerate(self.histogram):
+            seen += count
+            if seen >= target:
+                return 2 ** bucket * 1e-6
+        return self.maximum
+
+
+class Recorder:
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.events = []
+        self.calls = {}
+        self.phases = {}
+        self._lock = threading.Lock()
+
+    def record(self, name, category, start, duration, nbytes=0):
+        with self._lock:
+            self.events.append(
+                (name, category, start, duration, threading.get_ident(), nbytes)
+            )
+            table = self.phases if category == "phase" else self.calls
+            stats = table.get(name)
+            if stats is None:
+                stats = table[name] = CallStats()
+            stats.add(duration, nbytes)
+
+    def chrome_trace(self):
+        events = []
+        for name, category, start, duration, thread, nbytes in self.events:
+            event = {
+                "name": name,
+                "cat": category,
+                "ph": "X",
+                "ts": (start - self.origin) * 1e6,
+                "dur": duration * 1e6,
+                "pid": os.getpid(),
+                "tid": thread,
+            }
+            if nbytes:
+                event["args"] = {"bytes": nbytes}
+            events.append(event)
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def summary(self):
+        lines = [
+            f"{'Phase / Call':<48}{'Count':>8}{'Total ms':>11}{'Mean us':>10}"
+            f"{'p50 us':>9}{'p99 us':>9}{'Max us':>10}{'Bytes':>12}{'MB/s':>9}"
+        ]
+        for title, table in (("Phases", self.phases), ("Driver calls", self.calls)):
+            lines.append(f"-- {title}")
+            for name, stats in sorted(
+                table.items(), key=lambda item: item[1].total, reverse=True
+            ):
+                rate = stats.nbytes / stats.total / 1e6 if stats.total else 0
+                lines.append(
+                    f"{name:<48}{stats.count:>8}{stats.total * 1e3:>11.2f}"
+                    f"{stats.total / stats.count * 1e6:>10.1f}"
+                    f"{stats.percentile(0.5) * 1e6:>9.0f}"
+                    f"{stats.percentile(0.99) * 1e6:>9.0f}"
+                    f"{stats.maximum * 1e6:>10.1f}{stats.nbytes:>12}{rate:>9.1f}"
+                )
+        return "\n".join(lines)
+
+
+recorder = Recorder()
+
+
+@contextmanager
+def phase(name):
+    """Records the time spent in the enclosed block as phase <name>"""
+    if not enabled:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        recorder.record(name, "phase", start, time.perf_counter() - start)
+
+
+def report(filename=None):
+    """Writes the Chrome trace and logs the summary table (if enabled)"""
+    if not enabled:
+        return
+    filename = filename or trace_file
+    with open(filename, "w") as f:
+        json.dump(recorder.chrome_trace(), f)
+    log.info(f"Timeline written to: {filename}")
+    log.info("Time spent:\n" + recorder.summary())
+
+
+# Driver wrapping
+
+
+def _root_module(value):
+    module = getattr(value, "__module__", None)
+    if not isinstance(module, str):
+        return None
+    return module.split(".")[0]
+
+
+# {SD_Wave: bytes waveformLoad() transfers}, set by SD_Wave.newFromArrayDouble
+_wave_bytes = weakref.WeakKeyDictionary()
+
+
+def _nbytes(value):
+    try:
+        nbytes = _wave_bytes.get(value)
+    except TypeError:
+        # Not weakly referenceable, so not an SD_Wave
+        nbytes = None
+    if nbytes is None:
+        nbytes = getattr(value, "nbytes", None)
+    if isinstance(nbytes, int):
+        return nbytes
+    return 0
+
+
+def _call_nbytes(name, target, args, result):
+    """Bytes transferred by the call <name> to <target>"""
+    if name == "SD_Wave.newFromArrayDouble":
+        # Only copies the samples on the host, waveformLoad() uploads them
+        _wave_bytes[target.__self__] = WAVE_SAMPLE_BYTES * sum(
+            len(data) for data in args[1:] if data is not None
+        )
+        return 0
+    return sum(_nbytes(a) for a in args) + _nbytes(result)
+
+
+def _unwrap(value):
+    if isinstance(value, _Proxy):
+        return object.__getattribute__(value, "_target")
+    if isinstance(value, (list, tuple)):
+        return type(value)(_unwrap(v) for v in value)
+    return value
+
+
+class _Proxy:
+    """Times every call made through a driver object and wraps its results"""
+
+    __slots__ = ("_target", "_name")
+
+    def __init__(self, target, name):
+        object.__setattr__(self, "_target", target)
+        object.__setattr__(self, "_name", name)
+
+    def _wrap(self, value, name):
+        # Containers are wrapped too, so that driver objects held in them
+        # (e.g. the sequences of a multi-sequence block) are timed.
+        if _root_module(value) in _driver_modules or isinstance(value, (list, dict)):
+            return _Proxy(value, name)
+        return value
+
+    def __getattr__(self, attribute):
+        target = object.__getattribute__(self, "_target")
+        value = getattr(target, attribute)
+        if isinstance(target, type) or inspect.ismodule(target):
+            owner = getattr(target, "__name__", "")
+        else:
+            owner = type(target).__name__
+        return self._wrap(value, f"{owner}.{attribute}")
+
+    def __setattr__(self, attribute, value):
+        setattr(object.__getattribute__(self, "_target"), attribute, _unwrap(value))
+
+    def __call__(self, *args, **kwargs):
+        target = object.__getattribute__(self, "_target")
+        name = object.__getattribute__(self, "_name")
+        args = _unwrap(args)
+        kwargs = {k: _unwrap(v) for k, v in kwargs.items()}
+        start = time.perf_counter()
+        result = target(*args, **kwargs)
+        duration = time.perf_counter() - start
+        nbytes = _call_nbytes(name, target, args, result)
+        recorder.record(name, "driver", start, duration, nbytes)
+        return self._wrap(result, type(result).__name__)
+
+    def __getitem__(self, item):
+        target = object.__getattribute__(self, "_target")
+        name = object.__getattribute__(self, "_name")
+        return self._wrap(target[_unwrap(item)], f"{name}[]")
+
+    def __iter__(self):
+        target = object.__getattribute__(self, "_target")
+        name = object.__getattribute__(self, "_name")
+        for item in target:
+            yield self._wrap(item, f"{name}[]")
+
+    def __len__(self):
+        return len(object.__getattribute__(self, "_target"))
+
+    def __dir__(self):
+        return dir(object.__getattribute__(self, "_target"))
+
+    def __contains__(self, item):
+        return _unwrap(item) in object.__getattribute__(self, "_target")
+
+    def __eq__(self, other):
+        return object.__getattribute__(self, "_target") == _unwrap(other)
+
+    def __hash__(self):
+        return hash(object.__getattribute__(self, "_target"))
+
+    def __repr__(self):
+        return repr(object.__getattribute__(self, "_target"))
+
+    def __str__(self):
+        return str(object.__getattribute__(self, "_target"))
+
+
+# Names of the (top level) modules whose objects are wrapped
+_driver_modules = set()
+
+
+def wrap(module):
+    """Returns <module> with every call through it (and its objects) timed"""
+    _driver_modules.add(module.__name__.split(".")[0])
+    return _Proxy(module, module.__name__)
@@ -0,0 +1,234 @@
+"""
+Index of the registers in FPGA images (.k7z files).
+
+A .k7z image is a 7-zip archive whose AddressMapping_0.json lists the sandbox
+registers: those on the "Host" interface are accessed from the PC (PC_*),
+those on the "MainEngine_Memory" interface by the HVI (HVI_*). Reading the
+archive is slow, so each image's register map is read once and kept in
+k7z_index.json, next to the image, keyed by the image's SHA-256.
+
+The index lets register names be checked without any hardware:
+
+    python k7z_index.py [config or image.k7z ...]
+
+The archives are read with py7zr if it is installed, otherwise with the 7-Zip
+command line tool (7z, 7za or 7zr).
+"""
+
+import os
+import sys
+import json
+import shutil
+import hashlib
+import logging
+import tempfile
+import subprocess
+from dataclasses import dataclass, asdict
+
+try:
+    import py7zr
+except ImportError:
+    py7zr = None
+
+log = logging.getLogger(__name__)
+
+INDEX_FILE = "k7z_index.json"
+REGISTER_MAP = "AddressMapping_0.json"
+# Access given by each interface of the register map
+INTERFACES = {"Host": "PC", "MainEngine_Memory": "HVI"}
+
+
+@dataclass
+class FpgaRegister:
+    name: str
+    # Offset in the interface's address space
+    address: int
+    # Address range: bytes for PC registers, words for HVI registers
+    width: int
+    # "PC" or "HVI"
+    access: str
+    # "RW", "RO" or "WO"
+    type: str = "RW"
+
+
+# Register maps already read in this process: {path: (mtime, size, registers)}
+_maps = {}
+_reader_warned = False
+
+
+def register_map(image_file):
+    """
+    Returns {register name: FpgaRegister} for the image <image_file>, or None
+    if it cannot be read.
+    """
+    try:
+        stat = os.stat(image_file)
+    except OSError as err:
+        log.error(f"Cannot open FPGA image: {err}")
+        return None
+    path = os.path.abspath(image_file)
+    cached = _maps.get(path)
+    if cached is not None and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+        return cached[2]
+
+    digest = _sha256(image_file)
+    index_file = os.path.join(os.path.dirname(path), INDEX_FILE)
+    index = _load_index(index_file)
+    entry = index.get(digest)
+    if entry is None:
+        try:
+            content = _read_member(image_file, REGISTER_MAP)
+            if content is None:
+                return None
+            # Images without a sandbox (e.g. the vanilla ones) have an empty map
+            mapping = json.loads(content) if content.strip() else {"mappings": []}
+        except Exception as err:
+            log.warning(f"Cannot read the register map of {image_file}: {err}")
+            return None
+        entry = {
+            "file": os.path.basename(image_file),
+            "registers": [asdict(r) for r in _registers(mapping)],
+        }
+        index[digest] = entry
+        _save_index(index_file, index)
+        log.info(f"Indexed {len(entry['registers'])} registers of {image_file}")
+    registers = {r["name"]: FpgaRegister(**r) for r in entry["registers"]}
+    _maps[path] = (stat.st_mtime_ns, stat.st_size, registers)
+    return registers
+
+
+def pc_registers(image_file):
+    """Names of <image_file>'s registers accessible from the PC, or None"""
+    return _names(image_file, "PC")
+
+
+def hvi_registers(image_file):
+    """Names of <image_file>'s registers accessible from the HVI, or None"""
+    return _names(image_file, "HVI")
+
+
+def validate(config):
+    """
+    Checks every FPGA register named in <config> against its module's image.
+    Returns a list of problems (empty if every name is known, or if an
+    image cannot be read).
+    """
+    problems = []
+    for module in config.modules:
+        image = module.fpga.image_file
+        if image == "":
+            continue
+        for kind, registers in (
+            ("PC", module.fpga.pc_registers),
+            ("HVI", module.fpga.hvi_registers),
+        ):
+            names = _names(image, kind)
+            if names is None:
+                continue
+            for register in registers:
+                if register.name not in names:
+                    problems.append(
+                        f"{module.name}: {image} has no {kind} register "
+                        f"'{register.name}'"
+                    )
+    return problems
+
+
+def _names(image_file, access):
+    registers = register_map(image_file)
+    if registers is None:
+        return None
+    return set(name for name, r in registers.items() if r.access == access)
+
+
+def _registers(mapping):
+    registers = []
+    for interface in mapping["mappings"]:
+        access = INTERFACES.get(interface["interface"])
+        if access is None:
+            continue
+        for address in interface["addresses"]:
+            registers.append(
+                FpgaRegister(
+                    address["symbol"],
+                    address["offset"],
+                    address["range"],
+                    access,
+                    address.get("type", "RW"),
+                )
+            )
+    return registers
+
+
+def _sha256(filename):
+    digest = hashlib.sha256()
+    with open(filename, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _load_index(index_file):
+    if not os.path.exists(index_file):
+        return {}
+    try:
+        with open(index_file, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError) as err:
+        log.warning(f"Ignoring unreadable index {index_file}: {err}")
+        return {}
+
+
+def _save_index(index_file, index):
+    try:
+        with open(index_file + ".tmp", "w") as f:
+            json.dump(index, f, indent=1)
+        os.replace(index_file + ".tmp", index_file)
+    except OSError as err:
+        log.warning(f"Cannot save index {index_file}: {err}")
+
+
+def _read_member(archive, member):
+    """
+    Returns the contents of <member> of the 7-zip <archive>, or None if neither
+    py7zr nor the 7-Zip command line is available.
+    """
+    if py7zr is not None:
+        with tempfile.TemporaryDirectory() as directory:
+            with py7zr.SevenZipFile(archive, "r") as z:
+                z.extract(path=directory, targets=[member])
+            with open(os.path.join(directory, member), "rb") as f:
+                return f.read()
+    for tool in ("7z", "7za", "7zr"):
+        executable = shutil.which(tool)
+        if executable is not None:
+            return subprocess.run(
+                [executable, "e", "-so", archive, member],
+                check=True,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+            ).stdout
+    global _reader_warned
+    if not _reader_warned:
+        log.warning("Cannot read .k7z images: install py7zr or the 7-Zip command line")
+        _reader_warned = True
+    return None
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    for name in sys.argv[1:] or ["latest"]:
+        if name.endswith(".k7z"):
+            registers = register_map(name) or {}
+            for register in registers.values():
+                print(
+                    f"{register.access:<4}{register.address:>6}{register.width:>4} "
+                    f"{register.type:<3}{register.name}"
+                )
+        else:
+            import Configuration
+
+            problems = validate(Configuration.loadConfig(name))
+            for problem in problems:
+                log.error(problem)
+            log.info(f"{name}: {len(problems)} problems")
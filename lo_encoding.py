@@ -0,0 +1,109 @@
+"""
+Encoding of LO frequencies, phases and amplitudes into the register words of
+the QuadLO FPGA image, and back.
+
+The image's phase accumulator advances by K = f / fs * S / T * 2^25 per sample,
+written as its integer part (the A register) and its fraction in 1/5^10ths
+(the B register). A phase is written as its I and Q, at 16-bit full scale. The
+HVI LO registers take a phase in 1/PHASE_STEPS turns and an amplitude in
+1/AMPLITUDE_FULL_SCALE of full scale.
+
+Every function takes scalars or arrays and returns arrays, so a whole table of
+LOs or sweep points is converted at once:
+
+    a, b = encode_frequency(frequencies)
+    error = frequency_error(frequencies)    # Hz, after the round trip
+"""
+
+import numpy as np
+
+# K = f / fs * ACCUMULATOR_SCALE * 2^ACCUMULATOR_BITS
+ACCUMULATOR_SCALE = 5 / 8
+ACCUMULATOR_BITS = 25
+# Steps of the B register per unit of K
+FRACTION_STEPS = 5 ** 10
+# I and Q full scale
+IQ_FULL_SCALE = 32767
+# HVI LO phase register steps per turn, and amplitude register full scale
+PHASE_STEPS = 1024
+AMPLITUDE_FULL_SCALE = 0xFFFF
+
+
+def encode_frequency(frequencies, sample_rate=1e9):
+    """Returns the A and B registers of <frequencies> (Hz), as int64 arrays"""
+    # Scaling by 2^ACCUMULATOR_BITS is exact, so this rounds as K did when
+    # computed step by step; the temporaries are reused for large tables
+    k = np.asarray(frequencies, dtype=float) / sample_rate
+    k *= ACCUMULATOR_SCALE * 2 ** ACCUMULATOR_BITS
+    a = np.trunc(k)
+    k -= a
+    k *= FRACTION_STEPS
+    return a.astype(np.int64), np.round(k).astype(np.int64)
+
+
+def decode_frequency(a, b, sample_rate=1e9):
+    """Returns the frequencies (Hz) set by registers <a> and <b>"""
+    k = np.asarray(a, dtype=float) + np.asarray(b, dtype=float) / FRACTION_STEPS
+    return k / (ACCUMULATOR_SCALE * 2 ** ACCUMULATOR_BITS) * sample_rate
+
+
+def frequency_resolution(sample_rate=1e9):
+    """The frequency step (Hz) of one count of the B register"""
+    return sample_rate / (ACCUMULATOR_SCALE * 2 ** ACCUMULATOR_BITS * FRACTION_STEPS)
+
+
+def frequency_error(frequencies, sample_rate=1e9):
+    """Returns the frequency output minus <frequencies> (Hz)"""
+    a, b = encode_frequency(frequencies, sample_rate)
+    return decode_frequency(a, b, sample_rate) - np.asarray(frequencies, dtype=float)
+
+
+def encode_iq(phases):
+    """Returns the I and Q registers of <phases> (degrees), as int64 arrays"""
+    radians = np.radians(np.asarray(phases, dtype=float))
+    i = np.round(IQ_FULL_SCALE * np.cos(radians))
+    q = np.round(IQ_FULL_SCALE * np.sin(radians))
+    return i.astype(np.int64), q.astype(np.int64)
+
+
+def decode_iq(i, q):
+    """Returns the phases (degrees, 0 to 360) set by registers <i> and <q>"""
+    phases = np.degrees(np.arctan2(np.asarray(q, float), np.asarray(i, float)))
+    return np.mod(phases, 360.0)
+
+
+def encode_phase(phases):
+    """Returns the HVI phase register of <phases> (degrees), as an int64 array"""
+    steps = np.round(np.asarray(phases, dtype=float) * PHASE_STEPS / 360)
+    return steps.astype(np.int64) % PHASE_STEPS
+
+
+def decode_phase(codes):
+    """Returns the phases (degrees) of HVI phase registers <codes>"""
+    return np.asarray(codes, dtype=float) * 360 / PHASE_STEPS
+
+
+def encode_amplitude(amplitudes):
+    """
+    Returns the HVI amplitude register of <amplitudes> (fraction of full
+    scale), as an int64 array
+    """
+    codes = np.round(np.asarray(amplitudes, dtype=float) * AMPLITUDE_FULL_SCALE)
+    return codes.astype(np.int64)
+
+
+def decode_amplitude(codes):
+    """Returns the amplitudes (fraction of full scale) of registers <codes>"""
+    return np.asarray(codes, dtype=float) / AMPLITUDE_FULL_SCALE
+
+
+def phase_error(phases, hvi=False):
+    """
+    Returns the phase output minus <phases> (degrees, -180 to 180), when set
+    by I and Q, or by the HVI phase register if <hvi>
+    """
+    if hvi:
+        output = decode_phase(encode_phase(phases))
+    else:
+        output = decode_iq(*encode_iq(phases))
+    return np.mod(output - np.asarray(phases, dtype=float) + 180.0, 360.0) - 180.0
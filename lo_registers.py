@@ -0,0 +1,88 @@
+"""
+Register maps of the QuadLO FPGA image, generated from a table of LOs.
+
+Each AWG channel of the image has LO_COUNT local oscillators. An LO is set by
+its phase increment (split in an A and a B register, see lo_encoding) and the
+I and Q of its phase, so the PC registers of channel n are:
+
+    PC_CH<n>_Control, then for each LO k:
+    PC_CH<n>_Q<k>, PC_CH<n>_I<k>, PC_CH<n>_PhaseInc<k>A, PC_CH<n>_PhaseInc<k>B
+
+Instead of listing these one by one, a configurator gives the LOs of each
+channel and the values are computed for the whole table at once:
+
+    los = lo_table([1, 3, 4], [10e6, 30e6, 50e6, 70e6])
+    pcRegisters = pc_registers(los, control)
+    hviRegisters = hvi_registers({channel: 10e6 for channel in los})
+"""
+
+import numpy as np
+
+import lo_encoding
+from Configuration import Register
+
+LO_COUNT = 4
+
+
+def lo_table(channels, frequencies, phases=0):
+    """
+    Returns the LO table giving every channel in <channels> the same LOs:
+    {channel: [(frequency Hz, phase degrees) of each LO]}. <phases> is one
+    phase for all the LOs, or one per LO.
+    """
+    if np.isscalar(phases):
+        phases = [phases] * len(frequencies)
+    los = list(zip(frequencies, phases))
+    return {channel: list(los) for channel in channels}
+
+
+def pc_registers(los, control, sample_rate=1e9):
+    """
+    Returns the PC_CH<n>_* registers of <los>.
+    los : {channel: [(frequency Hz, phase degrees) of each LO]}
+    control : value of every channel's PC_CH<n>_Control register
+    """
+    table = [lo for channel_los in los.values() for lo in channel_los]
+    if not table:
+        return [Register(f"PC_CH{channel}_Control", control) for channel in los]
+    frequencies, phases = zip(*table)
+    a, b = lo_encoding.encode_frequency(frequencies, sample_rate)
+    i, q = lo_encoding.encode_iq(phases)
+    a, b, i, q = a.tolist(), b.tolist(), i.tolist(), q.tolist()
+
+    registers = []
+    row = 0
+    for channel, channel_los in los.items():
+        prefix = f"PC_CH{channel}_"
+        registers.append(Register(prefix + "Control", control))
+        for lo in range(len(channel_los)):
+            registers += [
+                Register(f"{prefix}Q{lo}", q[row]),
+                Register(f"{prefix}I{lo}", i[row]),
+                Register(f"{prefix}PhaseInc{lo}A", a[row]),
+                Register(f"{prefix}PhaseInc{lo}B", b[row]),
+            ]
+            row += 1
+    return registers
+
+
+def hvi_registers(frequencies, sample_rate=1e9):
+    """
+    Returns the HVI_* registers of the image, that the HVI writes to set LO 0
+    of each channel.
+    frequencies : {channel: initial frequency of its LO 0 (Hz)}
+    """
+    channels = list(frequencies)
+    a, b = lo_encoding.encode_frequency([frequencies[c] for c in channels], sample_rate)
+    registers = [
+        Register("HVI_Mult_A", 0),
+        Register("HVI_Mult_B", 0),
+        Register("HVI_Mult_AB", 0),
+        Register("HVI_GLOBAL_PhaseReset", 0),
+    ]
+    for channel, a0, b0 in zip(channels, a.tolist(), b.tolist()):
+        registers.append(Register(f"HVI_CH{channel}_PhaseInc0A", a0))
+        registers.append(Register(f"HVI_CH{channel}_PhaseInc0B", b0))
+    registers += [Register(f"HVI_CH{channel}_Phase0", 0) for channel in channels]
+    registers += [Register(f"HVI_CH{channel}_Amplitude0", 0) for channel in channels]
+    return registers
@@ -0,0 +1,289 @@
+"""
+Long-lived instrument session.
+
+Running "python QuadLO.py <config>" opens every module, loads the FPGA images,
+compiles the HVI and closes everything again, every time. A session keeps the
+module handles, the loaded FPGA images, the waveforms and the compiled HVI
+resident between experiments, so that back to back runs only pay for what
+changed (and for the acquisition itself).
+
+Start the server (in its own console):
+    python session.py serve [port]
+
+Then run experiments from any other process:
+    python session.py run [config]
+or, from Python:
+    import session
+    data = session.run("config_hist/config_12.yaml")
+
+Results come back as a dictionary: {digitizer name: [array per DAQ]}, each
+array holding one capture per row.
+
+Requests are pickled, so only processes that know the session key may connect:
+it is read from $QUADLO_SESSION_KEY or else from ~/.quadlo_session_key, which
+is created (readable by its owner only) the first time it is needed.
+"""
+
+import os
+import sys
+import time
+import logging
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+
+import numpy as np
+
+import instrument
+
+log = logging.getLogger(__name__)
+
+ADDRESS = "localhost"
+PORT = 6340
+KEY_VARIABLE = "QUADLO_SESSION_KEY"
+KEY_FILE = os.path.join(os.path.expanduser("~"), ".quadlo_session_key")
+
+
+def authkey():
+    """The secret shared by the server and its clients"""
+    secret = os.environ.get(KEY_VARIABLE)
+    if secret:
+        return secret.encode()
+    try:
+        fd = os.open(KEY_FILE, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        with open(KEY_FILE, "rb") as f:
+            return f.read()
+    with os.fdopen(fd, "wb") as f:
+        secret = os.urandom(32).hex().encode()
+        f.write(secret)
+    log.info(f"Created session key {KEY_FILE}")
+    return secret
+
+
+class _Resident:
+    """What is held open in one slot"""
+
+    def __init__(self, handle, model):
+        self.handle = handle
+        self.model = model
+        self.image = None
+        self.waves = None
+
+
+class Session:
+    def __init__(self):
+        # The drivers (and QuadLO's plotting libraries) are only imported by
+        # the server, so clients start quickly.
+        global QuadLO, awg_queue, validate, key
+        import QuadLO
+        import awg_queue
+        import validate
+        from drivers import key
+
+        # {(chassis, slot): _Resident}
+        self.slots = {}
+        self.hvi = None
+
+    def run(self, configName="latest"):
+        """Runs the experiment in <configName>, returns the captured data"""
+        start = time.perf_counter()
+        config = QuadLO.load(configName)
+        # Every problem of the config, before any module is touched
+        validate.check(config)
+        try:
+            with instrument.phase("configure"):
+                self._configure_modules(config)
+            with instrument.phase("configure_hvi"):
+                QuadLO.hvi.configure_hvi(config)
+                self.hvi = QuadLO.hvi
+            with instrument.phase("start"):
+                # Only compiles and loads the HVI if its sequence changed
+                self.hvi.start()
+            with instrument.phase("status"):
+                self.hvi.check_status(config)
+            with instrument.phase("readout"):
+                digitizers = [m for m in config.modules if m.model == "M3102A"]
+                data = {
+                    module.name: [np.array(captures) for captures in daqs]
+                    for module, daqs in zip(
+                        digitizers, QuadLO.readDigitizers(digitizers)
+                    )
+                }
+        finally:
+            # Also after a failure, so no AWG or DAQ is left running
+            with instrument.phase("stop"):
+                self._stop_modules(config)
+        log.info(f"Run completed in {time.perf_counter() - start:.3f}s")
+        return data
+
+    def close(self):
+        """Releases the HVI and restores and closes every module"""
+        if self.hvi is not None:
+            self.hvi.close()
+            self.hvi = None
+        for (chassis, slot), resident in self.slots.items():
+            log.info(f"Closing module in chassis {chassis} slot {slot}...")
+            self._restore_image(resident)
+            resident.handle.close()
+            awg_queue.forget(chassis, slot)
+        self.slots = {}
+        instrument.report()
+
+    def _configure_modules(self, config):
+        for module in config.modules:
+            resident = self._open(module)
+            module.handle = resident.handle
+            image = (module.fpga.image_file, module.fpga.vanilla_file)
+            if module.fpga.image_file == "":
+                # As QuadLO.closeModules() would have left it
+                self._restore_image(resident)
+            elif resident.image != image:
+                QuadLO._loadFpga(module)
+                resident.image = image
+                # Loading an image clears the AWG's onboard waveforms
+                resident.waves = None
+            QuadLO._writeFpgaRegisters(module)
+            if module.model == "M3202A":
+                waves = repr(module.pulseDescriptors)
+                if waves != resident.waves:
+                    QuadLO.setupAwg(module)
+                    resident.waves = waves
+                else:
+                    log.info(
+                        f"Waveforms in chassis {module.chassis} slot {module.slot} "
+                        f"unchanged"
+                    )
+                    QuadLO.enqueueWaves(module)
+            elif module.model == "M3102A":
+                QuadLO.setupDig(module)
+
+    def _open(self, module):
+        place = (module.chassis, module.slot)
+        resident = self.slots.get(place)
+        if resident is not None and resident.model == module.model:
+            return resident
+        if resident is not None:
+            self._restore_image(resident)
+            resident.handle.close()
+            awg_queue.forget(*place)
+        log.info(
+            f"Opening {module.model} in chassis {module.chassis} slot {module.slot}..."
+        )
+        if module.model == "M3202A":
+            handle = key.SD_AOU()
+        else:
+            handle = key.SD_AIN()
+        error = handle.openWithSlotCompatibility(
+            "", module.chassis, module.slot, key.SD_Compatibility.KEYSIGHT
+        )
+        if error < 0:
+            log.info(f"Error Opening - {error}")
+        module.handle = handle
+        for channel in range(1, module.channels + 1):
+            if module.model == "M3202A":
+                awg_queue.flush(module, channel)
+        resident = _Resident(handle, module.model)
+        self.slots[place] = resident
+        return resident
+
+    def _restore_image(self, resident):
+        """Loads the vanilla image back over the custom image of <resident>"""
+        if resident.image is not None and resident.image[1] != "":
+            log.info(f"Loading FPGA image: {resident.image[1]}")
+            resident.handle.FPGAload(os.getcwd() + "\\" + resident.image[1])
+            resident.waves = None
+        resident.image = None
+
+    def _stop_modules(self, config):
+        """Stops the AWGs and DAQs of <config> that are open"""
+        for module in config.modules:
+            resident = self.slots.get((module.chassis, module.slot))
+            if resident is None or module.handle is not resident.handle:
+                continue
+            if module.model == "M3202A":
+                QuadLO.stopAwg(module)
+            elif module.model == "M3102A":
+                QuadLO.stopDig(module)
+
+
+def serve(port=PORT):
+    """
+    Serves run requests until a 'shutdown' request is received. The session
+    is closed on the way out, whatever the reason.
+    """
+    session = Session()
+    try:
+        with Listener((ADDRESS, port), authkey=authkey()) as listener:
+            log.info(f"Session listening on {ADDRESS}:{port}")
+            running = True
+            while running:
+                # A client that fails to authenticate or goes away only loses
+                # its own request
+                try:
+                    with listener.accept() as connection:
+                        running = _answer(session, connection)
+                except (EOFError, OSError, AuthenticationError) as err:
+                    log.warning(f"Connection dropped: {err!r}")
+    finally:
+        session.close()
+
+
+def _answer(session, connection):
+    """Answers the request on <connection>, returns False after 'shutdown'"""
+    request = connection.recv()
+    command = request.get("command") if isinstance(request, dict) else None
+    running = True
+    try:
+        if command == "run":
+            start = time.perf_counter()
+            data = session.run(request.get("config", "latest"))
+            response = {
+                "status": "ok",
+                "data": data,
+                "duration": time.perf_counter() - start,
+            }
+        elif command == "close":
+            session.close()
+            response = {"status": "ok"}
+        elif command == "shutdown":
+            # serve() closes the session
+            response = {"status": "ok"}
+            running = False
+        else:
+            response = {"status": "error", "error": f"Unknown: {command}"}
+        connection.send(response)
+    except Exception as err:
+        # Also when the response cannot be sent (e.g. it does not pickle); if
+        # the connection itself is gone, serve() drops it
+        log.exception(f"Request {command} failed")
+        connection.send({"status": "error", "error": repr(err)})
+    return running
+
+
+def request(command, port=PORT, **kwargs):
+    with Client((ADDRESS, port), authkey=authkey()) as connection:
+        connection.send({"command": command, **kwargs})
+        response = connection.recv()
+    if response["status"] != "ok":
+        raise RuntimeError(response["error"])
+    return response
+
+
+def run(configName="latest", port=PORT):
+    """Asks the session server to run <configName>, returns the captured data"""
+    return request("run", port, config=configName)["data"]
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    command = sys.argv[1] if len(sys.argv) > 1 else "serve"
+    if command == "serve":
+        serve(int(sys.argv[2]) if len(sys.argv) > 2 else PORT)
+    elif command == "run":
+        start = time.perf_counter()
+        data = run(sys.argv[2] if len(sys.argv) > 2 else "latest")
+        for name, daqs in data.items():
+            log.info(f"{name}: {[d.shape for d in daqs]}")
+        log.info(f"Turnaround: {time.perf_counter() - start:.3f}s")
+    else:
+        request(command)
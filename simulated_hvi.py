@@ -0,0 +1,615 @@
+"""
+Pure-Python stand-in for the parts of keysight_hvi used by this project.
+
+Sequences are recorded exactly as hvi_wrap builds them. compile() and
+load_to_hw() cost time according to the latency model in simulated_sd1, and
+run() interprets the sequence on a background thread: registers are updated,
+FPGA sandbox registers are written/read and actions (triggers) are passed on
+to the simulated modules, in (scaled) real time.
+"""
+
+import time
+import logging
+import operator
+import threading
+
+import simulated_sd1 as sd1
+from simulated_sd1 import Latency
+
+log = logging.getLogger(__name__)
+
+sd1.latency.update(
+    {
+        "SystemDefinition": Latency(0.05),
+        "load_from_k7z": Latency(0.2),
+        "add_action": Latency(200e-6),
+        "add_event": Latency(200e-6),
+        "compile": Latency(1.0),
+        "compile_statement": Latency(2e-3),
+        # Every declared action and event, and FPGA sandbox, is compiled too
+        "compile_resource": Latency(5e-3),
+        "compile_sandbox": Latency(0.1),
+        "load_to_hw": Latency(0.5),
+        "run": Latency(10e-3),
+        "release_hw": Latency(0.1),
+        "register_read": Latency(50e-6),
+        "register_write": Latency(50e-6),
+    }
+)
+
+# Interpretation of sequences sleeps in slices of at least this many seconds.
+_MIN_SLEEP = 1e-3
+
+
+def _int32(value):
+    """<value> as held in a 32 bit signed HVI register (wrapped around)"""
+    value = int(value) & 0xFFFFFFFF
+    return value - (1 << 32) if value & 0x80000000 else value
+
+
+class TriggerResourceId:
+    pass
+
+
+for _trigger in range(8):
+    setattr(TriggerResourceId, f"PXI_TRIGGER{_trigger}", f"PXI_TRIGGER{_trigger}")
+
+
+class RegisterSize:
+    SHORT = 32
+    LONG = 64
+
+
+class OutputFormat:
+    DEBUG = "DEBUG"
+
+
+class ComparisonOperator:
+    EQUAL_TO = "EQUAL_TO"
+    NOT_EQUAL_TO = "NOT_EQUAL_TO"
+    GREATER_THAN = "GREATER_THAN"
+    GREATER_THAN_OR_EQUAL_TO = "GREATER_THAN_OR_EQUAL_TO"
+    LESS_THAN = "LESS_THAN"
+    LESS_THAN_OR_EQUAL_TO = "LESS_THAN_OR_EQUAL_TO"
+
+
+_comparisons = {
+    ComparisonOperator.EQUAL_TO: operator.eq,
+    ComparisonOperator.NOT_EQUAL_TO: operator.ne,
+    ComparisonOperator.GREATER_THAN: operator.gt,
+    ComparisonOperator.GREATER_THAN_OR_EQUAL_TO: operator.ge,
+    ComparisonOperator.LESS_THAN: operator.lt,
+    ComparisonOperator.LESS_THAN_OR_EQUAL_TO: operator.le,
+}
+
+
+class Condition:
+    def __init__(self, register, comparison, value):
+        self.register = register
+        self.comparison = comparison
+        self.value = value
+
+    @staticmethod
+    def register_comparison(register, comparison_operator, value):
+        return Condition(register, comparison_operator, value)
+
+    def __str__(self):
+        register = getattr(self.register, "name", self.register)
+        return f"{register} {self.comparison} {self.value}"
+
+
+class _Collection:
+    """Ordered, name indexed collection (engines, actions, registers...)"""
+
+    def __init__(self):
+        self._items = {}
+
+    def _add(self, name, item):
+        self._items[name] = item
+        return item
+
+    def __getitem__(self, name):
+        return self._items[name]
+
+    def __iter__(self):
+        return iter(self._items.values())
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, name):
+        return name in self._items
+
+
+# System definition
+
+
+class _ChassisCollection(_Collection):
+    def add(self, chassis_number):
+        return self._add(chassis_number, chassis_number)
+
+    def add_with_options(self, chassis_number, options):
+        return self._add(chassis_number, chassis_number)
+
+
+class _ResourceDefinition:
+    def __init__(self, resource_id, name):
+        self.id = resource_id
+        self.name = name
+
+
+class _ResourceCollection(_Collection):
+    def __init__(self, kind):
+        super().__init__()
+        self._kind = kind
+
+    def add(self, resource_id, name):
+        sd1.spend(f"add_{self._kind}")
+        return self._add(name, _ResourceDefinition(resource_id, name))
+
+
+class _FpgaRegister:
+    def __init__(self, name):
+        self.name = name
+
+
+class _FpgaRegisterCollection(_Collection):
+    def __getitem__(self, name):
+        if name not in self._items:
+            self._add(name, _FpgaRegister(name))
+        return self._items[name]
+
+
+class _FpgaSandbox:
+    def __init__(self):
+        self.fpga_registers = _FpgaRegisterCollection()
+        self.k7z_file = None
+
+    def load_from_k7z(self, file):
+        sd1.spend("load_from_k7z")
+        self.k7z_file = file
+
+
+class _EngineDefinition:
+    def __init__(self, engine_id, name):
+        self.name = name
+        self.module = engine_id.module
+        self.actions = _ResourceCollection("action")
+        self.events = _ResourceCollection("event")
+        self.fpga_sandboxes = [_FpgaSandbox()]
+
+
+class _EngineCollection(_Collection):
+    def add(self, engine_id, name):
+        return self._add(name, _EngineDefinition(engine_id, name))
+
+
+class SystemDefinition:
+    def __init__(self, name):
+        sd1.spend("SystemDefinition")
+        self.name = name
+        self.chassis = _ChassisCollection()
+        self.engines = _EngineCollection()
+        self.sync_resources = []
+
+
+# Sequences
+
+
+class _Register:
+    def __init__(self, name, size, scope):
+        self.name = name
+        self.size = size
+        self.scope = scope
+        self.initial_value = 0
+
+
+class _RegisterCollection(_Collection):
+    def __init__(self, scope):
+        super().__init__()
+        self._scope = scope
+
+    def add(self, name, size):
+        return self._add(name, _Register(name, size, self._scope))
+
+
+class _Scope:
+    def __init__(self, engine):
+        self.engine = engine
+        self.registers = _RegisterCollection(self)
+
+
+class _Parameter:
+    def __init__(self, name):
+        self.id = name
+
+
+class _InstructionDefinition:
+    def __init__(self, name, *parameters):
+        self.id = name
+        for parameter in parameters:
+            setattr(self, parameter, _Parameter(parameter))
+
+
+class _InstructionSet:
+    assign = _InstructionDefinition("assign", "destination", "source")
+    add = _InstructionDefinition("add", "destination", "left_operand", "right_operand")
+    subtract = _InstructionDefinition(
+        "subtract", "destination", "left_operand", "right_operand"
+    )
+    fpga_register_write = _InstructionDefinition(
+        "fpga_register_write", "fpga_register", "value"
+    )
+    fpga_register_read = _InstructionDefinition(
+        "fpga_register_read", "fpga_register", "destination"
+    )
+    action_execute = _InstructionDefinition("action_execute", "action")
+
+
+class _Statement:
+    def __init__(self, name, delay):
+        self.name = name
+        self.delay = delay
+
+
+class _Instruction(_Statement):
+    def __init__(self, name, delay, instruction_id):
+        super().__init__(name, delay)
+        self.instruction = instruction_id
+        self.parameters = {}
+
+    def set_parameter(self, parameter_id, value):
+        self.parameters[parameter_id] = value
+
+    def describe(self):
+        parameters = ", ".join(
+            f"{k}={_name_of(v)}" for k, v in self.parameters.items()
+        )
+        return f"{self.instruction}({parameters})"
+
+
+def _name_of(value):
+    if isinstance(value, list):
+        return "[" + ", ".join(_name_of(v) for v in value) + "]"
+    return getattr(value, "name", value)
+
+
+class _Delay(_Statement):
+    def describe(self):
+        return "delay"
+
+
+class _Branch:
+    def __init__(self, parent):
+        self.sequence = _Sequence(parent.engine, parent.scope)
+
+
+class _If(_Statement):
+    def __init__(self, name, delay, condition, sequence):
+        super().__init__(name, delay)
+        self.condition = condition
+        self.if_branch = _Branch(sequence)
+
+    def describe(self):
+        return f"if {self.condition}"
+
+
+class _Sequence:
+    """Local sequence, executed by a single engine"""
+
+    instruction_set = _InstructionSet()
+
+    def __init__(self, engine, scope):
+        self.engine = engine
+        self.scope = scope
+        self.statements = []
+
+    def add_instruction(self, name, delay, instruction_id):
+        return self._add(_Instruction(name, delay, instruction_id))
+
+    def add_delay(self, name, delay):
+        return self._add(_Delay(name, delay))
+
+    def add_if(self, name, delay, condition, enable_matching_branches):
+        return self._add(_If(name, delay, condition, self))
+
+    def _add(self, statement):
+        self.statements.append(statement)
+        return statement
+
+
+class _SyncWhile(_Statement):
+    def __init__(self, name, delay, condition, scopes):
+        super().__init__(name, delay)
+        self.condition = condition
+        self.sync_sequence = _SyncSequence(scopes)
+
+    def describe(self):
+        return f"while {self.condition}"
+
+
+class _SyncMultiSequenceBlock(_Statement):
+    def __init__(self, name, delay, scopes):
+        super().__init__(name, delay)
+        self.sequences = {
+            scope.engine.name: _Sequence(scope.engine, scope) for scope in scopes
+        }
+
+    def describe(self):
+        return "block"
+
+
+class _SyncSequence:
+    def __init__(self, scopes):
+        self.scopes = scopes
+        self.sync_statements = []
+
+    def add_sync_while(self, name, delay, condition):
+        return self._add(_SyncWhile(name, delay, condition, self.scopes))
+
+    def add_sync_multi_sequence_block(self, name, delay):
+        return self._add(_SyncMultiSequenceBlock(name, delay, self.scopes))
+
+    def _add(self, statement):
+        self.sync_statements.append(statement)
+        return statement
+
+    def to_string(self, output_format=OutputFormat.DEBUG):
+        lines = []
+        _describe(self, lines, 0)
+        return "\n".join(lines)
+
+
+def _describe(sync_sequence, lines, indent):
+    pad = "  " * indent
+    for statement in sync_sequence.sync_statements:
+        lines.append(f"{pad}{statement.name} [{statement.delay}]: {statement.describe()}")
+        if isinstance(statement, _SyncWhile):
+            _describe(statement.sync_sequence, lines, indent + 1)
+        else:
+            for engine, sequence in statement.sequences.items():
+                lines.append(f"{pad}  {engine}:")
+                _describe_local(sequence, lines, indent + 2)
+
+
+def _describe_local(sequence, lines, indent):
+    pad = "  " * indent
+    for statement in sequence.statements:
+        lines.append(f"{pad}{statement.name} [{statement.delay}]: {statement.describe()}")
+        if isinstance(statement, _If):
+            _describe_local(statement.if_branch.sequence, lines, indent + 1)
+
+
+class _Scopes(_Collection):
+    pass
+
+
+class Sequencer:
+    def __init__(self, name, system_definition):
+        self.name = name
+        self.system_definition = system_definition
+        scopes = _Scopes()
+        for engine in system_definition.engines:
+            scopes._add(engine.name, _Scope(engine))
+        self.sync_sequence = _SyncSequence(scopes)
+
+    def compile(self):
+        sd1.spend("compile")
+        sd1.spend("compile_statement", count=_count_statements(self.sync_sequence))
+        for engine in self.system_definition.engines:
+            sd1.spend("compile_resource", count=len(engine.actions) + len(engine.events))
+            if engine.fpga_sandboxes[0].k7z_file is not None:
+                sd1.spend("compile_sandbox")
+        return _SequencerHandle(self)
+
+
+def _count_statements(sync_sequence):
+    count = 0
+    for statement in sync_sequence.sync_statements:
+        count += 1
+        if isinstance(statement, _SyncWhile):
+            count += _count_statements(statement.sync_sequence)
+        else:
+            for sequence in statement.sequences.values():
+                count += _count_local(sequence)
+    return count
+
+
+def _count_local(sequence):
+    count = 0
+    for statement in sequence.statements:
+        count += 1
+        if isinstance(statement, _If):
+            count += _count_local(statement.if_branch.sequence)
+    return count
+
+
+# Execution
+
+
+class _RuntimeRegister:
+    def __init__(self, engine_state, name):
+        self._state = engine_state
+        self.name = name
+
+    def read(self):
+        sd1.spend("register_read")
+        return self._state[self.name]
+
+    def write(self, value):
+        sd1.spend("register_write")
+        self._state[self.name] = _int32(value)
+
+
+class _RuntimeRegisterCollection(_Collection):
+    def __init__(self, engine_state):
+        super().__init__()
+        for name in engine_state:
+            self._add(name, _RuntimeRegister(engine_state, name))
+
+
+class _RuntimeScope:
+    def __init__(self, engine_state):
+        self.registers = _RuntimeRegisterCollection(engine_state)
+
+
+class _RuntimeSyncSequence:
+    def __init__(self, state):
+        self.scopes = _Scopes()
+        for engine, engine_state in state.items():
+            self.scopes._add(engine, _RuntimeScope(engine_state))
+
+
+class _SequencerHandle:
+    no_timeout = None
+
+    def __init__(self, sequencer):
+        self._sequencer = sequencer
+        self._thread = None
+        self._stop = threading.Event()
+        self._loaded = False
+        self._state = {
+            scope.engine.name: {
+                r.name: _int32(r.initial_value) for r in scope.registers
+            }
+            for scope in sequencer.sync_sequence.scopes
+        }
+        self._started = None
+        self.sync_sequence = _RuntimeSyncSequence(self._state)
+        # Simulated time, in ns, since the start of the run
+        self.elapsed = 0
+
+    def load_to_hw(self):
+        """Loads the sequence, (re)initializing every register"""
+        sd1.spend("load_to_hw")
+        for scope in self._sequencer.sync_sequence.scopes:
+            state = self._state[scope.engine.name]
+            for register in scope.registers:
+                state[register.name] = _int32(register.initial_value)
+        self._loaded = True
+
+    def run(self, timeout=None):
+        """Starts execution and returns immediately"""
+        sd1.spend("run")
+        self._stop.clear()
+        self.elapsed = 0
+        self._started = time.perf_counter()
+        self._thread = threading.Thread(
+            target=self._execute, name="simulated HVI", daemon=True
+        )
+        self._thread.start()
+
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def wait(self, timeout=None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+        return not self.is_running()
+
+    def stop(self):
+        self._stop.set()
+        self.wait()
+
+    def release_hw(self):
+        self.stop()
+        sd1.spend("release_hw")
+        self._loaded = False
+
+    def _execute(self):
+        try:
+            self._run_sync(self._sequencer.sync_sequence)
+        except _Stopped:
+            pass
+        self._pace(flush=True)
+
+    def _pace(self, flush=False):
+        """Keeps simulated time in step with real (scaled) time"""
+        if sd1.time_scale <= 0:
+            return
+        due = self._started + self.elapsed * 1e-9 * sd1.time_scale
+        ahead = due - time.perf_counter()
+        if ahead > _MIN_SLEEP or (flush and ahead > 0):
+            time.sleep(ahead)
+
+    def _advance(self, ns):
+        self.elapsed += ns
+        self._pace()
+        if self._stop.is_set():
+            raise _Stopped()
+
+    def _value(self, engine, value):
+        if isinstance(value, _Register):
+            return self._state[value.scope.engine.name][value.name]
+        if isinstance(value, str):
+            return self._state[engine.name][value]
+        return value
+
+    def _evaluate(self, condition, engine=None):
+        register = condition.register
+        if isinstance(register, _Register):
+            current = self._state[register.scope.engine.name][register.name]
+        else:
+            current = self._state[engine.name][register]
+        return _comparisons[condition.comparison](current, condition.value)
+
+    def _run_sync(self, sync_sequence):
+        for statement in sync_sequence.sync_statements:
+            self._advance(statement.delay)
+            if isinstance(statement, _SyncWhile):
+                while self._evaluate(statement.condition):
+                    self._run_sync(statement.sync_sequence)
+                    # Loop back / condition evaluation
+                    self._advance(10)
+            else:
+                start = self.elapsed
+                longest = 0
+                for sequence in statement.sequences.values():
+                    self.elapsed = start
+                    self._run_local(sequence)
+                    longest = max(longest, self.elapsed - start)
+                self.elapsed = start
+                self._advance(longest)
+
+    def _run_local(self, sequence):
+        engine = sequence.engine
+        state = self._state[engine.name]
+        for statement in sequence.statements:
+            self.elapsed += statement.delay
+            if isinstance(statement, _If):
+                if self._evaluate(statement.condition, engine):
+                    self._run_local(statement.if_branch.sequence)
+            elif isinstance(statement, _Instruction):
+                self._run_instruction(engine, state, statement)
+                self.elapsed += 10
+
+    def _run_instruction(self, engine, state, statement):
+        instruction = statement.instruction
+        p = statement.parameters
+        if instruction == "assign":
+            state[p["destination"].name] = _int32(self._value(engine, p["source"]))
+        elif instruction in ("add", "subtract"):
+            left = self._value(engine, p["left_operand"])
+            right = self._value(engine, p["right_operand"])
+            result = left + right if instruction == "add" else left - right
+            state[p["destination"].name] = _int32(result)
+        elif instruction == "fpga_register_write":
+            # As a write from the PC would, so the image's logic runs
+            name = p["fpga_register"].name
+            value = _int32(self._value(engine, p["value"]))
+            engine.module._sandbox[name] = value
+            engine.module._sandbox_written(name, value)
+        elif instruction == "fpga_register_read":
+            value = engine.module._sandbox.get(p["fpga_register"].name, 0)
+            state[p["destination"].name] = value
+        elif instruction == "action_execute":
+            for action in p["action"]:
+                engine.module._hvi_action(action.name)
+        else:
+            engine.module._hvi_instruction(
+                instruction, {k: self._value(engine, v) for k, v in p.items()}
+            )
+
+
+class _Stopped(Exception):
+    pass
@@ -0,0 +1,576 @@
+"""
+Pure-Python stand-in for the parts of keysightSD1 used by this project.
+
+Every driver call costs a configurable amount of (real) time, so that the
+host side orchestration can be exercised and benchmarked without a chassis.
+The cost of a call is:
+
+    time_scale * (latency[call].fixed + latency[call].per_byte * bytes)
+
+Use configure() to change the time scale or individual call latencies, e.g.
+configure(time_scale=0) makes every call free. The environment variable
+SIM_TIME_SCALE sets the initial time scale.
+
+With a frame averager image loaded, a digitizer channel's DAQ gets the frames
+its averager outputs (see averager_model), and its counters can be polled.
+"""
+
+import os
+import re
+import time
+import logging
+import threading
+from dataclasses import dataclass
+
+import numpy as np
+
+import k7z_index
+import averager_model
+
+log = logging.getLogger(__name__)
+
+
+@dataclass
+class Latency:
+    """Cost of one driver call: fixed seconds plus seconds per byte moved"""
+
+    fixed: float = 0.0
+    per_byte: float = 0.0
+
+    def cost(self, nbytes=0):
+        return self.fixed + self.per_byte * nbytes
+
+
+time_scale = float(os.getenv("SIM_TIME_SCALE", "1.0"))
+
+# Approximate figures for an M9019A chassis with M3202A/M3102A modules.
+latency = {
+    "open": Latency(0.3),
+    "close": Latency(0.05),
+    "FPGAload": Latency(1.5),
+    "FPGAgetSandBoxRegister": Latency(50e-6),
+    "writeRegisterInt32": Latency(20e-6),
+    "readRegisterInt32": Latency(20e-6),
+    "channel": Latency(100e-6),
+    "waveformFlush": Latency(5e-3),
+    "waveformLoad": Latency(1e-3, 1 / 200e6),
+    "AWGflush": Latency(1e-3),
+    "AWGqueueWaveform": Latency(50e-6),
+    "AWGqueueConfig": Latency(50e-6),
+    "AWGstart": Latency(100e-6),
+    "AWGstop": Latency(100e-6),
+    "DAQflush": Latency(1e-3),
+    "DAQconfig": Latency(100e-6),
+    "DAQstart": Latency(100e-6),
+    "DAQstop": Latency(100e-6),
+    "DAQcounterRead": Latency(20e-6),
+    "DAQread": Latency(100e-6, 1 / 100e6),
+}
+DEFAULT_LATENCY = Latency(50e-6)
+
+
+def configure(time_scale=None, **latencies):
+    """
+    Changes the simulation latency model.
+
+    time_scale : multiplier applied to every call cost (0 = no delays)
+    latencies : <call name>=Latency(...) overrides
+    """
+    if time_scale is not None:
+        globals()["time_scale"] = time_scale
+    latency.update(latencies)
+
+
+def spend(call, nbytes=0, count=1):
+    """Blocks for the modelled duration of <count> calls to <call>"""
+    if time_scale <= 0:
+        return
+    duration = count * time_scale * latency.get(call, DEFAULT_LATENCY).cost(nbytes)
+    if duration > 0:
+        time.sleep(duration)
+
+
+# Driver constants
+
+
+class SD_Error:
+    STATUS_DEMO = 1
+    OPENING_MODULE = -8000
+    CLOSING_MODULE = -8001
+    MODULE_NOT_OPENED = -8003
+    INVALID_PARAMETERS = -8009
+    WAVE_INVALID_ID = -8025
+    TIMEOUT = -8056
+
+    _messages = {
+        OPENING_MODULE: "Error opening module",
+        CLOSING_MODULE: "Error closing module",
+        MODULE_NOT_OPENED: "Module not opened",
+        INVALID_PARAMETERS: "Invalid parameters",
+        WAVE_INVALID_ID: "Invalid waveform ID",
+        TIMEOUT: "Timeout",
+    }
+
+    @staticmethod
+    def getErrorMessage(errorNumber):
+        return SD_Error._messages.get(errorNumber, f"Unknown error {errorNumber}")
+
+
+class SD_Compatibility:
+    LEGACY = 0
+    KEYSIGHT = 1
+
+
+class SD_Waveshapes:
+    AOU_HIZ = -1
+    AOU_OFF = 0
+    AOU_SINUSOIDAL = 1
+    AOU_TRIANGULAR = 2
+    AOU_SQUARE = 4
+    AOU_DC = 5
+    AOU_AWG = 6
+    AOU_PARTNER = 8
+
+
+class SD_TriggerModes:
+    AUTOTRIG = 0
+    VIHVITRIG = 1
+    SWHVITRIG = 1
+    EXTTRIG = 2
+    ANALOGTRIG = 3
+    SWHVITRIG_CYCLE = 5
+    EXTTRIG_CYCLE = 6
+
+
+class SD_QueueMode:
+    ONE_SHOT = 0
+    CYCLIC = 1
+
+
+class SD_WaveformTypes:
+    WAVE_ANALOG = 0
+    WAVE_IQ = 2
+    WAVE_IQPOLAR = 3
+    WAVE_DIGITAL = 5
+
+
+class AIN_Impedance:
+    AIN_IMPEDANCE_HZ = 0
+    AIN_IMPEDANCE_50 = 1
+
+
+class AIN_Coupling:
+    AIN_COUPLING_DC = 0
+    AIN_COUPLING_AC = 1
+
+
+# Driver objects
+
+
+class SD_Module:
+    @staticmethod
+    def getChassisByIndex(index):
+        return 1
+
+
+class SD_Wave:
+    def __init__(self):
+        self.samples = None
+
+    def newFromArrayDouble(self, waveformType, waveformDataA, waveformDataB=None):
+        self.samples = np.asarray(waveformDataA, dtype=float)
+        return 0
+
+    def getStatus(self):
+        return 0 if self.samples is not None else SD_Error.INVALID_PARAMETERS
+
+
+class SD_SandBoxRegister:
+    def __init__(self, module, name):
+        self._module = module
+        self.Name = name
+
+    def writeRegisterInt32(self, data):
+        spend("writeRegisterInt32", 4)
+        self._module._sandbox[self.Name] = int(data)
+        self._module._sandbox_written(self.Name, int(data))
+        return 0
+
+    def readRegisterInt32(self):
+        spend("readRegisterInt32", 4)
+        return self._module._sandbox.get(self.Name, 0)
+
+
+class _Named:
+    """Simple attribute holder used to describe the HVI resources of a module"""
+
+    def __init__(self, **attributes):
+        self.__dict__.update(attributes)
+
+
+class _HviEngineId:
+    """Identifies the HVI engine of a module (module.hvi.engines.main_engine)"""
+
+    def __init__(self, module):
+        self.module = module
+
+
+class _ModuleHvi:
+    def __init__(self, module, actions, events, instructions):
+        self.engines = _Named(main_engine=_HviEngineId(module))
+        self.actions = _Named(**{name: name for name in actions})
+        self.events = _Named(**{name: name for name in events})
+        self.instruction_set = _Named(**instructions)
+
+
+class _SimModule:
+    model = ""
+
+    def __init__(self):
+        self._open = False
+        self.chassis = None
+        self.slot = None
+        self.fpga_image = None
+        self._sandbox = {}
+        self.hvi = None
+
+    def _open_module(self, partNumber, chassis, slot):
+        spend("open")
+        self._open = True
+        self.chassis = chassis
+        self.slot = slot
+        if partNumber:
+            self.model = partNumber
+        log.debug(f"Simulated {self.model} opened in chassis {chassis}, slot {slot}")
+        return slot
+
+    def openWithSlotCompatibility(self, partNumber, nChassis, nSlot, compatibility):
+        return self._open_module(partNumber, nChassis, nSlot)
+
+    def openWithSlot(self, partNumber, nChassis, nSlot):
+        return self._open_module(partNumber, nChassis, nSlot)
+
+    def openWithOptions(self, partNumber, nChassis, nSlot, options):
+        return self._open_module(partNumber, nChassis, nSlot)
+
+    def isOpen(self):
+        return self._open
+
+    def close(self):
+        spend("close")
+        self._open = False
+        return 0
+
+    def getProductName(self):
+        return self.model
+
+    def FPGAload(self, fileName):
+        if not self._open:
+            return SD_Error.MODULE_NOT_OPENED
+        spend("FPGAload")
+        self.fpga_image = fileName
+        self._sandbox = {}
+        return 0
+
+    def FPGAgetSandBoxRegister(self, registerName):
+        spend("FPGAgetSandBoxRegister")
+        return SD_SandBoxRegister(self, registerName)
+
+    def _sandbox_written(self, name, value):
+        """Runs the FPGA image's logic for a write of sandbox register <name>"""
+        pass
+
+    def _hvi_action(self, action):
+        """Executes an HVI action issued by the (simulated) HVI engine"""
+        pass
+
+    def _hvi_instruction(self, instruction, parameters):
+        """Executes a module specific HVI instruction"""
+        pass
+
+
+class SD_AOU(_SimModule):
+    model = "M3202A"
+    CHANNELS = 4
+
+    def __init__(self):
+        super().__init__()
+        self.waveforms = {}
+        self.queues = {ch: [] for ch in range(1, self.CHANNELS + 1)}
+        self.queue_modes = {ch: SD_QueueMode.ONE_SHOT for ch in self.queues}
+        self.running = {ch: False for ch in self.queues}
+        self.triggers = {ch: 0 for ch in self.queues}
+        self.amplitudes = {ch: 0.0 for ch in self.queues}
+        self.hvi = _ModuleHvi(
+            self,
+            actions=[f"awg{ch}_trigger" for ch in self.queues]
+            + [f"awg{ch}_start" for ch in self.queues]
+            + [f"awg{ch}_stop" for ch in self.queues],
+            events=[f"awg{ch}_queue_empty" for ch in self.queues],
+            instructions={
+                "set_amplitude": _Named(
+                    id="set_amplitude",
+                    channel=_Named(id="channel"),
+                    value=_Named(id="value"),
+                )
+            },
+        )
+
+    def _valid_channel(self, nChannel):
+        return nChannel in self.queues
+
+    def channelWaveShape(self, nChannel, waveShape):
+        spend("channel")
+        return 0 if self._valid_channel(nChannel) else SD_Error.INVALID_PARAMETERS
+
+    def channelAmplitude(self, nChannel, amplitude):
+        spend("channel")
+        if not self._valid_channel(nChannel):
+            return SD_Error.INVALID_PARAMETERS
+        self.amplitudes[nChannel] = amplitude
+        return 0
+
+    def waveformFlush(self):
+        spend("waveformFlush")
+        self.waveforms = {}
+        return 0
+
+    def waveformLoad(self, waveformObject, waveformNumber, paddingMode=0):
+        samples = waveformObject.samples
+        if samples is None:
+            return SD_Error.INVALID_PARAMETERS
+        # M3202A stores 16 bit samples
+        spend("waveformLoad", 2 * len(samples))
+        self.waveforms[waveformNumber] = samples
+        return len(samples)
+
+    def AWGflush(self, nAWG):
+        spend("AWGflush")
+        if not self._valid_channel(nAWG):
+            return SD_Error.INVALID_PARAMETERS
+        self.queues[nAWG] = []
+        self.running[nAWG] = False
+        return 0
+
+    def AWGqueueWaveform(
+        self, nAWG, waveformNumber, triggerMode, startDelay, cycles, prescaler
+    ):
+        spend("AWGqueueWaveform")
+        if not self._valid_channel(nAWG):
+            return SD_Error.INVALID_PARAMETERS
+        if waveformNumber not in self.waveforms:
+            return SD_Error.WAVE_INVALID_ID
+        self.queues[nAWG].append(
+            (waveformNumber, triggerMode, startDelay, cycles, prescaler)
+        )
+        return 0
+
+    def AWGqueueConfig(self, nAWG, mode):
+        spend("AWGqueueConfig")
+        if not self._valid_channel(nAWG):
+            return SD_Error.INVALID_PARAMETERS
+        self.queue_modes[nAWG] = mode
+        return 0
+
+    def AWGstart(self, nAWG):
+        spend("AWGstart")
+        if not self._valid_channel(nAWG):
+            return SD_Error.INVALID_PARAMETERS
+        self.running[nAWG] = True
+        self.triggers[nAWG] = 0
+        return 0
+
+    def AWGstop(self, nAWG):
+        spend("AWGstop")
+        if not self._valid_channel(nAWG):
+            return SD_Error.INVALID_PARAMETERS
+        self.running[nAWG] = False
+        return 0
+
+    def AWGtrigger(self, nAWG):
+        if self.running.get(nAWG):
+            self.triggers[nAWG] += 1
+        return 0
+
+    def _hvi_action(self, action):
+        channel = int(action[3])
+        if action.endswith("_trigger"):
+            self.AWGtrigger(channel)
+        elif action.endswith("_start"):
+            self.running[channel] = True
+        elif action.endswith("_stop"):
+            self.running[channel] = False
+
+    def _hvi_instruction(self, instruction, parameters):
+        if instruction == "set_amplitude":
+            self.amplitudes[parameters["channel"]] = parameters["value"]
+
+
+class _DaqChannel:
+    def __init__(self):
+        self.points = 0
+        self.cycles = 0
+        self.trigger_mode = SD_TriggerModes.AUTOTRIG
+        self.running = False
+        self.captured = 0
+        self.data = np.zeros(0, dtype=np.int16)
+        self.ready = threading.Condition()
+
+
+class SD_AIN(_SimModule):
+    model = "M3102A"
+    CHANNELS = 4
+    # Amplitude of the simulated ADC noise, in LSBs.
+    NOISE = 16
+
+    def __init__(self):
+        super().__init__()
+        self.daqs = {ch: _DaqChannel() for ch in range(1, self.CHANNELS + 1)}
+        # Frame averager of each channel, with an averager image loaded
+        self._averagers = {}
+        self._rng = np.random.default_rng(0)
+        self.hvi = _ModuleHvi(
+            self,
+            actions=[f"daq{ch}_trigger" for ch in self.daqs]
+            + [f"daq{ch}_start" for ch in self.daqs]
+            + [f"daq{ch}_stop" for ch in self.daqs],
+            events=[f"daq{ch}_running" for ch in self.daqs],
+            instructions={},
+        )
+
+    def channelInputConfig(self, channel, fullScale, impedance, coupling):
+        spend("channel")
+        return 0 if channel in self.daqs else SD_Error.INVALID_PARAMETERS
+
+    def DAQflush(self, nDAQ):
+        spend("DAQflush")
+        if nDAQ not in self.daqs:
+            return SD_Error.INVALID_PARAMETERS
+        daq = self.daqs[nDAQ]
+        with daq.ready:
+            daq.data = np.zeros(0, dtype=np.int16)
+            daq.captured = 0
+        return 0
+
+    def DAQconfig(self, nDAQ, nDAQpointsPerCycle, nCycles, prescaler, triggerMode):
+        spend("DAQconfig")
+        if nDAQ not in self.daqs:
+            return SD_Error.INVALID_PARAMETERS
+        daq = self.daqs[nDAQ]
+        daq.points = nDAQpointsPerCycle
+        daq.cycles = nCycles
+        daq.trigger_mode = triggerMode
+        return 0
+
+    def DAQstart(self, nDAQ):
+        spend("DAQstart")
+        if nDAQ not in self.daqs:
+            return SD_Error.INVALID_PARAMETERS
+        daq = self.daqs[nDAQ]
+        daq.running = True
+        if daq.trigger_mode == SD_TriggerModes.AUTOTRIG:
+            for cycle in range(daq.cycles):
+                self._capture(nDAQ)
+        return 0
+
+    def DAQstop(self, nDAQ):
+        spend("DAQstop")
+        if nDAQ not in self.daqs:
+            return SD_Error.INVALID_PARAMETERS
+        self.daqs[nDAQ].running = False
+        return 0
+
+    def DAQtrigger(self, nDAQ):
+        self._capture(nDAQ)
+        return 0
+
+    def DAQcounterRead(self, nDAQ):
+        """Number of points captured and not yet read"""
+        spend("DAQcounterRead")
+        if nDAQ not in self.daqs:
+            return SD_Error.INVALID_PARAMETERS
+        return len(self.daqs[nDAQ].data)
+
+    def DAQread(self, nDAQ, nPoints, timeOut=0):
+        """
+        Returns up to <nPoints> points, waiting up to <timeOut> ms
+        (0 = forever) for them to be captured.
+        """
+        if nDAQ not in self.daqs:
+            return SD_Error.INVALID_PARAMETERS
+        daq = self.daqs[nDAQ]
+        timeout = None if timeOut == 0 else timeOut / 1000
+        with daq.ready:
+            daq.ready.wait_for(lambda: len(daq.data) >= nPoints, timeout)
+            data = daq.data[:nPoints]
+            daq.data = daq.data[nPoints:]
+        # M3102A transfers 16 bit samples
+        spend("DAQread", 2 * len(data))
+        return data
+
+    def FPGAload(self, fileName):
+        error = super().FPGAload(fileName)
+        self._averagers = {}
+        return error
+
+    def _sandbox_written(self, name, value):
+        match = re.match(r"PC_CH(\d+)_Control$", name)
+        if match is None:
+            return
+        channel = int(match.group(1))
+        if channel not in _averaged_channels(self.fpga_image):
+            return
+        running = value & averager_model.CONTROL_RUN
+        if value & averager_model.CONTROL_RESET or (
+            running and channel not in self._averagers
+        ):
+            settings = averager_model.Settings.from_registers(self._sandbox, channel)
+            self._averagers[channel] = averager_model.Averager(settings)
+            self._update_averager_registers(channel)
+        if not running:
+            self._averagers.pop(channel, None)
+
+    def _update_averager_registers(self, channel):
+        averager = self._averagers[channel]
+        self._sandbox[f"PC_CH{channel}_Triggers"] = averager.triggers
+        self._sandbox[f"PC_CH{channel}_Averages"] = averager.outputs
+        self._sandbox[f"PC_CH{channel}_Status"] = averager.status
+
+    def _capture(self, nDAQ):
+        daq = self.daqs[nDAQ]
+        if not daq.running or (daq.cycles > 0 and daq.captured >= daq.cycles):
+            return
+        averager = self._averagers.get(nDAQ)
+        if averager is None:
+            frames = self._noise(daq.points)[np.newaxis]
+        else:
+            # The DAQ gets the averaged frames, once every 2^Log2Averages
+            frames = averager.push(self._noise(averager.settings.raw_samples()))
+            self._update_averager_registers(nDAQ)
+            if len(frames) == 0:
+                return
+        with daq.ready:
+            daq.data = np.concatenate([daq.data, frames.ravel()])
+            daq.captured += len(frames)
+            daq.ready.notify_all()
+
+    def _noise(self, points):
+        return self._rng.integers(-self.NOISE, self.NOISE, points, dtype=np.int16)
+
+    def _hvi_action(self, action):
+        channel = int(action[3])
+        if action.endswith("_trigger"):
+            self._capture(channel)
+        elif action.endswith("_start"):
+            self.daqs[channel].running = True
+        elif action.endswith("_stop"):
+            self.daqs[channel].running = False
+
+
+def _averaged_channels(image_file):
+    """The channels with a frame averager in FPGA image <image_file>"""
+    if not image_file:
+        return []
+    # QuadLO gives the driver Windows paths
+    registers = k7z_index.register_map(image_file.replace("\\", "/"))
+    return averager_model.channels(registers or [])
@@ -0,0 +1,401 @@
+"""
+Frequency, phase and amplitude sweeps run by the HVI.
+
+Sweeping by writing a config per point and rerunning QuadLO pays for opening
+the modules, loading the FPGA images and compiling the HVI at every point. A
+sweep instead precomputes the LO register values of every point (see
+lo_encoding) and builds one HVI sequence that steps through them: for each
+point the swept AWG writes the point's values to its LO registers, then fires
+NumberOfLoops triggers. The whole sweep is compiled and
+loaded once, and each capture is tagged with the point it was taken at.
+
+A frequency_range() sweep runs in one HVI loop that adds a fixed step to the
+frequency registers, so its sequence does not grow with the number of
+frequencies. Sweeps of explicit frequency lists are unrolled, a block and a
+loop per point, and are refused if that makes the sequence larger than
+MAX_ENGINE_STATEMENTS.
+
+    python sweep.py [config] [start Hz] [stop Hz] [points]
+"""
+
+import sys
+import time
+import logging
+import itertools
+from dataclasses import dataclass, field
+from typing import List
+
+import numpy as np
+
+import hvi_ir
+import hvi_wrap as hvi
+import completion
+import telemetry
+import instrument
+import hvi_topology
+import lo_encoding
+import validate
+
+log = logging.getLogger(__name__)
+
+# Statements an unrolled sweep may give one HVI engine, kept well under the
+# engine's instruction memory
+MAX_ENGINE_STATEMENTS = 4096
+
+
+@dataclass
+class SweepSpec:
+    """
+    The points of a sweep: every combination of <frequencies> (Hz), <phases>
+    (degrees) and <amplitudes> (fraction of full scale), frequency outermost.
+    """
+
+    frequencies: List[float]
+    phases: List[float] = field(default_factory=lambda: [0.0])
+    amplitudes: List[float] = field(default_factory=lambda: [0.25])
+    # The AWG whose LOs are swept (default: the lead AWG)
+    module: str = None
+    # Evenly spaced frequencies, stepped by the HVI in one loop
+    stepped: bool = False
+
+    @classmethod
+    def frequency_range(cls, start, stop, count, **kwargs):
+        """A sweep of <count> frequencies from <start> to <stop> Hz"""
+        return cls(list(np.linspace(start, stop, count)), stepped=True, **kwargs)
+
+
+@dataclass
+class SweepPoint:
+    index: int
+    frequency: float
+    phase: float
+    amplitude: float
+    # LO register values
+    a: int
+    b: int
+    i: int
+    q: int
+    phase_code: int
+    amplitude_code: int
+
+
+def points(spec, sample_rate=1e9):
+    """Returns the SweepPoints of <spec>, with their register values"""
+    grid = list(itertools.product(spec.frequencies, spec.phases, spec.amplitudes))
+    if not grid:
+        return []
+    frequencies, phases, amplitudes = (np.array(c, dtype=float) for c in zip(*grid))
+    if spec.stepped:
+        # The values the HVI reaches by adding the step
+        a, b = frequency_steps(spec, sample_rate)[0]
+        repeats = len(spec.phases) * len(spec.amplitudes)
+        a, b = np.repeat(a, repeats), np.repeat(b, repeats)
+    else:
+        a, b = lo_encoding.encode_frequency(frequencies, sample_rate)
+    i, q = lo_encoding.encode_iq(phases)
+    phase_codes = lo_encoding.encode_phase(phases)
+    amplitude_codes = lo_encoding.encode_amplitude(amplitudes)
+    codes = zip(
+        a.tolist(),
+        b.tolist(),
+        i.tolist(),
+        q.tolist(),
+        phase_codes.tolist(),
+        amplitude_codes.tolist(),
+    )
+    return [
+        SweepPoint(index, *point, *point_codes)
+        for index, (point, point_codes) in enumerate(zip(grid, codes))
+    ]
+
+
+def frequency_steps(spec, sample_rate=1e9):
+    """
+    Returns the A and B registers of each frequency of stepped <spec>, as
+    int64 arrays, and the A and B steps between them (0 <= B step <
+    FRACTION_STEPS). Stepping accumulates exactly, without drift.
+    """
+    a, b = lo_encoding.encode_frequency(
+        [spec.frequencies[0], spec.frequencies[-1]], sample_rate
+    )
+    # Phase increments as a whole number of B steps
+    first, last = (a * lo_encoding.FRACTION_STEPS + b).tolist()
+    count = len(spec.frequencies)
+    step = round((last - first) / (count - 1)) if count > 1 else 0
+    totals = first + step * np.arange(count, dtype=np.int64)
+    codes = np.divmod(totals, lo_encoding.FRACTION_STEPS)
+    return codes, divmod(step, lo_encoding.FRACTION_STEPS)
+
+
+def configure_hvi(config, spec):
+    """Defines the HVI sequence that runs every point of <spec>"""
+    topology = hvi_topology.from_config(config)
+    lead = topology.lead
+    awg = config.get_module(spec.module or lead)
+    table = points(spec, awg.sample_rate)
+    loop_count = config.hvi.get_constant("NumberOfLoops")
+    gap = config.hvi.get_constant("Gap")
+
+    hvi_topology.define_system(config, topology, "Sweep HVI")
+    hvi.parameter(lead, "NumberOfLoops", loop_count)
+    hvi.parameter(lead, "LoopsRemaining", 0)
+    hvi.parameter(lead, "PointCounter", 0)
+
+    hvi.start_sync_multi_sequence_block("Initialize", delay=30)
+    for module in topology.phase_resets:
+        hvi.writeFpgaRegister(
+            "deassert LO Phase Reset", module, hvi_topology.PHASE_RESET, 0b0000
+        )
+    hvi.end_sync_multi_sequence_block()
+
+    if spec.stepped:
+        _stepped_points(config, spec, topology, awg, table)
+    else:
+        for point in table:
+            _set_point(topology, awg, point)
+            _trigger_loop(topology, f"Point {point.index} Loop", gap)
+
+    hvi.start_sync_multi_sequence_block("Sweep Done", delay=30)
+    hvi.set_register("Set Point", lead, "PointCounter", len(table))
+    hvi.set_register("Clear Loop Counter", lead, "LoopCounter", 0)
+    hvi.end_sync_multi_sequence_block()
+    counts = hvi_ir.statement_counts(hvi.program)
+    module = max(counts, key=counts.get)
+    if counts[module] > MAX_ENGINE_STATEMENTS:
+        raise ValueError(
+            f"The sweep of {len(table)} points needs {counts[module]} HVI "
+            f"statements in {module}, above {MAX_ENGINE_STATEMENTS}: sweep a "
+            f"SweepSpec.frequency_range(), or fewer points"
+        )
+    log.info(f"SEQUENCER - CREATED for {len(table)} points")
+    log.debug(hvi.show_sequencer())
+    return table
+
+
+def _set_point(topology, awg, point):
+    """The block that writes <point>'s values to the LO registers of <awg>"""
+    lead = topology.lead
+    channels = [queue.channel for queue in awg.queues]
+    hvi.start_sync_multi_sequence_block(f"Point {point.index}", delay=30)
+    hvi.set_register("Set Point", lead, "PointCounter", point.index)
+    hvi.set_register("Clear Loop Counter", lead, "LoopCounter", 0)
+    hvi.set_register("Reload Loops", lead, "LoopsRemaining", "NumberOfLoops")
+    for channel in channels:
+        hvi.writeFpgaRegister(
+            f"Set CH{channel} LO0A",
+            awg.name,
+            f"HVI_CH{channel}_PhaseInc0A",
+            point.a,
+        )
+        hvi.writeFpgaRegister(
+            f"Set CH{channel} LO0B",
+            awg.name,
+            f"HVI_CH{channel}_PhaseInc0B",
+            point.b,
+        )
+    hvi.delay("Wait for register", awg.name, 60)
+    _set_phase_amplitude(awg, channels, point)
+    hvi_topology.reset_phases(topology, deassert_first=False)
+    hvi.end_sync_multi_sequence_block()
+
+
+def _set_phase_amplitude(awg, channels, point):
+    for channel in channels:
+        hvi.writeFpgaRegister(
+            f"Set CH{channel} LO Phase",
+            awg.name,
+            f"HVI_CH{channel}_Phase0",
+            point.phase_code,
+        )
+        hvi.writeFpgaRegister(
+            f"Set CH{channel} LO Amplitude",
+            awg.name,
+            f"HVI_CH{channel}_Amplitude0",
+            point.amplitude_code,
+        )
+
+
+def _trigger_loop(topology, name, gap):
+    """The loop that fires NumberOfLoops triggers"""
+    lead = topology.lead
+    hvi.start_syncWhile_register(
+        name, lead, "LoopsRemaining", "GREATER_THAN", 0, delay=70
+    )
+    hvi.start_sync_multi_sequence_block("Trigger All", delay=260)
+    hvi_topology.trigger_all(topology, "Trigger All")
+    hvi.incrementRegister("Increment loop counter", lead, "LoopCounter")
+    hvi.addToRegister("Count down loops", lead, "LoopsRemaining", -1)
+    hvi.delay("Wait Gap time", lead, gap)
+    hvi.end_sync_multi_sequence_block()
+    hvi.end_syncWhile()
+
+
+def _stepped_points(config, spec, topology, awg, table):
+    """
+    One loop over the frequencies of <spec>, adding the frequency step to
+    <awg>'s FrequencyA and FrequencyB registers (carrying from B to A) after
+    each; the phases and amplitudes of a frequency are unrolled in the loop
+    """
+    lead = topology.lead
+    channels = [queue.channel for queue in awg.queues]
+    (a, b), (step_a, step_b) = frequency_steps(spec, awg.sample_rate)
+    gap = config.hvi.get_constant("Gap")
+    hvi.parameter(lead, "FrequenciesRemaining", len(spec.frequencies))
+    hvi.parameter(awg.name, "FrequencyA", int(a[0]))
+    hvi.parameter(awg.name, "FrequencyB", int(b[0]))
+    hvi.parameter(awg.name, "FrequencyStepA", step_a)
+    hvi.parameter(awg.name, "FrequencyStepB", step_b)
+
+    hvi.start_syncWhile_register(
+        "Frequency Loop", lead, "FrequenciesRemaining", "GREATER_THAN", 0, delay=70
+    )
+    # The points of one frequency
+    for point in table[: len(spec.phases) * len(spec.amplitudes)]:
+        name = f"Frequency Point {point.index}"
+        hvi.start_sync_multi_sequence_block(name, delay=30)
+        hvi.set_register("Clear Loop Counter", lead, "LoopCounter", 0)
+        hvi.set_register("Reload Loops", lead, "LoopsRemaining", "NumberOfLoops")
+        for channel in channels:
+            hvi.writeFpgaRegister(
+                f"Set CH{channel} LO0A",
+                awg.name,
+                f"HVI_CH{channel}_PhaseInc0A",
+                "FrequencyA",
+            )
+            hvi.writeFpgaRegister(
+                f"Set CH{channel} LO0B",
+                awg.name,
+                f"HVI_CH{channel}_PhaseInc0B",
+                "FrequencyB",
+            )
+        hvi.delay("Wait for register", awg.name, 60)
+        _set_phase_amplitude(awg, channels, point)
+        hvi_topology.reset_phases(topology, deassert_first=False)
+        hvi.end_sync_multi_sequence_block()
+
+        _trigger_loop(topology, f"{name} Loop", gap)
+
+        hvi.start_sync_multi_sequence_block(f"{name} Done", delay=30)
+        hvi.incrementRegister("Next Point", lead, "PointCounter")
+        hvi.set_register("Clear Loop Counter", lead, "LoopCounter", 0)
+        hvi.end_sync_multi_sequence_block()
+
+    hvi.start_sync_multi_sequence_block("Next Frequency", delay=30)
+    hvi.addToRegister("Step A", awg.name, "FrequencyA", "FrequencyStepA")
+    hvi.addToRegister("Step B", awg.name, "FrequencyB", "FrequencyStepB")
+    hvi.if_register_comparison(
+        "Carry",
+        awg.name,
+        "FrequencyB",
+        "GREATER_THAN_OR_EQUAL_TO",
+        lo_encoding.FRACTION_STEPS,
+    )
+    hvi.addToRegister("Carry B", awg.name, "FrequencyB", -lo_encoding.FRACTION_STEPS)
+    hvi.incrementRegister("Carry A", awg.name, "FrequencyA")
+    hvi.end_if(awg.name)
+    hvi.addToRegister("Count down frequencies", lead, "FrequenciesRemaining", -1)
+    hvi.end_sync_multi_sequence_block()
+    hvi.end_syncWhile()
+
+
+def check_status(config, table, timeout=None, progress=None):
+    """Waits until the trigger of every point has been issued"""
+    loop_count = config.hvi.get_constant("NumberOfLoops")
+    expected = len(table) * loop_count
+    if timeout is None:
+        timeout = 2 * expected * config.hvi.get_constant("Gap") * 1e-9 + 1.0
+
+    def triggers_issued(values):
+        return values["points"] * loop_count + values["loops"]
+
+    lead = hvi_topology.from_config(config).lead
+    sources = {
+        "points": completion.hvi_counter(lead, "PointCounter"),
+        "loops": completion.hvi_counter(lead, "LoopCounter"),
+    }
+    with telemetry.TelemetryPoller(sources) as poller:
+        complete = completion.wait_for(
+            lambda: poller.value(triggers_issued),
+            expected,
+            timeout,
+            progress,
+            name="Sweep triggers",
+        )
+        rate = poller.rate(triggers_issued, window=timeout)
+    if rate is not None:
+        log.info(f"Trigger rate: {rate:.0f} triggers/s")
+    return complete
+
+
+def tag(data, table, loops):
+    """
+    Splits captured <data> ({digitizer: [array per DAQ]}, one capture per row)
+    by sweep point: returns [(SweepPoint, {digitizer: [array per DAQ]})]
+    """
+    tagged = []
+    for point in table:
+        rows = slice(point.index * loops, (point.index + 1) * loops)
+        tagged.append(
+            (point, {name: [daq[rows] for daq in daqs] for name, daqs in data.items()})
+        )
+    return tagged
+
+
+def run(configName, spec):
+    """
+    Runs the sweep <spec> with the modules of <configName>, returns the
+    captures tagged by point (see tag())
+    """
+    import QuadLO
+
+    start = time.perf_counter()
+    config = QuadLO.load(configName)
+    loops = config.hvi.get_constant("NumberOfLoops")
+    count = len(spec.frequencies) * len(spec.phases) * len(spec.amplitudes)
+    for module in config.modules:
+        if hasattr(module, "daqs"):
+            for daq in module.daqs:
+                daq.captureCount = count * loops
+    # The sweep runs its own HVI sequence, not the config's
+    validate.check(config, timing=False)
+    with instrument.phase("configure"):
+        QuadLO.configureModules()
+    try:
+        with instrument.phase("configure_hvi"):
+            # Raises ValueError if the sequence would be too large
+            table = configure_hvi(config, spec)
+        with instrument.phase("start"):
+            hvi.start()
+        with instrument.phase("status"):
+            check_status(config, table)
+        with instrument.phase("readout"):
+            data = {}
+            for module in config.modules:
+                if module.model == "M3102A":
+                    data[module.name] = [
+                        np.array(captures)
+                        for captures in QuadLO.getDigDataRaw(module)
+                    ]
+    finally:
+        # The modules are closed and restored, also after a failure
+        with instrument.phase("close"):
+            if hvi.hvi_handle is not None:
+                hvi.close()
+            QuadLO.closeModules()
+        instrument.report()
+    log.info(f"Swept {len(table)} points in {time.perf_counter() - start:.3f}s")
+    return tag(data, table, loops)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    configName = sys.argv[1] if len(sys.argv) > 1 else "latest"
+    if len(sys.argv) > 4:
+        spec = SweepSpec.frequency_range(
+            float(sys.argv[2]), float(sys.argv[3]), int(sys.argv[4])
+        )
+    else:
+        spec = SweepSpec.frequency_range(10e6, 50e6, 5)
+    for point, data in run(configName, spec):
+        shapes = {name: [d.shape for d in daqs] for name, daqs in data.items()}
+        log.info(f"Point {point.index}: {point.frequency / 1e6:.3f} MHz {shapes}")
@@ -0,0 +1,142 @@
+"""
+Samples HVI runtime registers and FPGA sandbox registers during a run.
+
+A TelemetryPoller reads a chosen set of registers at a fixed rate on a
+background thread and keeps the timestamped samples in a ring buffer. The
+register handles are resolved once, when the sources are created, so a sample
+costs one driver read per register. Progress and rate (e.g. triggers/s) are
+derived from the buffered samples, without touching the hardware:
+
+    sources = {
+        "loops": completion.hvi_counter("AWG_LEAD", "LoopCounter"),
+        "triggers": completion.sandbox_counter(handle, "PC_CH1_Triggers"),
+    }
+    with TelemetryPoller(sources, rate=200) as poller:
+        ...
+        log.info(f"{poller.rate('triggers'):.0f} triggers/s")
+"""
+
+import time
+import logging
+import threading
+from collections import deque
+from dataclasses import dataclass
+from typing import Dict
+
+log = logging.getLogger(__name__)
+
+
+@dataclass
+class Sample:
+    # time.perf_counter() when the sample was taken
+    time: float
+    # {source name: value}
+    values: Dict[str, int]
+
+
+class TelemetryPoller:
+    """
+    Reads <sources> every 1/<rate> seconds, keeping the last <capacity>
+    samples.
+
+    sources : {name: function returning the register's value}
+    """
+
+    def __init__(self, sources, rate=100.0, capacity=4096):
+        self.sources = dict(sources)
+        self.interval = 1.0 / rate
+        self.buffer = deque(maxlen=capacity)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self.sample()
+        self._thread = threading.Thread(
+            target=self._poll, name="telemetry", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def sample(self):
+        """Reads every source now, returns the Sample"""
+        values = {name: read() for name, read in self.sources.items()}
+        sample = Sample(time.perf_counter(), values)
+        with self._lock:
+            self.buffer.append(sample)
+        return sample
+
+    def samples(self, window=None):
+        """Returns the buffered samples, or those of the last <window> seconds"""
+        with self._lock:
+            samples = list(self.buffer)
+        if window is not None and samples:
+            since = samples[-1].time - window
+            samples = [s for s in samples if s.time >= since]
+        return samples
+
+    def latest(self):
+        with self._lock:
+            return self.buffer[-1] if self.buffer else None
+
+    def value(self, key):
+        """
+        Latest value of <key>: a source name, or a function of a sample's
+        values (e.g. to combine nested loop counters). None before any sample.
+        """
+        sample = self.latest()
+        return None if sample is None else _evaluate(key, sample)
+
+    def progress(self, key, expected, start=0):
+        """Fraction of the way from <start> to <expected> that <key> has gone"""
+        value = self.value(key)
+        if value is None or expected == start:
+            return None
+        return (value - start) / (expected - start)
+
+    def rate(self, key, window=1.0):
+        """
+        Change of <key> per second over the last <window> seconds (counting
+        down gives a positive rate too). None until two samples differ in time.
+        """
+        samples = self.samples(window)
+        if len(samples) < 2 or samples[-1].time == samples[0].time:
+            return None
+        change = _evaluate(key, samples[-1]) - _evaluate(key, samples[0])
+        return abs(change) / (samples[-1].time - samples[0].time)
+
+    def _poll(self):
+        next_time = time.perf_counter() + self.interval
+        while not self._stop.wait(max(next_time - time.perf_counter(), 0)):
+            try:
+                self.sample()
+            except Exception as err:
+                log.error(f"Telemetry stopped, cannot read registers: {err}")
+                return
+            next_time += self.interval
+            # Skip the samples missed while the host was busy
+            now = time.perf_counter()
+            if next_time < now:
+                next_time = now + self.interval
+
+
+def _evaluate(key, sample):
+    if callable(key):
+        return key(sample.values)
+    return sample.values[key]
@@ -0,0 +1,12 @@
+"""
+The tests run on the simulated drivers (see drivers.py), without a chassis,
+and with the simulated latencies switched off.
+"""
+
+import os
+import sys
+
+os.environ["HVI_SIMULATE"] = "1"
+os.environ["SIM_TIME_SCALE"] = "0"
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
@@ -0,0 +1,129 @@
+import logging
+
+import numpy as np
+import pytest
+
+import awg_queue
+from drivers import key
+from Configuration import (
+    AwgDescriptor,
+    Fpga,
+    PulseDescriptor,
+    Queue,
+    QueueItem,
+    SubPulseDescriptor,
+)
+
+
+@pytest.fixture(autouse=True)
+def fresh_state():
+    awg_queue._compiled.clear()
+    awg_queue._armed.clear()
+    awg_queue._reloaded.clear()
+
+
+def queue(channel=1, cycles=1):
+    return Queue(
+        channel, True, [QueueItem(1, True, 0, cycles), QueueItem(2, True, 1e-6, 1)]
+    )
+
+
+def awg(queues, slot=2):
+    pulses = [
+        PulseDescriptor(id, 10e-6, [SubPulseDescriptor(0, 1e-6, 0, 1, 1e6)])
+        for id in (1, 2)
+    ]
+    module = AwgDescriptor("AWG_0", "M3202A", 4, 1e9, slot, Fpga(), [], pulses, queues)
+    open_handle(module)
+    return module
+
+
+def open_handle(module):
+    module.handle = key.SD_AOU()
+    module.handle.openWithSlotCompatibility(
+        "", module.chassis, module.slot, key.SD_Compatibility.KEYSIGHT
+    )
+    for pulse in module.pulseDescriptors:
+        wave = key.SD_Wave()
+        wave.newFromArrayDouble(key.SD_WaveformTypes.WAVE_ANALOG, np.zeros(100))
+        module.handle.waveformLoad(wave, pulse.id)
+
+
+def queued(module, channel=1):
+    """The waveform ids in the (simulated) hardware queue of <channel>"""
+    return [entry[0] for entry in module.handle.queues[channel]]
+
+
+@pytest.fixture
+def arm(caplog):
+    """arm(module) arms the queues of <module>, returns what was done to each"""
+
+    def arm(module):
+        caplog.clear()
+        with caplog.at_level(logging.INFO, logger="awg_queue"):
+            awg_queue.arm_queues(module)
+        return [record.getMessage().split()[0] for record in caplog.records]
+
+    return arm
+
+
+def test_identical_queue_is_rearmed(arm):
+    module = awg([queue(1), queue(3)])
+    assert arm(module) == ["Programmed", "Programmed"]
+    assert arm(module) == ["Re-armed", "Re-armed"]
+    assert queued(module, 1) == [1, 2]
+    assert module.handle.running[1]
+
+
+def test_changed_queue_is_flushed_and_programmed(arm):
+    module = awg([queue(1)])
+    arm(module)
+    module.queues = [queue(1, cycles=5)]
+    assert arm(module) == ["Programmed"]
+    assert queued(module, 1) == [1, 2]
+    assert module.handle.queues[1][0][3] == 5
+
+
+def test_reloaded_waveforms_are_queued_again(arm):
+    module = awg([queue(1)])
+    arm(module)
+    awg_queue.waveforms_reloaded(module)
+    assert arm(module) == ["Programmed"]
+    assert queued(module, 1) == [1, 2]
+
+
+def test_armed_tables_follow_the_slot_not_the_handle(arm):
+    module = awg([queue(1)])
+    arm(module)
+    other = awg([queue(1)], slot=3)
+    assert arm(other) == ["Programmed"]
+    # Closed and opened again: the module's queues are unknown
+    module.handle.close()
+    awg_queue.forget(module.chassis, module.slot)
+    open_handle(module)
+    assert arm(module) == ["Programmed"]
+    assert arm(other) == ["Re-armed"]
+
+
+def test_compiled_tables_are_shared_and_bounded(monkeypatch):
+    monkeypatch.setattr(awg_queue, "MAX_COMPILED", 3)
+    first = awg_queue.compile_queue(queue(1))
+    assert awg_queue.compile_queue(queue(1)) is first
+    for cycles in range(2, 10):
+        awg_queue.compile_queue(queue(1, cycles))
+    assert len(awg_queue._compiled) == 3
+    assert awg_queue.compile_queue(queue(1)) == first
+
+
+def test_invalid_queue_lists_every_problem():
+    bad = Queue(9, False, [QueueItem(7, True, -1.0, 70000)])
+    with pytest.raises(ValueError) as error:
+        awg_queue.compile_queue(bad, resident_ids={1, 2}, channels=4)
+    message = str(error.value)
+    for problem in (
+        "Channel 9 does not exist",
+        "waveform ID 7",
+        "start time",
+        "cycles",
+    ):
+        assert problem in message
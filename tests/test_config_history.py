@@ -0,0 +1,86 @@
+import os
+
+import pytest
+
+import config_history
+import Configuration
+from Configuration import (
+    Config,
+    DaqDescriptor,
+    DigDescriptor,
+    Fpga,
+    Hvi,
+    HviConstant,
+    Register,
+)
+
+
+def config(loops=5):
+    dig = DigDescriptor(
+        "DIG_0",
+        "M3102A",
+        4,
+        500e6,
+        7,
+        Fpga(),
+        [Register("Gain", 3)],
+        [DaqDescriptor(1, 100e-6, 10, True)],
+    )
+    return Config(
+        [dig], Hvi("hvi_quad_lo", [dig], [HviConstant("NumberOfLoops", loops)])
+    )
+
+
+def yaml_files(directory):
+    return sorted(f for f in os.listdir(directory) if not f.endswith(".sqlite"))
+
+
+def test_identical_configs_share_a_file(tmp_path):
+    with config_history.ConfigHistory(str(tmp_path)) as history:
+        first = history.save(config())
+        second = history.save(config())
+        other = history.save(config(loops=6))
+    assert (first.number, second.number, other.number) == (1, 2, 3)
+    assert second.file == first.file
+    assert second.sha1 == first.sha1
+    assert other.file != first.file
+    assert yaml_files(tmp_path) == ["config_1.yaml", "config_3.yaml"]
+    assert Configuration.loadConfig(second.file).hvi.get_constant("NumberOfLoops") == 5
+
+
+def test_batch_deduplicates_within_itself(tmp_path):
+    dumped = [config_history.dump(c) for c in (config(), config(6), config())]
+    with config_history.ConfigHistory(str(tmp_path)) as history:
+        entries = history.save_dumped(dumped)
+        assert history.latest() == entries[-1]
+    assert [os.path.basename(e.file) for e in entries] == [
+        "config_1.yaml",
+        "config_2.yaml",
+        "config_1.yaml",
+    ]
+    assert yaml_files(tmp_path) == ["config_1.yaml", "config_2.yaml"]
+
+
+def test_find(tmp_path):
+    with config_history.ConfigHistory(str(tmp_path)) as history:
+        history.save_dumped([config_history.dump(config(n)) for n in (5, 6, 5)])
+        found = history.find(module="DIG_0", parameter="NumberOfLoops", value=5)
+        assert [e.number for e in found] == [1, 3]
+        assert [e.number for e in history.find(parameter="DIG_0.Gain")] == [1, 2, 3]
+        assert history.find(module="DIG_1") == []
+
+
+def test_failed_save_leaves_no_file(tmp_path):
+    broken = config_history.Dumped(None, "0" * 40)
+    with config_history.ConfigHistory(str(tmp_path)) as history:
+        with pytest.raises(TypeError):
+            history.save_dumped([config_history.dump(config()), broken])
+        assert history.latest() is None
+    assert yaml_files(tmp_path) == []
+
+
+def test_existing_directory_is_indexed(tmp_path):
+    with config_history.ConfigHistory(str(tmp_path)) as history:
+        history.save_dumped([config_history.dump(config(n)) for n in (5, 6)])
+    os.remove(os.path.join(str(tmp_path), config_history.INDEX_FILE))
+    assert config_history.latest_file(str(tmp_path)).endswith("config_2.yaml")
@@ -0,0 +1,69 @@
+import hvi_ir
+import hvi_opt
+
+
+def instruction(operation, delay=hvi_opt.MIN_INSTRUCTION_DELAY, **operands):
+    return hvi_ir.Instruction(operation, "AWG_0", operation, operands, delay)
+
+
+def step(operation, value):
+    return instruction(
+        operation, destination="R", left_operand="R", right_operand=value
+    )
+
+
+def listing(statements):
+    return [(s.operation, s.operands) for s in statements]
+
+
+def test_assign_then_steps_fold_into_one_assign():
+    folded = hvi_opt._optimize_local(
+        [
+            instruction("assign", destination="R", source=5),
+            step("subtract", 2),
+            step("add", 1),
+        ]
+    )
+    assert listing(folded) == [("assign", {"destination": "R", "source": 4})]
+
+
+def test_steps_fold_into_one_step():
+    folded = hvi_opt._optimize_local([step("add", 1), step("subtract", 4)])
+    assert listing(folded) == [
+        ("subtract", {"destination": "R", "left_operand": "R", "right_operand": 3})
+    ]
+
+
+def test_overwritten_result_is_dropped():
+    folded = hvi_opt._optimize_local(
+        [step("add", 1), instruction("assign", destination="R", source=7)]
+    )
+    assert listing(folded) == [("assign", {"destination": "R", "source": 7})]
+
+
+def test_register_reads_are_not_folded():
+    statements = [
+        instruction("fpga_register_read", destination="R", fpga_register="X"),
+        instruction("assign", destination="R", source=1),
+    ]
+    assert len(hvi_opt._optimize_local(statements)) == 2
+
+
+def test_steps_by_a_register_are_not_folded():
+    statements = [instruction("assign", destination="R", source=0), step("add", "S")]
+    assert len(hvi_opt._optimize_local(statements)) == 2
+
+
+def test_delayed_statements_are_not_folded():
+    statements = [
+        instruction("assign", destination="R", source=0),
+        instruction(
+            "add", delay=50, destination="R", left_operand="R", right_operand=1
+        ),
+    ]
+    assert len(hvi_opt._optimize_local(statements)) == 2
+
+
+def test_unknown_rate():
+    assert hvi_opt._rate(None) == "unknown rate"
+    assert hvi_opt._rate(1000) == "1000.00 kHz"
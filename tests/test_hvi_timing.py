@@ -0,0 +1,118 @@
+import hvi_ir
+import hvi_timing
+from Configuration import (
+    AwgDescriptor,
+    Config,
+    Fpga,
+    Hvi,
+    HviConstant,
+    PulseDescriptor,
+    Queue,
+    QueueItem,
+    SubPulseDescriptor,
+)
+
+
+def instruction(name, operation, **operands):
+    return hvi_ir.Instruction(name, "AWG_0", operation, operands, 10)
+
+
+def block(name, *statements):
+    return hvi_ir.SyncBlock(name, 30, {"AWG_0": list(statements)})
+
+
+def loop(name, register, comparison, value, *statements):
+    return hvi_ir.SyncWhile(
+        name, "AWG_0", register, comparison, value, 70, list(statements)
+    )
+
+
+def program(count_source):
+    """
+    Three iterations of a loop that triggers AWG_0 and then runs an inner
+    loop <count_source> times (a number, or read from the FPGA if None)
+    """
+    if count_source is None:
+        count = instruction("Read Count", "fpga_register_read", destination="Count")
+    else:
+        count = instruction("Set Count", "assign", destination="Count", source=10)
+    p = hvi_ir.Program("Test", [hvi_ir.ModuleDescriptor("AWG_0")])
+    p.add_register("AWG_0", "Outer", 0)
+    p.add_register("AWG_0", "Count", 0)
+    p.statements = [
+        loop(
+            "Outer Loop",
+            "Outer",
+            "LESS_THAN",
+            3,
+            block(
+                "Trigger",
+                instruction("Trigger", "action_execute", action=["awg1_trigger"]),
+                instruction(
+                    "Next",
+                    "add",
+                    destination="Outer",
+                    left_operand="Outer",
+                    right_operand=1,
+                ),
+                count,
+            ),
+            loop(
+                "Inner Loop",
+                "Count",
+                "GREATER_THAN",
+                0,
+                block(
+                    "Count Down",
+                    instruction(
+                        "Down",
+                        "subtract",
+                        destination="Count",
+                        left_operand="Count",
+                        right_operand=1,
+                    ),
+                ),
+            ),
+        )
+    ]
+    return p
+
+
+def config():
+    pulse = PulseDescriptor(1, 10e-6, [SubPulseDescriptor(0, 1e-6, 0, 1, 1e6)])
+    queue = Queue(1, True, [QueueItem(1, True, 0, 1)])
+    awg = AwgDescriptor("AWG_0", "M3202A", 4, 1e9, 2, Fpga(), [], [pulse], [queue])
+    return Config([awg], Hvi("hvi_quad_lo", [awg], [HviConstant("Gap", 20000)]))
+
+
+def outer(report):
+    return next(l for l in report["loops"] if l["name"] == "Outer Loop")
+
+
+def test_known_loop_counts():
+    report = hvi_timing.analyze(program(10))
+    assert outer(report)["iterations"] == 3
+    assert outer(report)["period_ns"] is not None
+    assert report["actions"] == {"AWG_0": {"awg1_trigger": 3}}
+
+
+def test_unknown_loop_count_is_reported():
+    report = hvi_timing.analyze(program(None))
+    inner = next(l for l in report["loops"] if l["name"] == "Inner Loop")
+    assert inner["iterations"] is None
+    assert outer(report)["period_ns"] is None
+    assert outer(report)["rate_hz"] is None
+    assert any("Inner Loop" in warning for warning in report["warnings"])
+
+
+def test_check_warns_on_unknown_period():
+    warnings = hvi_timing.check(hvi_timing.analyze(program(None)), config())
+    assert "Cannot tell how often loop 'Outer Loop' triggers AWG_0" in warnings
+
+
+def test_check_compares_known_period_with_pulses():
+    warnings = hvi_timing.check(hvi_timing.analyze(program(10)), config())
+    assert warnings == [
+        "Loop 'Outer Loop' triggers AWG_0 every 770 ns, before its pulse 1 pri "
+        "(10000 ns) has finished"
+    ]
@@ -0,0 +1,60 @@
+import math
+
+import numpy as np
+
+import lo_encoding
+
+
+# The registers as the configurators computed them, one frequency at a time
+def A(f, fs=1e9):
+    S = 5
+    T = 8
+    K = (f / fs) * (S / T) * 2 ** 25
+    A = int(K)
+    return A
+
+
+def B(f, fs=1e9):
+    S = 5
+    T = 8
+    K = (f / fs) * (S / T) * 2 ** 25
+    A = int(K)
+    B = round((K - A) * 5 ** 10)
+    return B
+
+
+def I(phase):
+    return int(round(32767 * math.cos(math.radians(phase))))
+
+
+def Q(phase):
+    return int(round(32767 * math.sin(math.radians(phase))))
+
+
+FREQUENCIES = [0, 1, 1e3, 10e6, 12.3456789e6, 100e6, 123456789.123, 250e6, 400e6]
+
+
+def test_frequencies_match_configurators():
+    for fs in (1e9, 500e6):
+        a, b = lo_encoding.encode_frequency(FREQUENCIES, fs)
+        assert list(a) == [A(f, fs) for f in FREQUENCIES]
+        assert list(b) == [B(f, fs) for f in FREQUENCIES]
+
+
+def test_random_frequencies_match_configurators():
+    frequencies = np.random.default_rng(1).uniform(0, 500e6, 1000)
+    a, b = lo_encoding.encode_frequency(frequencies)
+    assert list(a) == [A(f) for f in frequencies]
+    assert list(b) == [B(f) for f in frequencies]
+
+
+def test_frequency_round_trip():
+    error = lo_encoding.frequency_error(FREQUENCIES)
+    assert np.all(np.abs(error) <= lo_encoding.frequency_resolution() / 2 + 1e-9)
+
+
+def test_phases_match_configurators():
+    phases = [0, 1, 30, 45, 90, 135.5, 180, 270, 359.9, -45]
+    i, q = lo_encoding.encode_iq(phases)
+    assert list(i) == [I(p) for p in phases]
+    assert list(q) == [Q(p) for p in phases]
@@ -0,0 +1,281 @@
+"""
+Pre-flight checks of a Config, run before any module is opened.
+
+Mistakes in a config used to show up only once the FPGA images were loaded and
+the waveforms uploaded. validate() finds them beforehand, without hardware,
+and returns all of them at once:
+
+- module limits: channels, sample rate, AWG and digitizer memory,
+- pulses: sub-pulse amplitudes summing above full scale, a toa + width past
+  the pri, carriers above Nyquist, and the size of the waveforms QuadLO will
+  make from them (computed from the pulse parameters, without synthesis),
+- queues (see awg_queue.validate_queue()) and FPGA register names (see
+  k7z_index.validate()),
+- HVI timing: the HVI sequence is built, not compiled, and its timing checked
+  against the waveforms and captures (see hvi_timing.check()).
+
+    python validate.py [config]
+"""
+
+import sys
+import math
+import logging
+import importlib
+from dataclasses import dataclass
+
+import awg_queue
+import averager_model
+import hvi_topology
+import k7z_index
+
+log = logging.getLogger(__name__)
+
+
+@dataclass
+class ModelLimits:
+    channels: int
+    # Highest sample rate, in samples/s
+    sample_rate: float
+    # Waveform (AWG) or acquisition (digitizer) memory, in bytes
+    memory: int
+    bytes_per_sample: int = 2
+
+
+MODELS = {
+    "M3202A": ModelLimits(4, 1e9, 2 * 2 ** 30),
+    "M3102A": ModelLimits(4, 500e6, 2 * 2 ** 30),
+}
+# Sub-pulses of a pulse are interleaved, one per sample in INTERLEAVE
+INTERLEAVE = 5
+# HVI delays are counted in clock periods, in ns
+HVI_CLOCK_PERIOD = 10
+
+
+def validate(config, timing=True):
+    """
+    Returns the problems found in <config>, as a list of text (empty if
+    none). <timing> : also build the HVI sequence and check its timing.
+    """
+    problems = _check_modules(config)
+    for module in config.modules:
+        limits = MODELS.get(module.model)
+        if hasattr(module, "pulseDescriptors"):
+            problems += _check_awg(module, limits)
+        if hasattr(module, "daqs"):
+            problems += _check_digitizer(module, limits)
+    problems += k7z_index.validate(config)
+    problems += _check_hvi(config, timing)
+    return problems
+
+
+def check(config, timing=True):
+    """Validates <config>, raises ValueError listing every problem found"""
+    problems = validate(config, timing)
+    if problems:
+        raise ValueError("Invalid config:\n" + "\n".join(problems))
+
+
+def waveform_samples(descriptor, sample_rate):
+    """
+    Returns the number of samples QuadLO makes from PulseDescriptor
+    <descriptor> at <sample_rate>, or None if it cannot make them.
+    """
+    if not descriptor.pulses:
+        return None
+    if len(descriptor.pulses) == 1:
+        return _pulse_samples(descriptor.pulses[0], descriptor.pri, sample_rate)
+    lanes = [
+        _pulse_samples(pulse, descriptor.pri, sample_rate / INTERLEAVE)
+        for pulse in descriptor.pulses
+    ]
+    if None in lanes or len(set(lanes)) > 1:
+        return None
+    return lanes[0] * INTERLEAVE
+
+
+def _pulse_samples(pulse, pri, sample_rate):
+    """Length of the wave pulses.createPulse() returns"""
+    if pulse.bandwidth <= 0:
+        return None
+    # Drawn at 20x the sample rate...
+    super_rate = 20 * sample_rate
+    if pri == 0:
+        lead = int(0.45 / pulse.bandwidth * super_rate)
+        drawn = 2 * lead + int(pulse.width * super_rate)
+    else:
+        lead_out = int((pri - pulse.toa - pulse.width) * super_rate)
+        if lead_out < 0:
+            return None
+        drawn = int(pulse.toa * super_rate) + int(pulse.width * super_rate) + lead_out
+    # ...filtered by a gaussian sampled at 10x, trimmed by half its length...
+    sigma = 0.3 / pulse.bandwidth
+    kernel = math.ceil((3 * sigma - -3 * sigma) / (1 / (10 * sample_rate)))
+    filtered = drawn + kernel - 2 * (kernel // 2)
+    # ...then decimated by 20
+    return math.ceil(filtered / 20)
+
+
+def _check_modules(config):
+    problems = []
+    names = set()
+    slots = set()
+    for module in config.modules:
+        if module.name in names:
+            problems.append(f"{module.name}: more than one module has this name")
+        names.add(module.name)
+        place = (getattr(module, "chassis", 1), module.slot)
+        if place in slots:
+            problems.append(
+                f"{module.name}: chassis {place[0]} slot {place[1]} is used by "
+                f"another module"
+            )
+        slots.add(place)
+        limits = MODELS.get(module.model)
+        if limits is None:
+            continue
+        if module.channels > limits.channels:
+            problems.append(
+                f"{module.name}: {module.model} has {limits.channels} channels, "
+                f"not {module.channels}"
+            )
+        if module.sample_rate > limits.sample_rate:
+            problems.append(
+                f"{module.name}: sample rate {module.sample_rate:g} is above the "
+                f"{module.model}'s {limits.sample_rate:g}"
+            )
+    return problems
+
+
+def _check_awg(module, limits):
+    problems = []
+    ids = set()
+    total = 0
+    for descriptor in module.pulseDescriptors:
+        where = f"{module.name} pulse {descriptor.id}"
+        found = len(problems)
+        if descriptor.id in ids:
+            problems.append(f"{where}: another pulse has this id")
+        ids.add(descriptor.id)
+        if not descriptor.pulses:
+            problems.append(f"{where}: has no sub-pulses")
+            continue
+        if len(descriptor.pulses) > INTERLEAVE:
+            problems.append(
+                f"{where}: {len(descriptor.pulses)} sub-pulses, at most "
+                f"{INTERLEAVE} can be interleaved"
+            )
+        amplitude = sum(abs(pulse.amplitude) for pulse in descriptor.pulses)
+        if amplitude > 1.0:
+            problems.append(
+                f"{where}: sub-pulse amplitudes sum to {amplitude:g}, above 1.0"
+            )
+        for index, pulse in enumerate(descriptor.pulses):
+            if descriptor.pri and pulse.toa + pulse.width > descriptor.pri:
+                problems.append(
+                    f"{where} sub-pulse {index}: toa + width "
+                    f"({pulse.toa + pulse.width:g} s) is past the pri "
+                    f"({descriptor.pri:g} s)"
+                )
+            if pulse.bandwidth <= 0:
+                problems.append(f"{where} sub-pulse {index}: bandwidth must be > 0")
+            if abs(pulse.carrier) >= module.sample_rate / 2:
+                problems.append(
+                    f"{where} sub-pulse {index}: carrier {pulse.carrier:g} Hz is "
+                    f"above Nyquist ({module.sample_rate / 2:g} Hz)"
+                )
+        samples = waveform_samples(descriptor, module.sample_rate)
+        if samples is None:
+            if len(problems) == found:
+                problems.append(f"{where}: sub-pulses make waves of different lengths")
+            continue
+        total += samples
+    if limits is not None and total * limits.bytes_per_sample > limits.memory:
+        problems.append(
+            f"{module.name}: waveforms need "
+            f"{total * limits.bytes_per_sample / 2 ** 20:.0f} MiB, the "
+            f"{module.model} has {limits.memory / 2 ** 20:.0f} MiB"
+        )
+    for queue in module.queues:
+        problems += [
+            f"{module.name}: {problem}"
+            for problem in awg_queue.validate_queue(queue, ids, module.channels)
+        ]
+    return problems
+
+
+def _check_digitizer(module, limits):
+    problems = []
+    total = 0
+    for daq in module.daqs:
+        where = f"{module.name} DAQ {daq.channel}"
+        if not 1 <= daq.channel <= module.channels:
+            problems.append(f"{where}: channel does not exist")
+        points = int(round(daq.captureTime * module.sample_rate))
+        if points <= 0:
+            problems.append(f"{where}: captureTime {daq.captureTime:g} s is empty")
+        # 0 captures until the DAQ is stopped
+        if daq.captureCount < 0:
+            problems.append(f"{where}: captureCount must be >= 0")
+        total += max(points, 0) * max(daq.captureCount, 0)
+    for register in module.fpga.pc_registers:
+        if (
+            register.name.endswith("_Log2Averages")
+            and register.value > averager_model.MAX_LOG2_AVERAGES
+        ):
+            problems.append(
+                f"{module.name}: {register.name} above "
+                f"{averager_model.MAX_LOG2_AVERAGES} lets the averager's sums wrap"
+            )
+    if limits is not None and total * limits.bytes_per_sample > limits.memory:
+        problems.append(
+            f"{module.name}: captures need "
+            f"{total * limits.bytes_per_sample / 2 ** 20:.0f} MiB, the "
+            f"{module.model} has {limits.memory / 2 ** 20:.0f} MiB"
+        )
+    return problems
+
+
+def _check_hvi(config, timing):
+    problems = []
+    constants = {c.name: c.value for c in config.hvi.constants}
+    gap = constants.get("Gap")
+    if gap is not None and gap % HVI_CLOCK_PERIOD:
+        problems.append(
+            f"Gap ({gap} ns) is not a multiple of the HVI clock period "
+            f"({HVI_CLOCK_PERIOD} ns)"
+        )
+    lines = config.hvi.triggers
+    if lines is not None:
+        if not lines:
+            problems.append("Hvi.triggers leaves the HVI no PXI trigger line")
+        unknown = sorted(set(lines) - set(hvi_topology.PXI_TRIGGERS))
+        if unknown:
+            problems.append(f"Hvi.triggers: no PXI trigger lines {unknown}")
+        if len(set(lines)) != len(lines):
+            problems.append(f"Hvi.triggers lists a line more than once: {lines}")
+    if not timing:
+        return problems
+    import hvi_wrap
+    import hvi_timing
+
+    try:
+        sequence = importlib.import_module(config.hvi.hviFile)
+        sequence.configure_hvi(config)
+    except Exception as err:
+        problems.append(f"HVI {config.hvi.hviFile} cannot be built: {err!r}")
+        return problems
+    # Only the problems of the config, not those of the analysis
+    report = hvi_timing.analyze(hvi_wrap.program)
+    problems += hvi_timing.check(report, config)
+    return problems
+
+
+if __name__ == "__main__":
+    import Configuration
+
+    config = Configuration.loadConfig(sys.argv[1] if len(sys.argv) > 1 else "latest")
+    problems = validate(config)
+    for problem in problems:
+        log.error(problem)
+    log.info(f"{len(problems)} problems found")
+    sys.exit(1 if problems else 0)